@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+
+
+class KgVisualizeConfig(AppConfig):
+    name = 'backend.apps.kg_visualize'
+    label = 'kg_visualize'
+
+    def ready(self):
+        # 注册实体/关系写入的信号处理（版本号等派生状态）
+        from . import signals  # noqa: F401
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+图谱变更日志与增量同步
+
+实体/关系的每次插入、更新、删除都会追加一条 GraphChange 记录（见 signals.py
+与 versioning.record_write），seq 单调递增。客户端记住已同步到的 seq，
+之后调用 /api/kg/changes?since=<seq> 只获取这之后变化的对象，
+刷新开销与修改量成正比，而不是与图谱规模成正比。
+
+客户端应在加载完整图谱「之前」先取得当前 seq（不带 since 调用），
+这样加载期间发生的修改会在下一次增量同步中重放。
+
+seq 在插入时分配，而不是在提交时。为了让 last_seq 之前不会再出现新提交的记录，
+变更日志只在 versioning._flush() 中写入，且写入前先在同一事务里更新 all 领域的
+版本记录：该行的写锁持有到事务提交，并发的写事务在这里排队，seq 的分配顺序
+因此与提交顺序一致（SQLite 的写事务本身就是串行的）。保证：读到 seq 为 N 的
+记录时，seq 小于 N 的记录都已提交或已回滚（回滚留下的空号不会再出现）。
+
+以下情况需要客户端整体重新加载（full_reload）：
+- since 之前的日志已被清理（prune）；
+- 区间内出现 reset（清空数据、数据模式整体保存）；
+- 区间内的变更条数超过 KG_CHANGES_MAX_ROWS。
+"""
+from django.conf import settings
+from django.db.models import Max, Min, Q
+
+from .models import Entity, GraphChange, Relationship
+from .streaming import LINK_FIELDS, NODE_FIELDS, link_to_d3, node_to_d3
+from .versioning import ALL_DOMAINS
+
+
+def append(changes, resets=()):
+    """
+    批量写入变更记录。
+
+    changes 为 (domain, kind, object_id, op) 列表；resets 中的领域只写一条
+    reset 记录，其逐行记录被丢弃（reset 了 all 时丢弃全部逐行记录）。
+    """
+    resets = set(resets)
+    if ALL_DOMAINS in resets:
+        changes = []
+        resets = {ALL_DOMAINS}
+    rows = [
+        GraphChange(domain=domain, kind=kind, object_id=str(object_id), op=op)
+        for domain, kind, object_id, op in changes
+        if domain not in resets
+    ]
+    rows.extend(
+        GraphChange(domain=domain, kind=GraphChange.KIND_DOMAIN, object_id="", op=GraphChange.OP_RESET)
+        for domain in sorted(resets)
+    )
+    if rows:
+        GraphChange.objects.bulk_create(rows, batch_size=1000)
+
+
+def head_seq():
+    """已提交的最大 seq；按模块说明中的保证，此后提交的记录 seq 都更大"""
+    return GraphChange.objects.aggregate(head=Max("seq"))["head"] or 0
+
+
+def prune(keep):
+    """只保留最新的 keep 条记录（至少保留最新一条，以便判断 since 是否已被清理）"""
+    keep = max(keep, 1)
+    cutoff = GraphChange.objects.order_by("-seq").values_list("seq", flat=True)[keep - 1:keep].first()
+    if cutoff is None:
+        return 0
+    deleted, _ = GraphChange.objects.filter(seq__lt=cutoff).delete()
+    return deleted
+
+
+def _full_reload(since, head):
+    return {"full_reload": True, "since": since, "last_seq": head}
+
+
+def compact(rows):
+    """
+    合并同一对象的多条变更，返回 {kind: (upserted_ids, deleted_ids)}。
+
+    先插入后删除的对象对客户端不可见，直接丢弃。
+    """
+    first_op, last_op = {}, {}
+    for kind, object_id, op in rows:
+        key = (kind, object_id)
+        first_op.setdefault(key, op)
+        last_op[key] = op
+
+    result = {GraphChange.KIND_ENTITY: ([], []), GraphChange.KIND_RELATIONSHIP: ([], [])}
+    for key, op in last_op.items():
+        kind, object_id = key
+        if kind not in result:
+            continue
+        upserted, deleted = result[kind]
+        if op == GraphChange.OP_DELETE:
+            if first_op[key] != GraphChange.OP_INSERT:
+                deleted.append(object_id)
+        else:
+            upserted.append(object_id)
+    return result
+
+
+def changes_since(since, domain=ALL_DOMAINS):
+    """计算 since 之后（不含）的压缩增量"""
+    head = head_seq()
+    if since > head:
+        # 客户端的 seq 来自另一份数据（例如数据库被重建）
+        return _full_reload(since, head)
+    if since == head:
+        return _empty_delta(since, head)
+
+    oldest = GraphChange.objects.aggregate(oldest=Min("seq"))["oldest"] or 0
+    if since < oldest - 1:
+        return _full_reload(since, head)
+
+    qs = GraphChange.objects.filter(seq__gt=since, seq__lte=head)
+    if domain != ALL_DOMAINS:
+        qs = qs.filter(Q(domain=domain) | Q(domain=ALL_DOMAINS, op=GraphChange.OP_RESET))
+
+    limit = getattr(settings, "KG_CHANGES_MAX_ROWS", 50000)
+    rows = list(qs.order_by("seq").values_list("kind", "object_id", "op")[:limit + 1])
+    if len(rows) > limit or any(op == GraphChange.OP_RESET for _, _, op in rows):
+        return _full_reload(since, head)
+
+    compacted = compact(rows)
+    entity_ids, deleted_entities = compacted[GraphChange.KIND_ENTITY]
+    rel_ids, deleted_rels = compacted[GraphChange.KIND_RELATIONSHIP]
+
+    entities = _fetch(Entity.objects.all(), entity_ids, NODE_FIELDS, domain)
+    relations = _fetch(Relationship.objects.all(), [int(i) for i in rel_ids], LINK_FIELDS, domain)
+    # 已不存在（或已移出该领域）的对象按删除处理
+    found_entities = {e["id"] for e in entities}
+    found_rels = {str(r["id"]) for r in relations}
+    deleted_entities += [i for i in entity_ids if i not in found_entities]
+    deleted_rels += [i for i in rel_ids if i not in found_rels]
+
+    return {
+        "full_reload": False,
+        "since": since,
+        "last_seq": head,
+        "entities": {"upserted": [node_to_d3(e) for e in entities], "deleted": deleted_entities},
+        "relationships": {
+            "upserted": [link_to_d3(r) for r in relations],
+            "deleted": [int(i) for i in deleted_rels],
+        },
+    }
+
+
+def _empty_delta(since, head):
+    return {
+        "full_reload": False,
+        "since": since,
+        "last_seq": head,
+        "entities": {"upserted": [], "deleted": []},
+        "relationships": {"upserted": [], "deleted": []},
+    }
+
+
+def _fetch(queryset, ids, fields, domain, chunk=500):
+    if domain != ALL_DOMAINS:
+        queryset = queryset.filter(domain=domain)
+    rows = []
+    for start in range(0, len(ids), chunk):
+        rows.extend(queryset.filter(pk__in=ids[start:start + chunk]).order_by().values(*fields))
+    return rows
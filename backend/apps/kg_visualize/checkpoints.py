@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+可续传的分块导入
+
+import_kg_data 顺序流式导入时，每个批次在自己的事务中提交，同一事务内更新该次导入的
+ImportCheckpoint（阶段、文件、字节偏移、批次号、累计统计），并把该批次新增的
+原 ID -> 新 ID 映射写入一条 ImportMappingChunk。大文件的导入因此不再占用一个
+数小时的事务和它持有的锁。
+
+进程中断后用 --resume 重新执行同一命令：读取未完成的检查点，按批次顺序回放映射，
+从最后提交的批次之后继续读取。已提交的批次不会重复导入，未提交的批次随事务整体回滚。
+"""
+import hashlib
+import json
+import os
+
+from django.utils import timezone
+
+from .importer import new_stats
+from .models import ImportCheckpoint, ImportMappingChunk
+
+PHASES = (ImportCheckpoint.PHASE_NODES, ImportCheckpoint.PHASE_LINKS)
+
+
+class CheckpointError(Exception):
+    """没有可续传的检查点，或输入文件在中断后被修改"""
+
+
+class MappingLog(dict):
+    """ID 映射，记录自上次 take_changes() 以来的改动（删除记为新 ID 为 None）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changes = []
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changes.append([key, value])
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changes.append([key, None])
+
+    def take_changes(self):
+        changes, self._changes = self._changes, []
+        return changes
+
+
+def _import_key(shards, domain, strategy, conflict_resolution):
+    payload = [[os.path.abspath(shard.path), shard.format, shard.kind] for shard in shards]
+    payload.append([domain, strategy, conflict_resolution])
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+def _file_info(shards):
+    # 大小与修改时间用于在续传时发现被改动过的文件（此时记录的偏移已经没有意义）
+    info = []
+    for shard in shards:
+        stat = os.stat(shard.path)
+        info.append([os.path.abspath(shard.path), shard.format, shard.kind, stat.st_size, stat.st_mtime_ns])
+    return info
+
+
+def start(shards, domain, strategy, conflict_resolution):
+    """
+    为一次新的导入创建检查点，返回 (检查点, 被丢弃的检查点数)。
+    相同输入与选项此前未完成的检查点会被丢弃。
+    """
+    key = _import_key(shards, domain, strategy, conflict_resolution)
+    unfinished = ImportCheckpoint.objects.filter(key=key, finished_at__isnull=True)
+    discarded = unfinished.count()
+    if discarded:
+        unfinished.delete()
+    checkpoint = ImportCheckpoint.objects.create(
+        key=key,
+        domain=domain,
+        files=json.dumps(_file_info(shards)),
+        file=shards[0].path if shards else "",
+        stats=json.dumps(new_stats()),
+    )
+    return checkpoint, discarded
+
+
+def find_resumable(shards, domain, strategy, conflict_resolution):
+    """返回相同输入与选项最近一次未完成的导入的检查点"""
+    key = _import_key(shards, domain, strategy, conflict_resolution)
+    checkpoint = ImportCheckpoint.objects.filter(key=key, finished_at__isnull=True).order_by("-updated_at").first()
+    if checkpoint is None:
+        raise CheckpointError("No unfinished import of these files with these options to resume")
+    if json.loads(checkpoint.files) != _file_info(shards):
+        raise CheckpointError("Input files changed since the interrupted import; run it again without --resume")
+    return checkpoint
+
+
+def restore(checkpoint, importer):
+    """把检查点记录的累计统计与 ID 映射交给 importer，之后的映射改动记录在 MappingLog 中"""
+    mapping = MappingLog()
+    chunks = checkpoint.mapping_chunks.order_by("chunk").values_list("mapping", flat=True)
+    for changes in chunks.iterator():
+        for original, new_id in json.loads(changes):
+            if new_id is None:
+                dict.pop(mapping, original, None)
+            else:
+                dict.__setitem__(mapping, original, new_id)
+    importer.restore(json.loads(checkpoint.stats), mapping)
+
+
+def save(checkpoint, importer, phase, shard, offset, path):
+    """
+    记录一个已导入的批次，需要在写入该批次的事务中调用。
+    phase / shard / offset 为下一批次的读取位置，offset 为 0 表示从文件开头读取。
+    """
+    checkpoint.chunk += 1
+    changes = importer.entity_id_mapping.take_changes()
+    if changes:
+        ImportMappingChunk.objects.create(checkpoint=checkpoint, chunk=checkpoint.chunk, mapping=json.dumps(changes))
+    checkpoint.phase = phase
+    checkpoint.shard = shard
+    checkpoint.offset = offset
+    checkpoint.file = path
+    # 冲突明细随批次输出，不保存
+    checkpoint.stats = json.dumps({**importer.stats, "conflicts": []})
+    checkpoint.save()
+
+
+def finish(checkpoint):
+    """标记导入完成，映射明细不再需要"""
+    checkpoint.mapping_chunks.all().delete()
+    checkpoint.finished_at = timezone.now()
+    checkpoint.save(update_fields=["finished_at", "updated_at"])
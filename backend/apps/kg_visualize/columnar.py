@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+列式（columnar）图谱数据格式
+
+D3 格式中每条连线都重复实体 ID 字符串，每个节点/连线都重复 type、domain。
+列式格式：
+- 节点按列存放为并行数组；
+- type/domain 字典编码为小字符串表，列中只存下标；
+- 连线的 source/target 为节点数组下标。若端点不在本次返回的节点中
+  （跨领域关系），以负数 -(k + 1) 表示 external_ids[k]。
+
+    {
+      "node_types": [...], "relation_types": [...], "domains": [...],
+      "external_ids": [...],
+      "nodes": {"id": [...], "name": [...], "type": [...], "description": [...], "domain": [...]},
+      "links": {"id": [...], "source": [...], "target": [...], "type": [...],
+                "description": [...], "domain": [...]}
+    }
+"""
+from .models import Entity, Relationship
+from .streaming import get_chunk_size
+
+
+class StringTable:
+    """字符串字典编码"""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def encode(self, value):
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+def build_columnar(domain):
+    entities = Entity.objects.all()
+    relations = Relationship.objects.all()
+    if domain != "all":
+        entities = entities.filter(domain=domain)
+        relations = relations.filter(domain=domain)
+    chunk_size = get_chunk_size()
+
+    node_types, relation_types, domains, external = StringTable(), StringTable(), StringTable(), StringTable()
+    nodes = {"id": [], "name": [], "type": [], "description": [], "domain": []}
+    node_index = {}
+    rows = entities.order_by().values_list("id", "name", "type", "description", "domain")
+    for entity_id, name, type_, description, entity_domain in rows.iterator(chunk_size=chunk_size):
+        node_index[entity_id] = len(nodes["id"])
+        nodes["id"].append(entity_id)
+        nodes["name"].append(name)
+        nodes["type"].append(node_types.encode(type_ or ""))
+        nodes["description"].append(description or "")
+        nodes["domain"].append(domains.encode(entity_domain or "default"))
+
+    def endpoint(entity_id):
+        index = node_index.get(entity_id)
+        if index is None:
+            return -(external.encode(entity_id) + 1)
+        return index
+
+    links = {"id": [], "source": [], "target": [], "type": [], "description": [], "domain": []}
+    rows = relations.order_by().values_list("id", "source_id", "target_id", "type", "description", "domain")
+    for rel_id, source_id, target_id, type_, description, rel_domain in rows.iterator(chunk_size=chunk_size):
+        links["id"].append(rel_id)
+        links["source"].append(endpoint(source_id))
+        links["target"].append(endpoint(target_id))
+        links["type"].append(relation_types.encode(type_))
+        links["description"].append(description or "")
+        links["domain"].append(domains.encode(rel_domain or "default"))
+
+    return {
+        "node_types": node_types.values,
+        "relation_types": relation_types.values,
+        "domains": domains.values,
+        "external_ids": external.values,
+        "nodes": nodes,
+        "links": links,
+    }
+
+
+def columnar_to_d3(data):
+    """列式数据还原为 D3 格式（测试与客户端参考实现）"""
+    node_ids = data["nodes"]["id"]
+
+    def resolve(index):
+        return node_ids[index] if index >= 0 else data["external_ids"][-index - 1]
+
+    nodes = [
+        {
+            "id": node_ids[i],
+            "name": data["nodes"]["name"][i],
+            "type": data["node_types"][data["nodes"]["type"][i]],
+            "description": data["nodes"]["description"][i],
+            "domain": data["domains"][data["nodes"]["domain"][i]],
+        }
+        for i in range(len(node_ids))
+    ]
+    links = [
+        {
+            "source": resolve(data["links"]["source"][i]),
+            "target": resolve(data["links"]["target"][i]),
+            "type": data["relation_types"][data["links"]["type"][i]],
+            "description": data["links"]["description"][i],
+            "id": data["links"]["id"][i],
+            "domain": data["domains"][data["links"]["domain"][i]],
+        }
+        for i in range(len(data["links"]["id"]))
+    ]
+    return {"nodes": nodes, "links": links}
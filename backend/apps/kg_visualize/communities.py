@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+社区发现与多层次（LOD）超级节点聚合
+
+缩小查看数万节点的领域时，逐个节点渲染既看不清也传输不起。这里用
+标签传播（label propagation）对 Relationship 构成的无向图做社区划分，
+再把每层社区收缩为一个超级节点、在收缩后的加权图上继续传播，得到多层结构：
+
+- 第 1 层：实体 -> 社区；
+- 第 k 层：第 k-1 层社区 -> 更大的社区，直到社区数不再明显减少。
+
+结果按领域版本号持久化到 GraphCommunities（与 GraphLayout 相同的缓存方式，大领域
+过期时由后台任务重新计算），
+/api/kg/data?lod=N 返回第 N 层的超级节点（成员数）及社区间的聚合连线权重，
+lod=N&cluster=C 下钻返回社区 C 在下一层的内容（N=1 时为原始实体与关系）。
+"""
+import json
+
+import numpy as np
+from django.conf import settings
+
+from . import jobs
+from .layout import graph_arrays
+from .models import Entity, GraphCommunities, Relationship
+from .streaming import LINK_FIELDS, NODE_FIELDS, link_to_d3, node_to_d3
+from .versioning import get_version
+
+# 最多聚合的层数；快照缓存按层数预先登记格式名（见 graph_cache.FORMATS）
+MAX_LEVELS = 4
+# 社区数减少不到该比例时停止继续聚合
+MIN_SHRINK = 0.05
+
+
+def label_propagation(n, sources, targets, weights=None, self_weights=None, iterations=30, seed=0):
+    """
+    加权标签传播，返回按社区规模从大到小重新编号的标签数组。
+
+    每轮随机选一半节点（半同步更新，避免二分结构上来回振荡），
+    改为邻居中权重之和最大的标签；self_weights 为节点自身标签的票数
+    （收缩后的超级节点内部连线权重），平局随机打破。
+    """
+    labels = np.arange(n, dtype=np.int64)
+    if n == 0 or not len(sources):
+        return labels
+    weights = np.ones(len(sources)) if weights is None else np.asarray(weights, dtype=np.float64)
+    u = np.concatenate((sources, targets))
+    v = np.concatenate((targets, sources))
+    w = np.concatenate((weights, weights))
+    if self_weights is not None:
+        has_self = np.flatnonzero(self_weights)
+        u = np.concatenate((u, has_self))
+        v = np.concatenate((v, has_self))
+        w = np.concatenate((w, self_weights[has_self]))
+
+    rng = np.random.default_rng(seed)
+    for _ in range(iterations):
+        keys, inverse = np.unique(u * n + labels[v], return_inverse=True)
+        # 权重为整数计数，小于 1e-3 的噪声只用于打破平局
+        score = np.bincount(inverse, weights=w) + rng.random(len(keys)) * 1e-3
+        node, label = keys // n, keys % n
+        order = np.lexsort((-score, node))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = node[order][1:] != node[order][:-1]
+        best = labels.copy()
+        best[node[order][first]] = label[order][first]
+
+        changed = best != labels
+        if changed.sum() <= n * 0.001:
+            break
+        update = rng.random(n) < 0.5
+        labels[update] = best[update]
+
+    _, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    rank = np.empty(len(counts), dtype=np.int64)
+    rank[np.argsort(-counts, kind="stable")] = np.arange(len(counts))
+    return rank[inverse]
+
+
+def _contract(labels, k, sources, targets, weights, self_weights):
+    """把节点按 labels 收缩为 k 个超级节点，返回 (sources, targets, weights, self_weights)"""
+    ls, lt = labels[sources], labels[targets]
+    inner = ls == lt
+    self_weights = (np.bincount(labels, weights=self_weights, minlength=k)
+                    + np.bincount(ls[inner], weights=weights[inner], minlength=k))
+    a = np.minimum(ls[~inner], lt[~inner])
+    b = np.maximum(ls[~inner], lt[~inner])
+    keys, inverse = np.unique(a * k + b, return_inverse=True)
+    return keys // k, keys % k, np.bincount(inverse, weights=weights[~inner]), self_weights
+
+
+def detect_communities(n, sources, targets, max_levels=MAX_LEVELS):
+    """返回每层的成员关系数组（实体下标 -> 该层社区编号）"""
+    weights = np.ones(len(sources))
+    self_weights = np.zeros(n)
+    membership = np.arange(n, dtype=np.int64)
+    levels = []
+    size = n
+    for _ in range(max_levels):
+        labels = label_propagation(size, sources, targets, weights, self_weights)
+        k = int(labels.max()) + 1 if size else 0
+        if levels and k > size * (1 - MIN_SHRINK):
+            break
+        membership = labels[membership]
+        levels.append(membership)
+        if k <= 1:
+            break
+        sources, targets, weights, self_weights = _contract(labels, k, sources, targets, weights, self_weights)
+        size = k
+    return levels
+
+
+def compute_communities(domain):
+    """计算并保存领域的社区层次，返回 GraphCommunities"""
+    version = get_version(domain)
+    node_ids, sources, targets = graph_arrays(domain)
+    levels = detect_communities(len(node_ids), sources, targets)
+    memberships = np.concatenate(levels).astype(np.int32) if levels else np.zeros(0, dtype=np.int32)
+    communities, _ = GraphCommunities.objects.update_or_create(domain=domain, defaults={
+        "version": version,
+        "node_count": len(node_ids),
+        "level_count": len(levels),
+        "node_ids": json.dumps(node_ids, ensure_ascii=False),
+        "memberships": memberships.tobytes(),
+    })
+    return communities
+
+
+def get_communities(domain, version=None):
+    """
+    返回 (communities, stale)。version 为调用方已查询到的领域版本号。
+
+    结果落后于当前版本时，节点数不超过 KG_COMMUNITIES_MAX_SYNC_NODES 则就地重新计算；
+    更大的领域返回旧结果（可能为 None）并标记 stale，同时提交后台任务重新计算
+    （同一领域同时只有一个任务），也可由 compute_kg_communities 命令离线计算。
+    """
+    if version is None:
+        version = get_version(domain)
+    communities = GraphCommunities.objects.filter(domain=domain).first()
+    if communities is not None and communities.version == version:
+        return communities, False
+    entities = Entity.objects.all() if domain == "all" else Entity.objects.filter(domain=domain)
+    if entities.count() <= getattr(settings, "KG_COMMUNITIES_MAX_SYNC_NODES", 20000):
+        return compute_communities(domain), False
+    jobs.schedule_communities(domain)
+    return communities, True
+
+
+def cluster_id(level, cluster):
+    return f"cluster:{level}:{cluster}"
+
+
+def _super_graph(domain, node_ids, level, membership, keep=None):
+    """
+    第 level 层的超级节点与聚合连线；keep 为需要保留的社区编号集合（None 表示全部）。
+
+    超级节点以社区内连线最多的成员作为代表，name 取代表实体的名称。
+    """
+    _, sources, targets = graph_arrays(domain, node_ids)
+    membership = np.asarray(membership, dtype=np.int64)
+    k = int(membership.max()) + 1 if len(membership) else 0
+    sizes = np.bincount(membership, minlength=k)
+    degree = np.bincount(np.concatenate((sources, targets)), minlength=len(node_ids))
+    # 每个社区中度数最大的成员（同度数取下标最小者）
+    order = np.lexsort((-degree, membership))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = membership[order][1:] != membership[order][:-1]
+    representatives = dict(zip(membership[order][first].tolist(), order[first].tolist()))
+
+    clusters = range(k) if keep is None else sorted(keep)
+    rep_ids = [node_ids[representatives[c]] for c in clusters]
+    names = {}
+    for start in range(0, len(rep_ids), 500):
+        names.update(Entity.objects.filter(id__in=rep_ids[start:start + 500]).values_list("id", "name"))
+    nodes = [
+        {
+            "id": cluster_id(level, c),
+            "cluster": c,
+            "level": level,
+            "name": names.get(node_ids[representatives[c]], ""),
+            "representative": node_ids[representatives[c]],
+            "size": int(sizes[c]),
+            "domain": domain,
+        }
+        for c in clusters
+    ]
+
+    ls, lt = membership[sources], membership[targets]
+    between = ls != lt
+    if keep is not None:
+        selected = np.zeros(k, dtype=bool)
+        selected[list(keep)] = True
+        between &= selected[ls] & selected[lt]
+    a = np.minimum(ls[between], lt[between])
+    b = np.maximum(ls[between], lt[between])
+    keys, counts = np.unique(a * max(k, 1) + b, return_counts=True)
+    links = [
+        {"source": cluster_id(level, int(key // k)), "target": cluster_id(level, int(key % k)), "weight": int(count)}
+        for key, count in zip(keys, counts)
+    ]
+    return {"nodes": nodes, "links": links}
+
+
+def lod_graph(domain, level, communities):
+    """
+    communities（get_communities() 的结果，可能为 None）第 level 层（1 为最细）的
+    超级节点图，返回 (level, level_count, data)。
+
+    level 超过已有层数时使用最粗的一层。
+    """
+    levels = communities.levels() if communities is not None else []
+    if not levels:
+        return 0, 0, {"nodes": [], "links": []}
+    level = min(level, len(levels))
+    node_ids = json.loads(communities.node_ids)
+    return level, len(levels), _super_graph(domain, node_ids, level, levels[level - 1])
+
+
+def drill_down(domain, level, cluster, communities):
+    """
+    第 level 层社区 cluster 的下一层内容：level 为 1 时返回社区内的实体及其之间的关系，
+    否则返回第 level-1 层中属于该社区的超级节点及其间的聚合连线。
+    找不到该社区时返回 None。
+    """
+    levels = communities.levels() if communities is not None else []
+    if not 1 <= level <= len(levels):
+        return None
+    membership = np.asarray(levels[level - 1], dtype=np.int64)
+    members = np.flatnonzero(membership == cluster)
+    if not len(members):
+        return None
+    node_ids = json.loads(communities.node_ids)
+
+    if level > 1:
+        children = set(np.asarray(levels[level - 2])[members].tolist())
+        return _super_graph(domain, node_ids, level - 1, levels[level - 2], keep=children)
+
+    ids = [node_ids[i] for i in members]
+    member_set = set(ids)
+    nodes, links = [], []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        nodes.extend(node_to_d3(e) for e in Entity.objects.filter(id__in=chunk).order_by().values(*NODE_FIELDS))
+        relations = Relationship.objects.filter(source_id__in=chunk)
+        if domain != "all":
+            relations = relations.filter(domain=domain)
+        links.extend(
+            link_to_d3(r) for r in relations.order_by().values(*LINK_FIELDS)
+            if r["target_id"] in member_set
+        )
+    nodes.sort(key=lambda n: n["id"])
+    links.sort(key=lambda l: l["id"])
+    return {"nodes": nodes, "links": links}
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+流式导出（NDJSON / CSV / GraphML，可选 gzip）
+
+/api/kg/export 的 JSON 格式需要构造完整的响应（并放入快照缓存），最大的领域导出时
+占用数 GB 内存。这里用 values_list(...).iterator() 按块读取，边读边编码，每累计
+chunk_size 行输出一次，配合 StreamingHttpResponse 使用：内存占用只与块大小有关，
+文件头在读取数据之前就先输出。
+
+导出器按格式注册在 EXPORTERS 中，新增格式只需实现 header() / encode() / footer()：
+- ndjson：每行一个对象，实体、关系分开导出（table=entities / relationships），
+  字段与 import_kg_data --format ndjson 的输入一致；
+- csv：同上，首行为列名；
+- graphml：一个文档同时包含实体（node）与关系（edge）。
+"""
+import csv
+import io
+import json
+import re
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from .models import Entity, Relationship
+from .streaming import get_chunk_size
+
+TABLES = ("entities", "relationships")
+# 实体 / 关系的导出字段：(导出列名, 模型字段名)
+COLUMNS = {
+    "entities": (("id", "id"), ("name", "name"), ("type", "type"), ("description", "description"),
+                 ("domain", "domain")),
+    "relationships": (("id", "id"), ("source", "source_id"), ("target", "target_id"), ("type", "type"),
+                      ("description", "description"), ("domain", "domain")),
+}
+GZIP_LEVEL = 6
+# XML 1.0 不允许出现的控制字符
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+class ExportError(ValueError):
+    """导出参数不合法"""
+
+
+def _rows(table, domain, chunk_size):
+    model = Entity if table == "entities" else Relationship
+    queryset = model.objects.all()
+    if domain != "all":
+        queryset = queryset.filter(domain=domain)
+    fields = [field for _, field in COLUMNS[table]]
+    # 不排序，数据库按存储顺序返回，不需要先对整张表排序
+    return queryset.order_by().values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+class Exporter:
+    """
+    流式导出器基类。tables 为导出的表（按顺序），迭代实例得到 bytes 片段。
+    子类实现 encode(table, row) 返回一行编码后的文本，header() / footer() 返回文件首尾。
+    """
+    content_type = "application/octet-stream"
+    extension = ""
+    # 为 True 时实体与关系在一个文件中导出，否则一次只导出一张表
+    combined = False
+
+    def __init__(self, domain, table=None, chunk_size=None):
+        if self.combined:
+            self.tables = TABLES
+        elif table in TABLES:
+            self.tables = (table,)
+        else:
+            raise ExportError(f"table must be one of: {', '.join(TABLES)}")
+        self.domain = domain
+        self.chunk_size = chunk_size or get_chunk_size()
+
+    @property
+    def filename(self):
+        parts = ["kg", self.domain] + ([] if self.combined else list(self.tables))
+        return f"{'-'.join(parts)}.{self.extension}"
+
+    def header(self):
+        return ""
+
+    def footer(self):
+        return ""
+
+    def encode(self, table, row):
+        raise NotImplementedError
+
+    def __iter__(self):
+        header = self.header()
+        if header:
+            yield header.encode("utf-8")
+        for table in self.tables:
+            buf = []
+            for row in _rows(table, self.domain, self.chunk_size):
+                buf.append(self.encode(table, row))
+                if len(buf) >= self.chunk_size:
+                    yield "".join(buf).encode("utf-8")
+                    buf = []
+            if buf:
+                yield "".join(buf).encode("utf-8")
+        footer = self.footer()
+        if footer:
+            yield footer.encode("utf-8")
+
+
+class NDJSONExporter(Exporter):
+    content_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._names = [name for name, _ in COLUMNS[self.tables[0]]]
+
+    def encode(self, table, row):
+        return json.dumps(dict(zip(self._names, row)), ensure_ascii=False) + "\n"
+
+
+class CSVExporter(Exporter):
+    content_type = "text/csv; charset=utf-8"
+    extension = "csv"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf)
+
+    def _line(self, values):
+        self._buf.seek(0)
+        self._buf.truncate()
+        self._writer.writerow(values)
+        return self._buf.getvalue()
+
+    def header(self):
+        return self._line([name for name, _ in COLUMNS[self.tables[0]]])
+
+    def encode(self, table, row):
+        return self._line(row)
+
+
+def _xml_text(value):
+    return escape(_XML_INVALID.sub("", "" if value is None else str(value)))
+
+
+class GraphMLExporter(Exporter):
+    content_type = "application/graphml+xml; charset=utf-8"
+    extension = "graphml"
+    combined = True
+
+    # (GraphML 键 ID, 作用对象, 属性名)，与 COLUMNS 中的列对应
+    KEYS = (
+        ("n_name", "node", "name"), ("n_type", "node", "type"), ("n_description", "node", "description"),
+        ("n_domain", "node", "domain"),
+        ("e_type", "edge", "type"), ("e_description", "edge", "description"), ("e_domain", "edge", "domain"),
+    )
+
+    def header(self):
+        keys = "".join(
+            f'  <key id="{key}" for="{target}" attr.name="{name}" attr.type="string"/>\n'
+            for key, target, name in self.KEYS
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+            f"{keys}"
+            f'  <graph id={quoteattr(_XML_INVALID.sub("", self.domain))} edgedefault="directed">\n'
+        )
+
+    def footer(self):
+        return "  </graph>\n</graphml>\n"
+
+    def encode(self, table, row):
+        if table == "entities":
+            entity_id, name, entity_type, description, domain = row
+            return (
+                f"    <node id={quoteattr(_XML_INVALID.sub('', entity_id))}>"
+                f'<data key="n_name">{_xml_text(name)}</data>'
+                f'<data key="n_type">{_xml_text(entity_type)}</data>'
+                f'<data key="n_description">{_xml_text(description)}</data>'
+                f'<data key="n_domain">{_xml_text(domain)}</data></node>\n'
+            )
+        rel_id, source, target, rel_type, description, domain = row
+        return (
+            f'    <edge id="e{rel_id}" source={quoteattr(_XML_INVALID.sub("", source))} '
+            f'target={quoteattr(_XML_INVALID.sub("", target))}>'
+            f'<data key="e_type">{_xml_text(rel_type)}</data>'
+            f'<data key="e_description">{_xml_text(description)}</data>'
+            f'<data key="e_domain">{_xml_text(domain)}</data></edge>\n'
+        )
+
+
+EXPORTERS = {"ndjson": NDJSONExporter, "csv": CSVExporter, "graphml": GraphMLExporter}
+
+
+def gzip_stream(chunks, level=GZIP_LEVEL):
+    """
+    边读边 gzip 压缩。第一个片段之后做一次同步刷新，让客户端尽快收到数据
+    （否则 zlib 会缓冲到内部窗口写满才输出）。
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    first = True
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if first:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if out:
+            yield out
+    yield compressor.flush()
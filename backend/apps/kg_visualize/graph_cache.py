@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+图谱快照缓存
+
+按 (domain, format) 缓存已经序列化好的响应字节：
+- 进程内 LRU，命中时无需任何序列化；
+- Django 缓存后端（settings.KG_SNAPSHOT_CACHE_ALIAS），多个 worker 共享。
+
+每条缓存都记录生成时的领域版本号，读取时与当前版本比对，
+因此即使其它进程的写入没有通知到本进程，也不会返回过期数据。
+写入提交后由 versioning.graph_changed 信号触发 invalidate()，
+只清理受影响的领域和 all。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .versioning import ALL_DOMAINS
+
+# 所有会被缓存的表示格式，失效时逐一清理共享缓存中的键
+FORMATS = ("d3", "export", "columnar", "d3_layout", "columnar_layout", "lod1", "lod2", "lod3", "lod4")
+
+
+class GraphSnapshotCache:
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries or getattr(settings, "KG_SNAPSHOT_CACHE_ENTRIES", 32)
+        self.max_bytes = max_bytes or getattr(settings, "KG_SNAPSHOT_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[getattr(settings, "KG_SNAPSHOT_CACHE_ALIAS", "default")]
+
+    @staticmethod
+    def shared_key(domain, fmt):
+        # 领域名可能包含中文或空格，memcached 等后端不接受，统一做摘要
+        digest = hashlib.sha1(domain.encode("utf-8")).hexdigest()
+        return f"kg:snapshot:{digest}:{fmt}"
+
+    def get(self, domain, fmt, version):
+        key = (domain, fmt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                self._discard(key)
+
+        cached = self.shared.get(self.shared_key(domain, fmt))
+        if cached is not None and cached[0] == version:
+            self._store_local(key, version, cached[1])
+            return cached[1]
+        return None
+
+    def set(self, domain, fmt, version, data):
+        if len(data) > self.max_bytes:
+            return
+        self._store_local((domain, fmt), version, data)
+        self.shared.set(
+            self.shared_key(domain, fmt), (version, data),
+            getattr(settings, "KG_SNAPSHOT_CACHE_TIMEOUT", 3600)
+        )
+
+    def invalidate(self, domains):
+        """清理给定领域及 all 的所有格式"""
+        domains = set(domains) | {ALL_DOMAINS}
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in domains]:
+                self._discard(key)
+        self.shared.delete_many([self.shared_key(d, f) for d in domains for f in FORMATS])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _store_local(self, key, version, data):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (version, data)
+            self._size += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+
+snapshot_cache = GraphSnapshotCache()
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+内存中的邻接图引擎
+
+遍历、推荐、路径等接口需要 O(度数) 的邻居查询，而不是每次扫描关系表或客户端传来的
+links。每个领域一个 GraphEngine，首次使用时加载：
+
+- 基础部分是共享的图谱镜像（graph_image，各进程 mmap 同一份 CSR）：节点为整数编号，
+  出边 / 入边按关系类型分段；
+- 之后的写入记录在进程内的增量中：新实体追加编号（ID 驻留），新增 / 修改的关系按
+  关系 ID 记录端点与类型编号，删除的关系、实体记入删除集合。
+
+增量有两个来源，重复修补的结果相同：
+- 本进程的 Entity / Relationship save / delete 信号（signals.py），在事务提交后修补
+  已加载的引擎，写入立即可见；
+- 批量写入（不发送信号）与其它进程的写入：get_engine() 发现领域版本号变化时，从
+  变更日志（changefeed）读取上次同步之后的变更，按数据库中的当前值修补。
+日志已被清理、出现 reset（清空、快照恢复）或增量超过 KG_GRAPH_ENGINE_MAX_DELTA 时，
+改为加载当前版本的镜像。
+
+与镜像相同，只包含两端都在领域中的关系；事务中调用时不使用、也不更新缓存的引擎
+（事务中可能有未提交的写入）。
+"""
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from . import changefeed
+from .graph_image import DIRECTIONS, get_graph_image
+from .models import Entity, Relationship
+from .streaming import LINK_FIELDS, link_to_d3
+from .versioning import ALL_DOMAINS, get_version
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def get_max_delta():
+    return getattr(settings, "KG_GRAPH_ENGINE_MAX_DELTA", 50000)
+
+
+class GraphEngine:
+    """一个领域的邻接图：镜像 + 进程内增量"""
+
+    def __init__(self, image):
+        self.image = image
+        self.domain = image.domain
+        self.version = image.version
+        self.seq = image.seq
+        self.types = list(image.types)
+        self._type_codes = {name: code for code, name in enumerate(self.types)}
+        # 镜像之后新增的实体：ID -> 编号（从镜像节点数开始）
+        self._new_ids = {}
+        self._new_names = []
+        self._removed_nodes = set()
+        # 增量中的关系：关系 ID -> (起点编号, 终点编号, 类型编号)，以及各节点的增量关系
+        self._edges = {}
+        self._delta = {direction: defaultdict(list) for direction in DIRECTIONS}
+        # 镜像中已删除（或已被增量中的新值替代）的关系
+        self._removed = set()
+        self._filters = None
+        # 修补需要重新读取数据时置为 True，下次 get_engine() 改为加载镜像
+        self.stale = False
+        self._lock = threading.RLock()
+
+    @property
+    def node_count(self):
+        return self.image.node_count + len(self._new_names)
+
+    @property
+    def delta_size(self):
+        return len(self._edges) + len(self._removed) + len(self._new_names) + len(self._removed_nodes)
+
+    def index(self, entity_id):
+        """实体 ID 的节点编号，不在领域中时返回 None"""
+        i = self._new_ids.get(entity_id)
+        if i is None:
+            i = self.image.index(entity_id)
+        if i is None or i in self._removed_nodes:
+            return None
+        return i
+
+    def node_id(self, i):
+        base = self.image.node_count
+        return self.image.node_id(i) if i < base else self._new_names[i - base]
+
+    def type_code(self, name):
+        return self._type_codes.get(name)
+
+    def _filter_arrays(self):
+        if self._filters is None:
+            self._filters = (
+                np.fromiter(self._removed, dtype=np.int64, count=len(self._removed)),
+                np.fromiter(self._removed_nodes, dtype=np.int64, count=len(self._removed_nodes)),
+            )
+        return self._filters
+
+    def neighbors(self, node, direction="out", types=None):
+        """
+        节点在 direction（out / in）方向上的边：(另一端编号, 关系类型编号, 关系 ID) 三个数组。
+        types 为关系类型编号的集合，None 表示全部类型。代价与度数成正比。
+        """
+        with self._lock:
+            parts = []
+            if node < self.image.node_count:
+                if types is None:
+                    parts.append(self.image.neighbors(node, direction))
+                else:
+                    parts.extend(
+                        self.image.neighbors(node, direction, code)
+                        for code in sorted(types) if code < len(self.image.types)
+                    )
+            if parts and (self._removed or self._removed_nodes):
+                removed, removed_nodes = self._filter_arrays()
+                parts = [
+                    tuple(a[~(np.isin(rels, removed) | np.isin(others, removed_nodes))] for a in (others, codes, rels))
+                    for others, codes, rels in parts
+                ]
+            extra = []
+            for rel_id in self._delta[direction].get(node, ()):
+                source, target, code = self._edges[rel_id]
+                other = target if direction == "out" else source
+                if (types is None or code in types) and other not in self._removed_nodes:
+                    extra.append((other, code, rel_id))
+            if extra:
+                parts.append(tuple(np.array(column, dtype=np.int64) for column in zip(*extra)))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        if len(parts) == 1:
+            return parts[0]
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def expand(self, nodes, direction="out", types=None):
+        """
+        一组节点（编号数组）在 direction 方向上的全部边，整体用数组运算展开：
+        (起点编号, 另一端编号, 关系类型编号, 关系 ID) 四个数组。用于按层的广度优先遍历。
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        with self._lock:
+            base = nodes[nodes < self.image.node_count]
+            indptr = self.image.indptr[direction]
+            starts, ends = indptr[base], indptr[base + 1]
+            lengths = ends - starts
+            total = int(lengths.sum())
+            # 各节点 [start, end) 区间拼接后的位置
+            positions = np.arange(total, dtype=np.int64) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            origins = np.repeat(base, lengths)
+            others = self.image.indices[direction][positions].astype(np.int64)
+            codes = self.image.edge_type[direction][positions].astype(np.int64)
+            rels = self.image.edge_rel[direction][positions]
+            keep = None
+            if types is not None:
+                keep = np.isin(codes, np.fromiter(types, dtype=np.int64, count=len(types)))
+            if self._removed or self._removed_nodes:
+                removed, removed_nodes = self._filter_arrays()
+                alive = ~(np.isin(rels, removed) | np.isin(others, removed_nodes))
+                keep = alive if keep is None else keep & alive
+            columns = [origins, others, codes, rels]
+            if keep is not None:
+                columns = [column[keep] for column in columns]
+            delta = self._delta[direction]
+            if delta:
+                # 增量中的关系一般很少，逐条检查
+                extra = []
+                for node in delta.keys() & set(nodes.tolist()):
+                    for rel_id in delta[node]:
+                        source, target, code = self._edges[rel_id]
+                        other = target if direction == "out" else source
+                        if (types is None or code in types) and other not in self._removed_nodes:
+                            extra.append((node, other, code, rel_id))
+                if extra:
+                    columns = [
+                        np.concatenate([column, np.array(values, dtype=np.int64)])
+                        for column, values in zip(columns, zip(*extra))
+                    ]
+        return tuple(columns)
+
+    def degree(self, node, direction="out"):
+        return len(self.neighbors(node, direction)[0])
+
+    # 以下修补方法均为幂等操作，按对象的最终状态修补
+
+    def add_node(self, entity_id):
+        with self._lock:
+            i = self._new_ids.get(entity_id)
+            if i is None:
+                i = self.image.index(entity_id)
+            if i is None:
+                i = self._new_ids[entity_id] = self.node_count
+                self._new_names.append(entity_id)
+            elif i in self._removed_nodes:
+                self._removed_nodes.discard(i)
+                self._filters = None
+            return i
+
+    def remove_node(self, entity_id):
+        with self._lock:
+            i = self.index(entity_id)
+            if i is not None:
+                self._removed_nodes.add(i)
+                self._filters = None
+
+    def upsert_edge(self, rel_id, source_id, target_id, rel_type):
+        with self._lock:
+            self.remove_edge(rel_id)
+            source, target = self.index(source_id), self.index(target_id)
+            if source is None or target is None:
+                return  # 端点不在领域中（跨领域关系），不计入
+            code = self._type_codes.get(rel_type)
+            if code is None:
+                code = self._type_codes[rel_type] = len(self.types)
+                self.types.append(rel_type)
+            self._edges[rel_id] = (source, target, code)
+            self._delta["out"][source].append(rel_id)
+            self._delta["in"][target].append(rel_id)
+
+    def remove_edge(self, rel_id):
+        with self._lock:
+            edge = self._edges.pop(rel_id, None)
+            if edge is not None:
+                source, target, _ = edge
+                self._delta["out"][source].remove(rel_id)
+                self._delta["in"][target].remove(rel_id)
+            if rel_id not in self._removed:
+                self._removed.add(rel_id)
+                self._filters = None
+
+    def catch_up(self, version):
+        """
+        按变更日志修补到最新，version 为此前读取的领域版本号。
+        日志不足以修补（已清理、reset、变更过多）时返回 False。
+        """
+        delta = changefeed.changes_since(self.seq, self.domain)
+        if delta["full_reload"]:
+            return False
+        entities, relations = delta["entities"], delta["relationships"]
+        with self._lock:
+            for entity_id in entities["deleted"]:
+                self.remove_node(entity_id)
+            added = [e["id"] for e in entities["upserted"] if self.index(e["id"]) is None]
+            for entity_id in added:
+                self.add_node(entity_id)
+            for rel_id in relations["deleted"]:
+                self.remove_edge(rel_id)
+            # 从其它领域移入的实体，领域中原有的指向它的关系不在日志中
+            for link in relations["upserted"] + _links_touching(self.domain, added):
+                self.upsert_edge(link["id"], link["source"], link["target"], link["type"])
+            self.version = version
+            self.seq = delta["last_seq"]
+        return True
+
+
+def _links_touching(domain, entity_ids, chunk=500):
+    relations = Relationship.objects.all()
+    if domain != ALL_DOMAINS:
+        relations = relations.filter(domain=domain)
+    links = []
+    for start in range(0, len(entity_ids), chunk):
+        ids = entity_ids[start:start + chunk]
+        rows = relations.filter(Q(source_id__in=ids) | Q(target_id__in=ids)).order_by().values(*LINK_FIELDS)
+        links.extend(link_to_d3(r) for r in rows)
+    return links
+
+
+def get_engine(domain):
+    """返回领域的 GraphEngine（按需加载，领域版本号变化时先修补）"""
+    version = get_version(domain)
+    if connection.in_atomic_block:
+        return GraphEngine(get_graph_image(domain, version))
+    with _lock:
+        engine = _engines.get(domain)
+    if engine is not None and not engine.stale:
+        if engine.version == version:
+            return engine
+        max_delta = get_max_delta()
+        if engine.delta_size <= max_delta and engine.catch_up(version) and engine.delta_size <= max_delta:
+            return engine
+    engine = GraphEngine(get_graph_image(domain, version))
+    with _lock:
+        _engines[domain] = engine
+    return engine
+
+
+def _loaded(domains):
+    with _lock:
+        return [_engines[d] for d in {*domains, ALL_DOMAINS} if d and d in _engines]
+
+
+def _patch_on_commit(domains, patch):
+    """事务提交后对已加载的引擎执行 patch(engine, domain)；回滚时不修补"""
+    if not _loaded(domains):
+        return
+
+    def apply():
+        for engine in _loaded(domains):
+            patch(engine, engine.domain)
+
+    transaction.on_commit(apply)
+
+
+def entity_saved(entity_id, domain, old_domain):
+    moved = bool(old_domain) and old_domain != domain
+
+    def patch(engine, engine_domain):
+        if engine_domain == ALL_DOMAINS:
+            engine.add_node(entity_id)
+        elif engine_domain == domain:
+            if moved:
+                engine.stale = True  # 领域中原有的指向它的关系需要重新读取
+            else:
+                engine.add_node(entity_id)
+        elif engine_domain == old_domain:
+            engine.remove_node(entity_id)
+
+    _patch_on_commit((domain, old_domain), patch)
+
+
+def entity_deleted(entity_id, domain):
+    _patch_on_commit((domain,), lambda engine, _: engine.remove_node(entity_id))
+
+
+def relationship_saved(rel_id, source_id, target_id, rel_type, domain, old_domain):
+    def patch(engine, engine_domain):
+        if engine_domain in (ALL_DOMAINS, domain):
+            engine.upsert_edge(rel_id, source_id, target_id, rel_type)
+        else:
+            engine.remove_edge(rel_id)
+
+    _patch_on_commit((domain, old_domain), patch)
+
+
+def relationship_deleted(rel_id, domain):
+    _patch_on_commit((domain,), lambda engine, _: engine.remove_edge(rel_id))
+
+
+def clear():
+    with _lock:
+        _engines.clear()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+各进程共享的只读图谱镜像（CSR，mmap）
+
+多个 worker 进程各自在内存中构建同一个领域的图结构，既重复计算又占用 N 份内存。
+这里把领域的图结构按版本号写成一个文件（KG_GRAPH_IMAGE_DIR 下），各进程用 mmap
+只读映射为 NumPy 数组，不复制数据：同一主机上每个领域只有一份物理内存（页缓存）。
+
+- 节点为领域内的实体，按 ID（码点顺序，与 UTF-8 字节序一致）编号，ID 存为字符串表；
+- 边为领域内两端都在领域中的关系（与 layout.graph_arrays 相同，跨领域关系不计入）；
+- 出边、入边各一组 CSR：indptr、indices（另一端节点编号）、type（关系类型编号，
+  类型名在文件头中）、rel（关系 ID）。每个节点的边按 (类型, 另一端) 排序，
+  同一类型的边是连续的一段。
+
+文件格式：8 字节 MAGIC、8 字节文件头长度（小端）、JSON 文件头（领域、版本号、
+变更日志 seq、类型名、各数组的 dtype / 长度 / 偏移），之后是按 ALIGN 字节对齐的各数组。
+
+发布：get_graph_image() 发现没有当前版本的文件时，由同一主机上第一个需要它的进程
+在文件锁下构建并写入（临时文件 + os.replace），其它进程等待后直接映射；发布后删除
+该领域的旧版本文件（已映射旧文件的进程不受影响，下次访问时映射新文件）。
+在事务中调用时不发布：事务中可能有未提交的写入，回滚后同一版本号会对应不同的数据，
+此时只在内存中构建、不缓存。
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from . import changefeed
+from .models import Entity, Relationship
+from .streaming import get_chunk_size
+from .versioning import get_version, read_transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有文件锁，多个进程可能同时构建，os.replace 保证结果完整
+    fcntl = None
+
+MAGIC = b"KGIMAGE\x00"
+FORMAT_VERSION = 2
+ALIGN = 64
+DIRECTIONS = ("out", "in")
+
+_images = {}
+_lock = threading.Lock()
+
+
+def get_image_dir():
+    return getattr(settings, "KG_GRAPH_IMAGE_DIR", os.path.join(settings.BASE_DIR, "graph_images"))
+
+
+class GraphImage:
+    """
+    从 buffer（mmap 或 bytes）读取的图谱镜像，数组均为只读视图。
+
+    node_count、edge_count、types（关系类型名，按编号）、domain、version、
+    seq（构建时变更日志的最新 seq，与数据一致）；
+    indptr / indices / edge_type / edge_rel 为 {"out": 数组, "in": 数组}。
+    """
+
+    def __init__(self, buffer):
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a graph image")
+        (length,) = struct.unpack_from("<Q", buffer, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(buffer[start:start + length]).decode("utf-8"))
+        if header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported graph image version {header['format_version']}")
+        self.buffer = buffer
+        self.domain = header["domain"]
+        self.version = header["version"]
+        self.seq = header["seq"]
+        self.types = header["types"]
+        self._type_codes = {name: code for code, name in enumerate(self.types)}
+        arrays = {
+            name: np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            for name, (dtype, count, offset) in header["arrays"].items()
+        }
+        self._ids = arrays["ids"]
+        self._id_offsets = arrays["id_offsets"]
+        self.node_count = len(self._id_offsets) - 1
+        self.edge_count = len(arrays["out_indices"])
+        self.indptr = {d: arrays[f"{d}_indptr"] for d in DIRECTIONS}
+        self.indices = {d: arrays[f"{d}_indices"] for d in DIRECTIONS}
+        self.edge_type = {d: arrays[f"{d}_type"] for d in DIRECTIONS}
+        self.edge_rel = {d: arrays[f"{d}_rel"] for d in DIRECTIONS}
+
+    def _id_bytes(self, i):
+        return self._ids[self._id_offsets[i]:self._id_offsets[i + 1]].tobytes()
+
+    def node_id(self, i):
+        return self._id_bytes(i).decode("utf-8")
+
+    def node_ids(self):
+        offsets = self._id_offsets.tolist()
+        data = self._ids.tobytes()
+        return [data[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+    def index(self, entity_id):
+        """实体 ID 的节点编号（二分查找字符串表），不在领域中时返回 None"""
+        key = entity_id.encode("utf-8")
+        lo, hi = 0, self.node_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.node_count and self._id_bytes(lo) == key:
+            return lo
+        return None
+
+    def type_code(self, name):
+        return self._type_codes.get(name)
+
+    def neighbors(self, i, direction="out", type_code=None):
+        """节点 i 在 direction 方向上的边：(另一端节点编号, 关系类型编号, 关系 ID) 三个数组视图"""
+        start, end = int(self.indptr[direction][i]), int(self.indptr[direction][i + 1])
+        if type_code is not None:
+            types = self.edge_type[direction][start:end]
+            start, end = start + int(np.searchsorted(types, type_code)), \
+                start + int(np.searchsorted(types, type_code, side="right"))
+        return (self.indices[direction][start:end], self.edge_type[direction][start:end],
+                self.edge_rel[direction][start:end])
+
+    def edges(self):
+        """全部边的 (起点编号, 终点编号) 数组，按起点排序"""
+        indptr = self.indptr["out"]
+        sources = np.repeat(np.arange(self.node_count, dtype=np.int64), np.diff(indptr))
+        return sources, self.indices["out"].astype(np.int64)
+
+
+def _build(domain):
+    """读取领域数据，返回 (文件头, {数组名: 数组})"""
+    chunk_size = get_chunk_size()
+    entities, relations = Entity.objects.all(), Relationship.objects.all()
+    if domain != "all":
+        entities, relations = entities.filter(domain=domain), relations.filter(domain=domain)
+    sources, targets, types, rel_ids = [], [], [], []
+    # 版本号与数据在同一个事务中读取，互相一致
+    with read_transaction():
+        version = get_version(domain)
+        seq = changefeed.head_seq()
+        ids = sorted(entities.order_by().values_list("id", flat=True).iterator(chunk_size=chunk_size))
+        rows = relations.order_by().values_list("id", "source_id", "target_id", "type")
+        for rel_id, source_id, target_id, rel_type in rows.iterator(chunk_size=chunk_size):
+            rel_ids.append(rel_id)
+            sources.append(source_id)
+            targets.append(target_id)
+            types.append(rel_type)
+
+    index = {entity_id: i for i, entity_id in enumerate(ids)}
+    src = np.fromiter((index.get(s, -1) for s in sources), dtype=np.int64, count=len(sources))
+    dst = np.fromiter((index.get(t, -1) for t in targets), dtype=np.int64, count=len(targets))
+    type_names = sorted(set(types))
+    type_codes = {name: code for code, name in enumerate(type_names)}
+    edge_type = np.fromiter(map(type_codes.__getitem__, types), dtype=np.int32, count=len(types))
+    edge_rel = np.array(rel_ids, dtype=np.int64)
+    keep = (src >= 0) & (dst >= 0)
+    src, dst, edge_type, edge_rel = src[keep], dst[keep], edge_type[keep], edge_rel[keep]
+
+    encoded = [entity_id.encode("utf-8") for entity_id in ids]
+    id_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=id_offsets[1:])
+    arrays = {"ids": np.frombuffer(b"".join(encoded), dtype=np.uint8), "id_offsets": id_offsets}
+    for direction, (near, far) in (("out", (src, dst)), ("in", (dst, src))):
+        order = np.lexsort((far, edge_type, near))
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(near, minlength=len(ids)), out=indptr[1:])
+        arrays[f"{direction}_indptr"] = indptr
+        arrays[f"{direction}_indices"] = far[order].astype(np.int32)
+        arrays[f"{direction}_type"] = edge_type[order]
+        arrays[f"{direction}_rel"] = edge_rel[order]
+    header = {
+        "format_version": FORMAT_VERSION, "domain": domain, "version": version, "seq": seq, "types": type_names,
+    }
+    return header, arrays
+
+
+def _encode(header, arrays):
+    """按文件格式编码，返回 bytes 片段列表"""
+    specs, offset = [], 0
+    for name, array in arrays.items():
+        specs.append((name, array.dtype.str, len(array), offset))
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    def header_bytes(base):
+        specs_at = {name: [dtype, count, base + offset] for name, dtype, count, offset in specs}
+        return json.dumps({**header, "arrays": specs_at}).encode("utf-8")
+
+    # 文件头的长度取决于其中数组的偏移（数据起点），增大起点直到文件头放得下
+    prefix = len(MAGIC) + 8
+    base = ALIGN
+    data = header_bytes(base)
+    while prefix + len(data) > base:
+        base = -(-(prefix + len(data)) // ALIGN) * ALIGN
+        data = header_bytes(base)
+    chunks = [MAGIC, struct.pack("<Q", len(data)), data, b"\x00" * (base - prefix - len(data))]
+    for array in arrays.values():
+        chunks.append(array.tobytes())
+        chunks.append(b"\x00" * (-array.nbytes % ALIGN))
+    return chunks
+
+
+def _domain_key(domain):
+    return hashlib.sha256(domain.encode("utf-8")).hexdigest()[:16]
+
+
+def _image_path(domain, version):
+    return os.path.join(get_image_dir(), f"{_domain_key(domain)}-{version}.kgimg")
+
+
+@contextmanager
+def _file_lock(domain):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(get_image_dir(), f"{_domain_key(domain)}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _open(path):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        # 关闭文件后映射仍然有效
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return GraphImage(buffer)
+    except ValueError:
+        return None  # 旧格式或损坏的文件，重新发布
+
+
+def publish(domain):
+    """构建领域当前版本的镜像并写入文件，删除该领域的旧版本文件，返回文件路径"""
+    header, arrays = _build(domain)
+    image_dir = get_image_dir()
+    os.makedirs(image_dir, exist_ok=True)
+    path = _image_path(domain, header["version"])
+    partial = f"{path}.{os.getpid()}.part"
+    try:
+        with open(partial, "wb") as f:
+            f.writelines(_encode(header, arrays))
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    prefix = f"{_domain_key(domain)}-"
+    for name in os.listdir(image_dir):
+        if name.startswith(prefix) and name.endswith(".kgimg") and os.path.join(image_dir, name) != path:
+            try:
+                os.remove(os.path.join(image_dir, name))
+            except OSError:
+                pass  # Windows 上仍被映射的文件无法删除，下次发布时再删
+    return path
+
+
+def get_graph_image(domain, version=None):
+    """返回领域当前版本的 GraphImage，必要时发布新版本"""
+    if version is None:
+        version = get_version(domain)
+    with _lock:
+        image = _images.get(domain)
+    if image is not None and image.version == version:
+        return image
+    if connection.in_atomic_block:
+        return GraphImage(b"".join(_encode(*_build(domain))))
+
+    image = _open(_image_path(domain, version))
+    if image is None:
+        os.makedirs(get_image_dir(), exist_ok=True)
+        with _file_lock(domain):
+            # 等待锁期间其它进程可能已经发布
+            image = _open(_image_path(domain, version)) or _open(publish(domain))
+    with _lock:
+        _images[domain] = image
+    return image
+
+
+def invalidate(domains):
+    """释放已变化领域的映射（其它进程在下次访问时发现版本变化）"""
+    with _lock:
+        for domain in domains:
+            _images.pop(domain, None)
+
+
+def clear():
+    with _lock:
+        _images.clear()
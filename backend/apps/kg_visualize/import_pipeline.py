@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+离线导入的解析阶段
+
+支持的输入格式：
+- json：{"nodes": [...], "links": [...]} 文档，一个大文件可预先拆成多个文件；
+- ndjson：实体、关系分别一个文件，每行一个 JSON 对象（字段同 nodes / links 的元素）；
+- csv：实体、关系分别一个文件，首行为列名（实体 id,name,type,description，
+  关系 source,target,type,description），多余的列被忽略。
+
+输入被切成分片（Shard），每个分片流式解码、校验并规范化为导入所需的字段：
+- 节点批次直接交给写入方；
+- 连线依赖全部节点导入后的 ID 映射，按批 pickle 到临时文件，节点全部写入后再读回。
+
+workers > 0 时各分片在子进程中解析（NDJSON 文件按字节范围继续切分），节点批次同样
+暂存到临时文件，主进程按分片原来的顺序读回写入，数据库写入仍只在主进程中串行进行。
+冲突处理（auto_id 的编号、merge_data 的覆盖、连线按 ID 映射连接到哪个实体）取决于
+行的顺序，按原顺序写入保证结果与不并行解析时相同。
+本模块不访问数据库，子进程无需初始化 Django。
+"""
+import csv
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+
+from .jsonstream import JSONArrayStream, JSONStreamError
+
+# 每个子进程最多积压在队列中的消息数
+QUEUE_DEPTH = 2
+# 等待子进程结果时检查其存活状态的间隔（秒）
+POLL_INTERVAL = 1.0
+# NDJSON 按字节范围切分时每片的最小大小
+MIN_RANGE_SIZE = 4 * 1024 * 1024
+# 每个子进程分到的 NDJSON 片数（多切几片以平衡各进程的负载）
+RANGES_PER_WORKER = 4
+FORMATS = ("json", "ndjson", "csv")
+REQUIRED_COLUMNS = {"nodes": {"id", "name"}, "links": {"source", "target", "type"}}
+
+
+class ShardError(Exception):
+    """分片文件无法解析（文件损坏、格式不符或子进程异常退出）"""
+
+
+class Shard(namedtuple("Shard", ["path", "format", "kind", "start", "end"], defaults=(None, None, 0, None))):
+    """
+    一个解析单元。format 为 json 时 kind 为 None（文件同时包含 nodes 与 links），
+    ndjson / csv 时 kind 为 "nodes" 或 "links"；start / end 为 NDJSON 的字节范围
+    （从 start 之后的第一个完整行开始，到起始位置不小于 end 的行之前结束）。
+    续传时 start 为 iter_chunks() 给出的偏移（json 分片此时 kind 为偏移所在的数组）。
+    """
+
+
+def clean_node(node):
+    """返回导入所需的节点字段，缺少 id / name 时返回 None（计为错误）"""
+    if not isinstance(node, dict) or not node.get("id") or not node.get("name"):
+        return None
+    # 命令行导入的数据统一写入 --domain 指定的领域，忽略行内的 domain
+    return {
+        "id": node["id"],
+        "name": node["name"],
+        "type": node.get("type", ""),
+        "description": node.get("description", ""),
+    }
+
+
+def clean_link(link):
+    """返回导入所需的连线字段，缺少端点、类型或自环时返回 None（计为错误）"""
+    if not isinstance(link, dict):
+        return None
+    source, target, rel_type = link.get("source"), link.get("target"), link.get("type")
+    if not source or not target or not rel_type or source == target:
+        return None
+    return {"source": source, "target": target, "type": rel_type, "description": link.get("description", "")}
+
+
+class _JSONRecords:
+    """json 分片中各数组的元素；start 不为 0 时从数组 kind 中该偏移处的元素之后继续"""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self._reader = None
+
+    def __iter__(self):
+        shard = self.shard
+        with open(shard.path, "rb") as f:
+            self._reader = JSONArrayStream(f, start=shard.start, resume=shard.kind if shard.start else None)
+            yield from self._reader.items()
+        if {"nodes", "links"} & set(self._reader.skipped):
+            raise ShardError(f"{shard.path}: 'nodes' and 'links' must be arrays")
+        if not {"nodes", "links"} & set(self._reader.arrays):
+            raise ShardError(f"{shard.path}: invalid data format. Expected {{'nodes': [...], 'links': [...]}}")
+
+    def position(self):
+        return self._reader.position()
+
+
+class _NDJSONRecords:
+    def __init__(self, shard):
+        self.shard = shard
+        self._file = None
+
+    def __iter__(self):
+        shard = self.shard
+        with open(shard.path, "rb") as self._file:
+            f = self._file
+            if shard.start:
+                # 跳到 start 之后的第一个行首（start 恰好是行首时 start - 1 处是换行符）
+                f.seek(shard.start - 1)
+                f.readline()
+            while shard.end is None or f.tell() < shard.end:
+                line = f.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    yield shard.kind, json.loads(line)
+                except ValueError:
+                    # 无法解码的行与缺少字段的行一样计为错误
+                    yield shard.kind, None
+
+    def position(self):
+        return self._file.tell()
+
+
+class _CSVRecords:
+    """
+    按字节逐行读取并交给 csv.reader，以便记录偏移；start 不为 0 时读完列名后跳到该偏移
+    （必须是某条记录的起始位置）。
+    """
+
+    def __init__(self, shard):
+        self.shard = shard
+        self._offset = 0
+
+    def __iter__(self):
+        shard = self.shard
+        with open(shard.path, "rb") as f:
+            lines = self._lines(f)
+            header = next(csv.reader(lines), [])
+            if header:
+                header[0] = header[0].removeprefix("\ufeff")
+            missing = REQUIRED_COLUMNS[shard.kind] - set(header)
+            if missing:
+                raise ShardError(f"{shard.path}: missing CSV columns {', '.join(sorted(missing))}")
+            if shard.start:
+                f.seek(shard.start)
+                self._offset = shard.start
+            for values in csv.reader(lines):
+                if not values:
+                    continue
+                # 列数不足时补空串，多出的值忽略
+                values += [""] * (len(header) - len(values))
+                yield shard.kind, dict(zip(header, values))
+
+    def _lines(self, f):
+        for line in iter(f.readline, b""):
+            self._offset += len(line)
+            yield line.decode("utf-8")
+
+    def position(self):
+        return self._offset
+
+
+RECORD_READERS = {"json": _JSONRecords, "ndjson": _NDJSONRecords, "csv": _CSVRecords}
+
+
+@contextmanager
+def _reading(shard):
+    """把解析分片时的各种异常统一转换为 ShardError"""
+    try:
+        yield
+    except JSONStreamError as e:
+        raise ShardError(f"Invalid JSON file {shard.path}: {e}")
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        raise ShardError(f"Error reading file {shard.path}: {e}")
+
+
+def parse_shard(shard, batch_size, spool):
+    """
+    解析一个分片，依次产出 ("nodes", 节点批次)，最后产出 ("errors", 无效行计数)。
+
+    合法连线按批 pickle 写入 spool（二进制文件对象），用 read_spool() 读回。
+    """
+    errors = {"nodes": 0, "links": 0}
+    nodes, links = [], []
+    with _reading(shard):
+        for key, item in RECORD_READERS[shard.format](shard):
+            if key == "nodes":
+                row, batch = clean_node(item), nodes
+            elif key == "links":
+                row, batch = clean_link(item), links
+            else:
+                continue
+            if row is None:
+                errors[key] += 1
+                continue
+            batch.append(row)
+            if len(nodes) >= batch_size:
+                yield "nodes", nodes
+                nodes = []
+            if len(links) >= batch_size:
+                pickle.dump(links, spool, pickle.HIGHEST_PROTOCOL)
+                links = []
+
+    if nodes:
+        yield "nodes", nodes
+    if links:
+        pickle.dump(links, spool, pickle.HIGHEST_PROTOCOL)
+    yield "errors", errors
+
+
+def iter_chunks(shard, kind, batch_size):
+    """
+    顺序读取分片中 kind（"nodes" / "links"）的记录，每读满 batch_size 条产出一次
+    (合法行, 无效行数, 偏移)。偏移为已读记录之后的字节位置，
+    shard._replace(kind=kind, start=偏移) 即从该处继续读取；分片读完时最后产出一次，偏移为 None。
+    """
+    clean = clean_node if kind == "nodes" else clean_link
+    records = RECORD_READERS[shard.format](shard)
+    rows, errors = [], 0
+    with _reading(shard):
+        for key, item in records:
+            if key != kind:
+                continue
+            row = clean(item)
+            if row is None:
+                errors += 1
+            else:
+                rows.append(row)
+            if len(rows) + errors >= batch_size:
+                yield rows, errors, records.position()
+                rows, errors = [], 0
+    yield rows, errors, None
+
+
+def split_ranges(shards, parts):
+    """把 NDJSON 分片按字节范围切成约 parts 份（每份不小于 MIN_RANGE_SIZE），其它分片不变"""
+    result = []
+    for shard in shards:
+        if shard.format != "ndjson" or parts <= 1:
+            result.append(shard)
+            continue
+        size = os.path.getsize(shard.path)
+        step = max(MIN_RANGE_SIZE, -(-size // parts))
+        result.extend(shard._replace(start=start, end=min(start + step, size)) for start in range(0, size, step))
+    return result
+
+
+def read_spool(path):
+    """逐批读回 parse_shard 写入的连线"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _new_spool(spool_dir, kind="links"):
+    fd, path = tempfile.mkstemp(prefix=f"{kind}-", suffix=".pickle", dir=spool_dir)
+    return os.fdopen(fd, "wb"), path
+
+
+def _replay(node_spool, errors, link_spool):
+    """按 parse_shard 的顺序产出子进程解析好的一个分片，节点暂存文件读完即删除"""
+    try:
+        for nodes in read_spool(node_spool):
+            yield "nodes", nodes
+    finally:
+        os.remove(node_spool)
+    yield "errors", errors
+    yield "links", link_spool
+
+
+def _worker(tasks, results, batch_size, spool_dir):
+    for index, shard in iter(tasks.get, None):
+        try:
+            node_spool, node_path = _new_spool(spool_dir, "nodes")
+            link_spool, link_path = _new_spool(spool_dir)
+            with node_spool, link_spool:
+                for kind, payload in parse_shard(shard, batch_size, link_spool):
+                    if kind == "nodes":
+                        pickle.dump(payload, node_spool, pickle.HIGHEST_PROTOCOL)
+                    else:
+                        errors = payload
+            results.put(("shard", (index, (node_path, errors, link_path))))
+        except Exception as e:
+            results.put(("error", str(e) if isinstance(e, ShardError) else f"{shard.path}: {e!r}"))
+            break
+    results.put(("done", None))
+
+
+def iter_batches(shards, batch_size, spool_dir, workers=0):
+    """
+    解析全部分片，产出：
+    - ("nodes", rows)：节点批次；
+    - ("errors", {"nodes": n, "links": m})：某个分片中无效的行数；
+    - ("links", spool_path)：某个分片的连线暂存文件。
+
+    workers 为 0 时在当前进程中依次解析；否则最多启动 workers 个子进程并行解析，
+    先解析完的分片在主进程中等待，仍按分片（与 NDJSON 字节范围）的原顺序交回。
+    """
+    if workers > 0:
+        shards = split_ranges(shards, workers * RANGES_PER_WORKER)
+    workers = min(workers, len(shards))
+    if workers <= 0:
+        for shard in shards:
+            spool, spool_path = _new_spool(spool_dir)
+            with spool:
+                yield from parse_shard(shard, batch_size, spool)
+            yield "links", spool_path
+        return
+
+    context = multiprocessing.get_context()
+    tasks = context.Queue()
+    results = context.Queue(maxsize=workers * QUEUE_DEPTH)
+    for index, shard in enumerate(shards):
+        tasks.put((index, shard))
+    for _ in range(workers):
+        tasks.put(None)
+    processes = [
+        context.Process(target=_worker, args=(tasks, results, batch_size, spool_dir), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        running, parsed, next_index = workers, {}, 0
+        while running:
+            try:
+                kind, payload = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    raise ShardError("Parser worker exited unexpectedly")
+                continue
+            if kind == "done":
+                running -= 1
+            elif kind == "error":
+                raise ShardError(payload)
+            else:
+                index, result = payload
+                parsed[index] = result
+                while next_index in parsed:
+                    yield from _replay(*parsed.pop(next_index))
+                    next_index += 1
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
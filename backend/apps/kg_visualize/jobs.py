@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+进程内后台任务（导入 / 导出 / 社区计算）
+
+大文件导入与全量导出在请求线程中执行会超过反向代理的超时，并长时间占用 worker；
+大领域的社区层次过期时也在后台重新计算（见 communities.get_communities）。
+这里不依赖外部消息队列：任务记录在 GraphJob 表中，由进程内的线程池执行，
+接口立即返回任务 ID，客户端轮询 /api/kg/jobs/<id> 获取进度、吞吐量与最终报告
+（导出为下载链接）。状态保存在数据库中，多进程部署时任意进程都能查询。
+
+- 线程池在首次提交任务时创建，随应用进程存在；KG_JOB_WORKERS 为 0 时任务在
+  提交线程中同步执行（测试与调试使用）。
+- 任务在提交它的事务提交后才开始执行（transaction.on_commit）。
+- 进程退出时未完成的任务不会重试。任务的 worker 记录执行进程的主机名、进程号与
+  启动标识（BOOT_ID），同一主机上新的线程池启动、轮询任务状态或重新提交社区计算
+  时，把执行进程已不存在的任务标记为失败。
+- 已结束超过 KG_JOB_RETENTION 秒的任务在提交新任务时删除，连同导出文件。
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import communities
+from .importer import GraphImporter
+from .models import GraphJob
+from .pagination import entity_page, relationship_page
+from .streaming import get_chunk_size, graph_querysets, iter_json_array
+from .versioning import coalesce_writes
+
+# 进度写入任务表的最小间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 进程启动标识：容器中重启后的进程号经常与之前相同（例如都是 1），只凭进程号
+# 无法判断任务的执行进程是否已经退出
+BOOT_ID = uuid.uuid4().hex[:16]
+
+UNFINISHED = (GraphJob.STATUS_PENDING, GraphJob.STATUS_RUNNING)
+
+
+def get_workers():
+    return getattr(settings, "KG_JOB_WORKERS", 2)
+
+
+def get_job_dir():
+    return getattr(settings, "KG_JOB_DIR", os.path.join(settings.BASE_DIR, "jobs"))
+
+
+def _worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{BOOT_ID}"
+
+
+def submit(kind, domain, params, payload=None):
+    """
+    创建任务并在当前事务提交后交给线程池执行，返回 GraphJob。
+
+    payload 为导入数据（nodes、links），只保存在内存中交给执行线程，不写入任务表。
+    """
+    _purge_expired()
+    job = GraphJob.objects.create(
+        id=uuid.uuid4().hex, kind=kind, domain=domain, params=json.dumps(params), worker=_worker_name()
+    )
+    if get_workers() <= 0:
+        transaction.on_commit(lambda: _execute(job.id, payload))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.id, payload))
+    return job
+
+
+def schedule_communities(domain):
+    """提交领域社区层次的重新计算任务；已有未结束的同类任务时直接返回该任务"""
+    pending = GraphJob.objects.filter(kind=GraphJob.KIND_COMMUNITIES, domain=domain, status__in=UNFINISHED).first()
+    if pending and recover(pending).status in UNFINISHED:
+        return pending
+    return submit(GraphJob.KIND_COMMUNITIES, domain, {})
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _fail_interrupted()
+            _executor = ThreadPoolExecutor(max_workers=get_workers(), thread_name_prefix="kg-job")
+        return _executor
+
+
+def _interrupted(worker):
+    """worker（主机名:进程号:启动标识）对应的执行进程是否已经退出；其他主机上的进程无法判断，返回 False"""
+    host, _, rest = worker.partition(":")
+    pid, _, boot_id = rest.partition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # 进程号相同而启动标识不同：本进程重启前提交的任务
+        return boot_id != BOOT_ID
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # 进程存在，属于其他用户
+    return False
+
+
+def _mark_interrupted(job_ids):
+    GraphJob.objects.filter(pk__in=job_ids, status__in=UNFINISHED).update(
+        status=GraphJob.STATUS_FAILED, error="Interrupted: the worker process exited", finished_at=timezone.now()
+    )
+
+
+def _fail_interrupted():
+    """本主机上执行进程已经退出、却仍处于 pending / running 的任务标记为失败"""
+    stale = GraphJob.objects.filter(status__in=UNFINISHED, worker__startswith=f"{socket.gethostname()}:")
+    _mark_interrupted([job_id for job_id, worker in stale.values_list("id", "worker") if _interrupted(worker)])
+
+
+def recover(job):
+    """未结束的任务的执行进程已经退出时标记为失败（轮询状态时调用），返回最新的任务记录"""
+    if job.status in UNFINISHED and _interrupted(job.worker):
+        _mark_interrupted([job.pk])
+        job.refresh_from_db()
+    return job
+
+
+def _purge_expired():
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, "KG_JOB_RETENTION", 86400))
+    expired = GraphJob.objects.filter(finished_at__lt=cutoff)
+    for path in expired.exclude(result_file="").values_list("result_file", flat=True):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    expired.delete()
+
+
+def _run_in_thread(job_id, payload):
+    try:
+        _execute(job_id, payload)
+    finally:
+        # 线程池中的线程各自持有数据库连接，任务结束后关闭
+        connection.close()
+
+
+def _execute(job_id, payload):
+    job = GraphJob.objects.get(pk=job_id)
+    job.status = GraphJob.STATUS_RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=["status", "started_at"])
+    progress = Progress(job)
+    try:
+        if job.kind == GraphJob.KIND_IMPORT:
+            job.result = json.dumps(run_import(job, payload, progress))
+        elif job.kind == GraphJob.KIND_COMMUNITIES:
+            job.result = json.dumps(run_communities(job, progress))
+        else:
+            job.result_file = run_export(job, progress)
+        job.status = GraphJob.STATUS_SUCCEEDED
+    except Exception as e:
+        job.status = GraphJob.STATUS_FAILED
+        job.error = f"{type(e).__name__}: {e}"
+        logger.exception("Graph %s job %s failed", job.kind, job.pk)
+    job.processed = progress.processed
+    job.total = progress.total
+    job.finished_at = timezone.now()
+    job.save()
+
+
+class Progress:
+    """累计已处理的行数，至多每 PROGRESS_INTERVAL 秒写入一次任务表"""
+
+    def __init__(self, job):
+        self.job_id = job.pk
+        self.processed = 0
+        self.total = None
+        self._reported = 0.0
+
+    def set_total(self, total):
+        self.total = total
+        GraphJob.objects.filter(pk=self.job_id).update(total=total)
+
+    def advance(self, rows):
+        self.processed += rows
+        now = time.monotonic()
+        if now - self._reported >= PROGRESS_INTERVAL:
+            self._reported = now
+            GraphJob.objects.filter(pk=self.job_id).update(processed=self.processed)
+
+
+def run_import(job, payload, progress):
+    """
+    分批导入 payload 中的节点与连线，每批在自己的事务中提交（进度对其他连接可见），
+    返回与 /api/kg/import 同步响应中 data 相同的报告。
+    """
+    params = json.loads(job.params)
+    nodes, links = payload["nodes"], payload["links"]
+    importer = GraphImporter(job.domain, params["strategy"], params["conflict_resolution"])
+    progress.set_total(len(nodes) + len(links))
+    size = importer.batch_size
+    for rows, write in ((nodes, importer.import_entities), (links, importer.import_relationships)):
+        for start in range(0, len(rows), size):
+            batch = rows[start:start + size]
+            with transaction.atomic(), coalesce_writes():
+                write(batch)
+            progress.advance(len(batch))
+    return {
+        "import_stats": importer.stats,
+        "entity_id_mapping": importer.entity_id_mapping,
+        "domain": job.domain,
+        "strategy": params["strategy"],
+        "conflict_resolution": params["conflict_resolution"],
+    }
+
+
+def run_communities(job, progress):
+    """重新计算领域的社区层次，返回结果对应的领域版本号与各层社区数"""
+    computed = communities.compute_communities(job.domain)
+    progress.set_total(computed.node_count)
+    progress.advance(computed.node_count)
+    return {
+        "domain": job.domain,
+        "version": computed.version,
+        "clusters": [max(level) + 1 if len(level) else 0 for level in computed.levels()],
+    }
+
+
+def _export_link(r):
+    return {
+        "id": r["id"],
+        "source": r["source_id"],
+        "target": r["target_id"],
+        "type": r["type"],
+        "description": r["description"],
+    }
+
+
+def _paged(page, queryset, chunk_size, progress):
+    """
+    按键集分页逐页读取。每页是一条独立的查询，页与页之间不持有读事务，
+    SQLite 上同时进行的导入（以及本任务的进度更新）不会被长时间的读阻塞。
+    """
+    after = None
+    while True:
+        rows, after = page(queryset, after, chunk_size)
+        yield from rows
+        progress.advance(len(rows))
+        if after is None:
+            return
+
+
+def run_export(job, progress):
+    """
+    把领域数据按 /api/kg/export 的响应格式写入 KG_JOB_DIR 下的文件，返回文件路径。
+    分页读取，导出期间的写入可能部分出现在结果中（与逐页调用分页接口相同）。
+    """
+    chunk_size = get_chunk_size()
+    entities, relations = graph_querysets(job.domain)
+    progress.set_total(entities.count() + relations.count())
+
+    job_dir = get_job_dir()
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, f"{job.pk}.json")
+    partial = path + ".part"
+    try:
+        with open(partial, "wb") as f:
+            f.write(b'{"ret": 0, "data": {"nodes": [')
+            rows = _paged(entity_page, entities, chunk_size, progress)
+            for piece in iter_json_array(rows, dict, chunk_size):
+                f.write(piece)
+            f.write(b'], "links": [')
+            rows = _paged(relationship_page, relations, chunk_size, progress)
+            for piece in iter_json_array(rows, _export_link, chunk_size):
+                f.write(piece)
+            f.write((']}, "domain": %s}' % json.dumps(job.domain)).encode("utf-8"))
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return path
+
+
+def job_status(job):
+    """任务状态接口返回的数据"""
+    end = job.finished_at or timezone.now()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0
+    data = {
+        "id": job.pk,
+        "kind": job.kind,
+        "domain": job.domain,
+        "status": job.status,
+        "processed": job.processed,
+        "total": job.total,
+        # 导出期间新写入的行也会被读到，processed 可能略超过 total
+        "progress": round(min(job.processed / job.total, 1.0), 4) if job.total else None,
+        "rows_per_second": round(job.processed / elapsed, 1) if elapsed > 0 else None,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == GraphJob.STATUS_FAILED:
+        data["error"] = job.error
+    elif job.status == GraphJob.STATUS_SUCCEEDED:
+        if job.kind == GraphJob.KIND_EXPORT:
+            data["download_url"] = reverse("job_download", args=[job.pk])
+        else:
+            data["result"] = json.loads(job.result)
+    return data
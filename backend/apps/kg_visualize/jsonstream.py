@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+大型 JSON 文档的流式读取
+
+导入文件的结构为 {"nodes": [...], "links": [...]}，json.load 需要把整个文档读入内存
+并构造全部对象后才能开始写库。这里按块读取文件，只对顶层对象的结构（{ } [ ] , :）
+做增量词法分析，数组中的每个元素单独交给标准库的 JSONDecoder.raw_decode 解码，
+逐个产出。内存占用只与读取块大小和单个元素的大小有关，与文件大小无关。
+"""
+import codecs
+import json
+
+READ_SIZE = 1 << 16
+# 单个元素（解码前）的大小上限；超过时多半是文件损坏，避免把整个文件读进缓冲区
+MAX_ITEM_SIZE = 64 * 1024 * 1024
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+
+
+class JSONStreamError(ValueError):
+    def __init__(self, msg, offset):
+        super().__init__(f"{msg}: byte {offset}")
+        self.offset = offset
+
+
+class JSONArrayStream:
+    """
+    逐个读取顶层对象中数组字段的元素。
+
+        for key, item in JSONArrayStream(f).items():
+            ...
+
+    f 为以二进制模式打开的文件（UTF-8，可带 BOM）。读到的数组字段名记录在 arrays 中；
+    非数组字段会被解码后跳过，字段名记录在 skipped 中。
+
+    position() 返回最近产出的元素之后的字节偏移。把它和当时的字段名传回
+    JSONArrayStream(f, start=偏移, resume=字段名) 即可从该元素之后继续读取。
+    """
+
+    def __init__(self, fp, read_size=READ_SIZE, max_item_size=MAX_ITEM_SIZE, start=0, resume=None):
+        self.fp = fp
+        self.read_size = read_size
+        self.max_item_size = max_item_size
+        self.resume = resume
+        self.arrays = []
+        self.skipped = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        # 已从缓冲区丢弃的字节数，用于计算偏移和报告错误位置
+        self._consumed = start
+        self._eof = False
+        if start:
+            fp.seek(start)
+
+    def position(self):
+        return self._consumed + len(self._buf[:self._pos].encode("utf-8"))
+
+    def items(self):
+        if self.resume is not None:
+            # 从数组 resume 中某个元素之后继续
+            self.arrays.append(self.resume)
+            more = self._token(",]") == ","
+            if more:
+                yield from self._elements(self.resume)
+            more = self._token(",}") == ","
+        else:
+            if self._peek() == "\ufeff":
+                self._pos += 1
+            self._expect("{")
+            more = self._peek() != "}"
+            if not more:
+                self._pos += 1
+        if more:
+            while True:
+                key = self._value()
+                if not isinstance(key, str):
+                    self._error("Expecting property name")
+                self._expect(":")
+                if self._peek() == "[":
+                    self._pos += 1
+                    self.arrays.append(key)
+                    yield from self._array(key)
+                else:
+                    self._value()
+                    self.skipped.append(key)
+                if self._token(",}") == "}":
+                    break
+        if self._peek():
+            self._error("Extra data")
+
+    def _array(self, key):
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        yield from self._elements(key)
+
+    def _elements(self, key):
+        while True:
+            yield key, self._value()
+            if self._token(",]") == "]":
+                return
+
+    # -----------------------------
+    # 词法分析
+    # -----------------------------
+
+    def _fill(self, size=None):
+        """丢弃已消费的部分并读入更多数据，文件结束时返回 False"""
+        if self._eof:
+            return False
+        self._consumed += len(self._buf[:self._pos].encode("utf-8"))
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        chunk = self.fp.read(size or self.read_size)
+        if not chunk:
+            self._eof = True
+            self._buf += self._decoder.decode(b"", final=True)
+            return False
+        self._buf += self._decoder.decode(chunk)
+        return True
+
+    def _peek(self):
+        """跳过空白，返回下一个字符（文件结束时返回空串）"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _token(self, expected):
+        char = self._peek()
+        if not char or char not in expected:
+            self._error(f"Expecting one of {expected!r}")
+        self._pos += 1
+        return char
+
+    def _expect(self, char):
+        self._token(char)
+
+    def _value(self):
+        if not self._peek():
+            self._error("Expecting value")
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # 元素不完整：按未解析部分的长度成倍读入，避免大元素被反复从头解码
+                pending = len(self._buf) - self._pos
+                if pending > self.max_item_size:
+                    self._error("Item too large or malformed")
+                if not self._fill(max(self.read_size, pending)):
+                    raise JSONStreamError("Invalid JSON", self._consumed + self._pos) from None
+                continue
+            # 缓冲区剩余部分都是数字字符时，刚解码的值可能是被截断的数字（如 "12" 之后还有 ".5"）
+            rest = end
+            while rest < len(self._buf) and self._buf[rest] in NUMBER_CHARS:
+                rest += 1
+            if rest == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _error(self, msg):
+        raise JSONStreamError(msg, self._consumed + self._pos)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+服务端力导向布局
+
+浏览器端 d3.forceSimulation 在数千节点以上会长时间卡顿。这里用 NumPy 向量化的
+Fruchterman-Reingold 算法在服务端计算布局：
+- 节点数不超过 EXACT_LIMIT 时精确计算两两斥力；
+- 更大的图使用网格近似：远场斥力在网格上用 FFT 卷积计算，同一网格内精确计算，
+  每次迭代 O(n + 网格数·log 网格数)。
+
+布局按领域版本号计算并持久化到 GraphLayout，/api/kg/data?layout=1 直接返回坐标。
+图谱增量修改后以上一次的坐标作为初始位置（warm start），少量迭代即可收敛。
+"""
+import json
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .graph_image import get_graph_image
+from .models import Entity, GraphLayout
+from .versioning import get_version
+
+EXACT_LIMIT = 1000
+
+
+def _phyllotaxis(indices, spacing):
+    """与 d3 相同的初始布局：向日葵螺旋"""
+    indices = np.asarray(indices, dtype=np.float64)
+    radius = spacing * 0.5 * np.sqrt(0.5 + indices)
+    angle = indices * math.pi * (3 - math.sqrt(5))
+    return np.column_stack((radius * np.cos(angle), radius * np.sin(angle)))
+
+
+def _repulsion_exact(pos, k2, block=512):
+    """精确计算两两斥力 k²·d/|d|²，按块展开并用矩阵乘法求和"""
+    x, y = pos[:, 0], pos[:, 1]
+    disp = np.empty_like(pos)
+    for start in range(0, len(pos), block):
+        bx, by = x[start:start + block], y[start:start + block]
+        dx = bx[:, None] - x[None, :]
+        dy = by[:, None] - y[None, :]
+        w = dx * dx
+        w += dy * dy
+        np.maximum(w, 1e-2, out=w)
+        np.divide(k2, w, out=w)
+        total = w.sum(1)
+        disp[start:start + block, 0] = bx * total - w @ x
+        disp[start:start + block, 1] = by * total - w @ y
+    return disp
+
+
+def _repulsion_grid(pos, k2, per_cell=4, max_side=512):
+    """
+    网格近似斥力（particle-mesh）：
+
+    节点质量累加到 side x side 网格上，与斥力核做 FFT 卷积得到每个网格中心受到的
+    远场斥力；同一网格内的节点之间再精确计算。复杂度 O(n + side² log side)。
+    """
+    n = len(pos)
+    side = int(min(max_side, max(2, math.ceil(math.sqrt(n / per_cell)))))
+    # 网格范围取 1%~99% 分位数，少数远离主体的孤立节点不会把网格撑得过稀；
+    # 范围外的节点归入边缘网格
+    low, high = np.percentile(pos, [1, 99], axis=0)
+    h = max(float((high - low).max()), 1e-6) / side
+    cell_xy = np.clip(((pos - low) / h).astype(np.int64), 0, side - 1)
+    cell = cell_xy[:, 0] * side + cell_xy[:, 1]
+    mass = np.bincount(cell, minlength=side * side).astype(np.float64).reshape(side, side)
+
+    offsets = np.arange(-(side - 1), side) * h
+    dx, dy = np.meshgrid(offsets, offsets, indexing="ij")
+    r2 = dx * dx + dy * dy
+    r2[side - 1, side - 1] = np.inf  # 同一网格的贡献由近场部分精确计算
+    size = (1 << int(math.ceil(math.log2(3 * side - 2))),) * 2
+    mass_fft = np.fft.rfft2(mass, size)
+    disp = np.empty_like(pos)
+    for axis, kernel in enumerate((k2 * dx / r2, k2 * dy / r2)):
+        field = np.fft.irfft2(mass_fft * np.fft.rfft2(kernel, size), size)
+        field = field[side - 1:2 * side - 1, side - 1:2 * side - 1]
+        disp[:, axis] = field[cell_xy[:, 0], cell_xy[:, 1]]
+
+    # 近场：按网格排序后，第 o 轮比较相隔 o 位的两个节点，同一网格则精确计算
+    order = np.argsort(cell, kind="stable")
+    sorted_cell, sorted_pos = cell[order], pos[order]
+    for o in range(1, n):
+        i = np.flatnonzero(sorted_cell[:-o] == sorted_cell[o:])
+        if not len(i):
+            break
+        delta = sorted_pos[i] - sorted_pos[i + o]
+        force = delta * (k2 / np.maximum((delta ** 2).sum(1), 1e-2))[:, None]
+        for axis in (0, 1):
+            disp[:, axis] += np.bincount(order[i], weights=force[:, axis], minlength=n)
+            disp[:, axis] -= np.bincount(order[i + o], weights=force[:, axis], minlength=n)
+    return disp
+
+
+def force_layout(n, sources, targets, initial=None, iterations=200, spacing=200.0, temperature=None):
+    """
+    计算 n 个节点的二维坐标。
+
+    sources/targets 为连线两端的节点下标数组；initial 为初始坐标（n x 2），
+    缺省时使用螺旋布局。spacing 为理想边长（与前端 forceLink.distance 一致）。
+    """
+    if n == 0:
+        return np.zeros((0, 2))
+    pos = np.array(initial, dtype=np.float64) if initial is not None else _phyllotaxis(np.arange(n), spacing)
+    if n == 1:
+        return pos
+
+    k = float(spacing)
+    k2 = k * k
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    repulsion = _repulsion_exact if n <= EXACT_LIMIT else _repulsion_grid
+    t = temperature if temperature is not None else k * math.sqrt(n) / 10
+    cooling = t / (iterations + 1)
+
+    for _ in range(iterations):
+        disp = repulsion(pos, k2)
+        if len(sources):
+            delta = pos[sources] - pos[targets]
+            dist = np.sqrt((delta ** 2).sum(-1)) + 1e-6
+            pull = delta * (dist / k)[:, None]
+            for axis in (0, 1):
+                disp[:, axis] -= np.bincount(sources, weights=pull[:, axis], minlength=n)
+                disp[:, axis] += np.bincount(targets, weights=pull[:, axis], minlength=n)
+        # 向心力，避免不连通的分量漂远
+        disp -= 0.01 * pos
+        length = np.sqrt((disp ** 2).sum(-1)) + 1e-9
+        pos += disp * (np.minimum(length, t) / length)[:, None]
+        t = max(t - cooling, 1e-3)
+
+    return pos - pos.mean(0)
+
+
+def graph_arrays(domain, node_ids=None):
+    """
+    返回 (按 id 排序的节点 ID 列表, 连线起点下标数组, 连线终点下标数组)，忽略自环与跨领域连线。
+    边取自共享的图谱镜像（graph_image），不再逐行读取关系表。
+
+    传入 node_ids（例如已保存结果中的节点列表）时按该列表编号，不在其中的端点被忽略。
+    """
+    image = get_graph_image(domain)
+    sources, targets = image.edges()
+    if node_ids is None:
+        node_ids = image.node_ids()
+    else:
+        # 镜像中的节点编号 -> node_ids 中的下标，不在其中为 -1
+        position = {node_id: i for i, node_id in enumerate(node_ids)}
+        remap = np.fromiter((position.get(node_id, -1) for node_id in image.node_ids()),
+                            dtype=np.int64, count=image.node_count)
+        sources, targets = remap[sources], remap[targets]
+        keep = (sources >= 0) & (targets >= 0)
+        sources, targets = sources[keep], targets[keep]
+    keep = sources != targets
+    return node_ids, sources[keep], targets[keep]
+
+
+def _warm_start(node_ids, sources, targets, previous, spacing):
+    """
+    沿用上次布局中已有节点的坐标，新节点放在已定位邻居的中心附近。
+    没有任何可沿用的坐标时返回 None。
+    """
+    n = len(node_ids)
+    pos = _phyllotaxis(np.arange(n), spacing)
+    placed = np.zeros(n, dtype=bool)
+    for i, node_id in enumerate(node_ids):
+        if node_id in previous:
+            pos[i] = previous[node_id]
+            placed[i] = True
+    if not placed.any():
+        return None
+    if placed.all():
+        return pos
+
+    ends = np.concatenate((sources, targets))
+    others = np.concatenate((targets, sources))
+    usable = placed[others] & ~placed[ends]
+    counts = np.bincount(ends[usable], minlength=n)
+    for axis in (0, 1):
+        total = np.bincount(ends[usable], weights=pos[others[usable], axis], minlength=n)
+        has_neighbor = counts > 0
+        pos[has_neighbor, axis] = total[has_neighbor] / counts[has_neighbor]
+    jitter = np.random.default_rng(n).uniform(-spacing / 4, spacing / 4, size=(n, 2))
+    pos[~placed] += jitter[~placed]
+    return pos
+
+
+def compute_layout(domain, warm=True):
+    """计算并保存领域布局，返回 GraphLayout"""
+    version = get_version(domain)
+    spacing = getattr(settings, "KG_LAYOUT_SPACING", 200.0)
+    node_ids, sources, targets = graph_arrays(domain)
+
+    previous = GraphLayout.objects.filter(domain=domain).first() if warm else None
+    initial = None
+    if previous is not None:
+        initial = _warm_start(node_ids, sources, targets, previous.positions_by_id(), spacing)
+    if initial is not None:
+        iterations = getattr(settings, "KG_LAYOUT_WARM_ITERATIONS", 40)
+        # 已有坐标基本合理，只需小步调整
+        temperature = spacing
+    else:
+        iterations = getattr(settings, "KG_LAYOUT_ITERATIONS", 200)
+        temperature = None
+
+    pos = force_layout(len(node_ids), sources, targets, initial=initial, iterations=iterations,
+                       spacing=spacing, temperature=temperature)
+    layout, _ = GraphLayout.objects.update_or_create(domain=domain, defaults={
+        "version": version,
+        "node_count": len(node_ids),
+        "node_ids": json.dumps(node_ids, ensure_ascii=False),
+        "positions": pos.astype(np.float32).tobytes(),
+    })
+    return layout
+
+
+def stored_layout_version(domain):
+    """已保存布局对应的领域版本号（不读取坐标），尚无布局时为 None"""
+    return GraphLayout.objects.filter(domain=domain).values_list("version", flat=True).first()
+
+
+def get_layout(domain, version=None):
+    """
+    返回 (layout, stale)。version 为调用方已查询到的领域版本号。
+
+    布局落后于当前版本时，节点数不超过 KG_LAYOUT_MAX_SYNC_NODES 则就地重新计算；
+    更大的领域返回旧布局（可能为 None）并标记 stale，由 compute_kg_layout 命令离线计算，
+    避免在请求线程中长时间计算。
+    """
+    if version is None:
+        version = get_version(domain)
+    layout = GraphLayout.objects.filter(domain=domain).first()
+    if layout is not None and layout.version == version:
+        return layout, False
+    entities = Entity.objects.all() if domain == "all" else Entity.objects.filter(domain=domain)
+    if entities.count() <= getattr(settings, "KG_LAYOUT_MAX_SYNC_NODES", 2000):
+        return compute_layout(domain), False
+    return layout, True
@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from backend.apps.kg_visualize.snapshot import clear_domain
+
+WORDS = ["人工智能", "机器学习", "深度学习", "神经网络", "知识图谱", "强化学习", "数据挖掘", "推荐系统"]
+DOMAIN = "__benchmark__"
+COLUMNS = {"entities": ["id", "name", "type", "description"], "relationships": ["source", "target", "type"]}
+
+
+class Command(BaseCommand):
+    help = 'Compare import_kg_data throughput of the JSON, NDJSON and CSV paths on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000, help='Entities (and relationships) to import (default: 50000)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Batch size for the streaming paths (default: 5000)')
+        parser.add_argument('--skip-legacy', action='store_true', help='Skip the per-row JSON import (slow on large inputs)')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        rng = random.Random(0)
+        nodes = [
+            {"id": f"bench_{i}", "name": f"{rng.choice(WORDS)}{i}", "type": "benchmark",
+             "description": " ".join(rng.choice(WORDS) for _ in range(4))}
+            for i in range(rows)
+        ]
+        links = [
+            {"source": f"bench_{i}", "target": f"bench_{rng.randrange(rows)}", "type": rng.choice(WORDS)}
+            for i in range(rows)
+        ]
+        links = [link for link in links if link["source"] != link["target"]]
+
+        with tempfile.TemporaryDirectory(prefix='kg-bench-') as tmp:
+            files = self._write_inputs(tmp, nodes, links)
+            batch = ['--batch-size', str(options['batch_size'])]
+            variants = [
+                ('json (per-row)', [files['json']]),
+                ('json --stream', [files['json'], '--stream'] + batch),
+                ('ndjson', ['--format', 'ndjson', '--entities', files['entities.ndjson'],
+                            '--relationships', files['relationships.ndjson']] + batch),
+                ('csv', ['--format', 'csv', '--entities', files['entities.csv'],
+                         '--relationships', files['relationships.csv']] + batch),
+            ]
+            if options['skip_legacy']:
+                variants = variants[1:]
+
+            # 每种方式都按实际部署的方式逐批提交（计入提交与 fsync 的开销），
+            # 之前与之后删除基准领域的数据，起始数据相同，结束后不留下测试数据
+            results = []
+            try:
+                for label, arguments in variants:
+                    clear_domain(DOMAIN)
+                    start = time.perf_counter()
+                    call_command('import_kg_data', *arguments, '--domain', DOMAIN, stdout=io.StringIO())
+                    elapsed = time.perf_counter() - start
+                    results.append((label, elapsed))
+                    self.stdout.write(f"{label}: {elapsed:.1f}s ({(len(nodes) + len(links)) / elapsed:.0f} rows/s)")
+            finally:
+                clear_domain(DOMAIN)
+
+        baseline = results[0][1]
+        for label, elapsed in results[1:]:
+            self.stdout.write(self.style.SUCCESS(f"{label}: {baseline / elapsed:.1f}x vs {results[0][0]}"))
+
+    @staticmethod
+    def _write_inputs(directory, nodes, links):
+        files = {name: os.path.join(directory, name) for name in (
+            'json', 'entities.ndjson', 'relationships.ndjson', 'entities.csv', 'relationships.csv'
+        )}
+        with open(files['json'], 'w', encoding='utf-8') as f:
+            json.dump({"nodes": nodes, "links": links}, f, ensure_ascii=False)
+        for name, items in (('entities', nodes), ('relationships', links)):
+            with open(files[f'{name}.ndjson'], 'w', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            with open(files[f'{name}.csv'], 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS[name])
+                writer.writeheader()
+                writer.writerows(items)
+        return files
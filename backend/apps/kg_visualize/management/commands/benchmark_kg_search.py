@@ -0,0 +1,65 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from backend.apps.kg_visualize.models import Entity
+from backend.apps.kg_visualize.search import index_available, search_entities
+
+WORDS = [
+    "人工智能", "机器学习", "深度学习", "神经网络", "计算机视觉", "自然语言处理", "知识图谱",
+    "强化学习", "数据挖掘", "推荐系统", "语音识别", "图像分割", "目标检测", "迁移学习",
+    "transformer", "embedding", "optimizer", "gradient", "attention", "benchmark",
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare entity search latency of the full-text index against icontains scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entities', type=int, default=1000000, help='Number of synthetic entities (default: 1000000)')
+        parser.add_argument('--queries', type=int, default=20, help='Number of search queries to time (default: 20)')
+        parser.add_argument('--limit', type=int, default=50, help='Result limit per query (default: 50)')
+
+    def handle(self, *args, **options):
+        if not index_available():
+            self.stderr.write("Full-text index is not available on this database; run migrate first")
+            return
+        rng = random.Random(0)
+        # 所有数据都在一个事务内生成并在结束时回滚，不会留下测试数据，也不写变更日志
+        with transaction.atomic():
+            self._populate(options['entities'], rng)
+            queries = [rng.choice(WORDS) + str(rng.randrange(100)) for _ in range(options['queries'])]
+            scan = self._time(queries, lambda q: list(
+                Entity.objects.filter(Q(id__icontains=q) | Q(name__icontains=q) | Q(description__icontains=q))
+                .values('id', 'name', 'type', 'description', 'domain')[:options['limit']]
+            ))
+            indexed = self._time(queries, lambda q: search_entities(q, options['limit']))
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"icontains scan: {scan * 1000:.1f} ms/query")
+        self.stdout.write(f"full-text index: {indexed * 1000:.1f} ms/query")
+        self.stdout.write(self.style.SUCCESS(f"speedup: {scan / max(indexed, 1e-9):.1f}x"))
+
+    def _populate(self, count, rng, batch=10000):
+        start = time.perf_counter()
+        for offset in range(0, count, batch):
+            Entity.objects.bulk_create([
+                Entity(
+                    id=f"bench_{i}",
+                    name=f"{rng.choice(WORDS)}{i}",
+                    type="benchmark",
+                    description=" ".join(rng.choice(WORDS) + str(rng.randrange(100)) for _ in range(6)),
+                    domain="__benchmark__",
+                )
+                for i in range(offset, min(offset + batch, count))
+            ])
+        self.stdout.write(f"Inserted {count} entities in {time.perf_counter() - start:.1f}s")
+
+    @staticmethod
+    def _time(queries, run):
+        start = time.perf_counter()
+        for q in queries:
+            run(q)
+        return (time.perf_counter() - start) / len(queries)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from backend.apps.kg_visualize.communities import compute_communities
+from backend.apps.kg_visualize.models import Entity
+from backend.apps.kg_visualize.versioning import ALL_DOMAINS
+
+
+class Command(BaseCommand):
+    help = 'Precompute the community hierarchy used by /api/kg/data?lod=N'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--domain',
+            action='append',
+            help='Domain to cluster (repeatable); defaults to every domain plus "all"'
+        )
+
+    def handle(self, *args, **options):
+        domains = options['domain']
+        if not domains:
+            domains = sorted(Entity.objects.values_list('domain', flat=True).distinct()) + [ALL_DOMAINS]
+        for domain in domains:
+            communities = compute_communities(domain)
+            sizes = [max(level) + 1 if len(level) else 0 for level in communities.levels()]
+            self.stdout.write(self.style.SUCCESS(
+                f"Computed communities for {domain}: {communities.node_count} nodes, clusters per level {sizes}"
+            ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from backend.apps.kg_visualize.layout import compute_layout
+from backend.apps.kg_visualize.models import Entity
+from backend.apps.kg_visualize.versioning import ALL_DOMAINS
+
+
+class Command(BaseCommand):
+    help = 'Precompute the server-side force-directed layout for knowledge graph domains'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--domain',
+            action='append',
+            help='Domain to lay out (repeatable); defaults to every domain plus "all"'
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Ignore the previous layout and recompute from scratch'
+        )
+
+    def handle(self, *args, **options):
+        domains = options['domain']
+        if not domains:
+            domains = sorted(Entity.objects.values_list('domain', flat=True).distinct()) + [ALL_DOMAINS]
+        for domain in domains:
+            layout = compute_layout(domain, warm=not options['cold'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Computed layout for {domain}: {layout.node_count} nodes (version {layout.version})"
+            ))
@@ -1,20 +1,60 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import DatabaseError, connection, transaction
 from django.core.files import File
+from backend.apps.kg_visualize import checkpoints
+from backend.apps.kg_visualize.importer import GraphImporter, new_stats
+from backend.apps.kg_visualize.import_pipeline import FORMATS, Shard, ShardError, iter_batches, iter_chunks, read_spool
 from backend.apps.kg_visualize.models import Entity, Relationship
+from backend.apps.kg_visualize.versioning import coalesce_writes
 import json
 import os
 import sys
+import tempfile
+import time
+
+# 流式导入时进度输出的最小间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+
+class _QueryCounter:
+    """统计执行的 SQL 条数（connection.execute_wrapper）"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
 
 
 class Command(BaseCommand):
-    help = 'Import knowledge graph data from JSON file with conflict resolution'
+    help = 'Import knowledge graph data from JSON, NDJSON or CSV files with conflict resolution'
 
     def add_arguments(self, parser):
         parser.add_argument(
             'file_path',
             type=str,
-            help='Path to the JSON file containing graph data'
+            nargs='*',
+            help='Path to the JSON file containing graph data (several pre-split files with --stream/--workers)'
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default='json',
+            help='Input format; ndjson and csv read --entities/--relationships files and imply --stream (default: json)'
+        )
+        parser.add_argument(
+            '--entities',
+            action='append',
+            default=[],
+            help='NDJSON/CSV file with one entity per row (repeatable)'
+        )
+        parser.add_argument(
+            '--relationships',
+            action='append',
+            default=[],
+            help='NDJSON/CSV file with one relationship per row (repeatable)'
         )
         parser.add_argument(
             '--domain',
@@ -46,18 +86,78 @@ class Command(BaseCommand):
             action='store_true',
             help='Enable verbose output'
         )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            help='Parse the file incrementally and commit every --batch-size rows (for very large files)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Rows per committed batch in streaming mode (default: KG_IMPORT_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Parse and validate input files in N worker processes (implies --stream)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue an interrupted streaming import of the same files and options after its last '
+                 'committed batch (implies --stream, not available with --workers)'
+        )
 
     def handle(self, *args, **options):
-        file_path = options['file_path']
+        paths = options['file_path']
         domain = options['domain']
         strategy = options['strategy']
         conflict_resolution = options['conflict_resolution']
         dry_run = options['dry_run']
         verbose = options['verbose']
 
+        fmt = options['format']
+        if fmt == 'json':
+            if options['entities'] or options['relationships']:
+                raise CommandError("--entities/--relationships require --format ndjson or csv")
+            if not paths:
+                raise CommandError("No input file given")
+            shards = [Shard(path, fmt) for path in paths]
+        else:
+            if paths:
+                raise CommandError(f"--format {fmt} reads --entities/--relationships files, not positional files")
+            shards = [Shard(path, fmt, 'nodes') for path in options['entities']]
+            shards += [Shard(path, fmt, 'links') for path in options['relationships']]
+            if not shards:
+                raise CommandError(f"--format {fmt} requires --entities and/or --relationships")
+
         # 检查文件是否存在
-        if not os.path.exists(file_path):
-            raise CommandError(f"File not found: {file_path}")
+        for shard in shards:
+            if not os.path.exists(shard.path):
+                raise CommandError(f"File not found: {shard.path}")
+
+        if options['stream'] or options['workers'] or options['resume'] or fmt != 'json':
+            if dry_run:
+                raise CommandError("--dry-run is only available for a single JSON file without --stream/--workers")
+            batch_size = options['batch_size'] or getattr(settings, 'KG_IMPORT_BATCH_SIZE', 1000)
+            if batch_size < 1 or options['workers'] < 0:
+                raise CommandError("--batch-size and --workers must be positive")
+            if options['workers']:
+                if options['resume']:
+                    raise CommandError("--resume is not available with --workers")
+                stats = self._stream_import(shards, domain, strategy, conflict_resolution, batch_size,
+                                            options['workers'], verbose)
+            else:
+                stats = self._checkpointed_import(shards, domain, strategy, conflict_resolution, batch_size,
+                                                  options['resume'], verbose)
+            self._print_results(stats, verbose)
+            return
+
+        if len(paths) > 1:
+            raise CommandError("Importing several files requires --stream or --workers")
+        file_path = paths[0]
 
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
@@ -95,83 +195,107 @@ class Command(BaseCommand):
         self._print_results(stats, verbose)
 
     def _dry_run_import(self, nodes, links, domain, strategy, conflict_resolution, verbose):
-        """执行模拟导入，不实际保存数据"""
-        stats = {
-            "entities": {"created": 0, "updated": 0, "skipped": 0, "conflicts": 0},
-            "relationships": {"created": 0, "skipped": 0, "errors": 0},
-            "conflicts": []
-        }
-
-        # 模拟实体导入
+        """
+        执行模拟导入，不实际保存数据
+
+        领域内已有的实体与关系键各用一条查询读入内存，之后按实际导入的规则
+        （包括文件内重复 ID、auto_id 的新 ID 与连线端点映射）逐行模拟，
+        查询数与输入规模无关。
+        """
+        stats = new_stats()
+        counter = _QueryCounter()
+        with connection.execute_wrapper(counter):
+            # 实体 ID -> [type, description]，模拟过程中新建的实体也加入其中
+            entities = {
+                entity_id: [entity_type, description]
+                for entity_id, entity_type, description in Entity.objects.filter(domain=domain)
+                .order_by().values_list('id', 'type', 'description').iterator(chunk_size=10000)
+            }
+            # (source, target, type) -> description
+            relationships = {}
+            for source, target, rel_type, description in Relationship.objects.filter(domain=domain) \
+                    .order_by('id').values_list('source_id', 'target_id', 'type', 'description') \
+                    .iterator(chunk_size=10000):
+                relationships.setdefault((source, target, rel_type), description)
+        stats["queries"] = counter.count
+
+        entity_id_mapping = {}
         for node in nodes:
             node_id = node.get("id")
             name = node.get("name")
-            
+
             if not node_id or not name:
                 stats["entities"]["errors"] += 1
                 continue
 
-            existing_entity = Entity.objects.filter(id=node_id, domain=domain).first()
-            
-            if existing_entity:
-                if conflict_resolution == "skip":
-                    stats["entities"]["skipped"] += 1
-                elif conflict_resolution == "merge_data":
-                    # 检查是否需要更新
-                    if (not existing_entity.type and node.get("type")) or \
-                       (not existing_entity.description and node.get("description")):
-                        stats["entities"]["updated"] += 1
-                    else:
-                        stats["entities"]["skipped"] += 1
-                elif conflict_resolution == "auto_id":
-                    stats["entities"]["conflicts"] += 1
-                    stats["entities"]["created"] += 1
-            else:
+            existing_entity = entities.get(str(node_id))
+            if existing_entity is None:
+                entities[str(node_id)] = [node.get("type", ""), node.get("description", "")]
+                entity_id_mapping[node_id] = node_id
+                stats["entities"]["created"] += 1
+            elif conflict_resolution == "skip":
+                stats["entities"]["skipped"] += 1
+                entity_id_mapping[node_id] = node_id
+            elif conflict_resolution == "merge_data":
+                # 检查是否需要更新
+                updated = False
+                if not existing_entity[0] and node.get("type"):
+                    existing_entity[0] = node.get("type")
+                    updated = True
+                if not existing_entity[1] and node.get("description"):
+                    existing_entity[1] = node.get("description")
+                    updated = True
+                stats["entities"]["updated" if updated else "skipped"] += 1
+                entity_id_mapping[node_id] = node_id
+            elif conflict_resolution == "auto_id":
+                stats["entities"]["conflicts"] += 1
+                suffix = 1
+                while f"{node_id}_{suffix}" in entities:
+                    suffix += 1
+                new_id = f"{node_id}_{suffix}"
+                entities[new_id] = [node.get("type", ""), node.get("description", "")]
+                entity_id_mapping[node_id] = new_id
                 stats["entities"]["created"] += 1
+                if verbose:
+                    self.stdout.write(f"  Would create entity with new ID: {node_id} -> {new_id}")
 
         # 模拟关系导入
         for link in links:
             source = link.get("source")
             target = link.get("target")
             rel_type = link.get("type")
-            
+            description = link.get("description", "")
+
             if not source or not target or not rel_type or source == target:
                 stats["relationships"]["errors"] += 1
                 continue
 
-            # 检查源和目标实体是否存在
-            src_exists = Entity.objects.filter(id=source, domain=domain).exists()
-            tgt_exists = Entity.objects.filter(id=target, domain=domain).exists()
-            
-            if not src_exists or not tgt_exists:
+            mapped_source = entity_id_mapping.get(source)
+            mapped_target = entity_id_mapping.get(target)
+            if not mapped_source or not mapped_target:
                 stats["relationships"]["errors"] += 1
                 continue
 
-            # 检查关系是否已存在
-            src = Entity.objects.get(id=source, domain=domain)
-            tgt = Entity.objects.get(id=target, domain=domain)
-            existing_rel = Relationship.objects.filter(
-                source=src, target=tgt, type=rel_type, domain=domain
-            ).first()
-            
-            if existing_rel:
-                if strategy == "skip":
-                    stats["relationships"]["skipped"] += 1
-                elif strategy == "merge":
-                    stats["relationships"]["created"] += 1  # 算作更新
-            else:
+            key = (str(mapped_source), str(mapped_target), rel_type)
+            if key not in relationships:
+                relationships[key] = description
                 stats["relationships"]["created"] += 1
+            elif strategy == "skip":
+                stats["relationships"]["skipped"] += 1
+            elif strategy == "merge":
+                if not relationships[key] and description:
+                    relationships[key] = description
+                    stats["relationships"]["created"] += 1  # 算作更新
+                else:
+                    stats["relationships"]["skipped"] += 1
 
         return stats
 
     @transaction.atomic
+    @coalesce_writes()
     def _perform_import(self, nodes, links, domain, strategy, conflict_resolution, verbose):
         """执行实际导入"""
-        stats = {
-            "entities": {"created": 0, "updated": 0, "skipped": 0, "conflicts": 0},
-            "relationships": {"created": 0, "skipped": 0, "errors": 0},
-            "conflicts": []
-        }
+        stats = new_stats()
 
         entity_id_mapping = {}
 
@@ -310,6 +434,132 @@ class Command(BaseCommand):
 
         return stats
 
+    def _checkpointed_import(self, shards, domain, strategy, conflict_resolution, batch_size, resume, verbose):
+        """
+        顺序流式导入：先读取全部文件中的实体，再读取全部关系（json 文件读两遍），
+        每 batch_size 行提交一次。
+
+        每个批次与导入检查点（文件、字节偏移、批次号、新增的 ID 映射）在同一事务中提交，
+        中断后用 --resume 从最后提交的批次之后继续。行直接以 executemany 插入
+        （GraphImporter native 模式），变更日志中只为领域记录 reset。
+        """
+        importer = GraphImporter(domain, strategy, conflict_resolution, batch_size, native=True)
+        try:
+            if resume:
+                checkpoint = checkpoints.find_resumable(shards, domain, strategy, conflict_resolution)
+                self.stdout.write(
+                    f"Resuming after batch {checkpoint.chunk}: {checkpoint.phase} "
+                    f"of {checkpoint.file or 'the next file'} from byte {checkpoint.offset}"
+                )
+            else:
+                checkpoint, discarded = checkpoints.start(shards, domain, strategy, conflict_resolution)
+                if discarded:
+                    self.stdout.write(self.style.WARNING(
+                        "Discarded the checkpoint of an unfinished import of the same files; "
+                        "use --resume to continue an interrupted import instead"
+                    ))
+        except checkpoints.CheckpointError as e:
+            raise CommandError(str(e))
+        checkpoints.restore(checkpoint, importer)
+
+        progress = {"nodes": 0, "links": 0, "started": time.perf_counter(), "reported": 0.0}
+        resume_at = (checkpoints.PHASES.index(checkpoint.phase), checkpoint.shard)
+        for phase_index, phase in enumerate(checkpoints.PHASES):
+            for index, shard in enumerate(shards):
+                if shard.kind not in (None, phase) or (phase_index, index) < resume_at:
+                    continue
+                offset = checkpoint.offset if (phase_index, index) == resume_at else 0
+                try:
+                    for rows, errors, end in iter_chunks(shard._replace(kind=phase, start=offset), phase, batch_size):
+                        importer.stats['entities' if phase == 'nodes' else 'relationships']['errors'] += errors
+                        progress[phase] += errors
+                        if end is None:
+                            # 文件读完，下一批次从下一个文件开头读取
+                            position = (index + 1, 0, shards[index + 1].path if index + 1 < len(shards) else '')
+                        else:
+                            position = (index, end, shard.path)
+                        self._import_batch(importer, phase, rows, progress, verbose,
+                                           lambda: checkpoints.save(checkpoint, importer, phase, *position))
+                except ShardError as e:
+                    raise CommandError(f"{e} ({self._committed(progress)}; use --resume to continue)")
+
+        checkpoints.finish(checkpoint)
+        self._report_progress(progress, final=True)
+        return importer.stats
+
+    def _stream_import(self, shards, domain, strategy, conflict_resolution, batch_size, workers, verbose):
+        """
+        并行解析的流式导入：文件在 workers 个子进程中解析，写入仍在当前进程中串行进行，
+        每 batch_size 行提交一次。各分片按输入顺序写入，冲突处理的结果与 --stream 相同。
+
+        关系依赖实体的 ID 映射，解析时先暂存到临时文件，全部实体导入完成后再读回。
+        行直接以 executemany 插入（GraphImporter native 模式），变更日志中只为领域
+        记录 reset。已提交的批次在后续失败时不会回滚，也不记录检查点。
+        """
+        importer = GraphImporter(domain, strategy, conflict_resolution, batch_size, native=True)
+        progress = {"nodes": 0, "links": 0, "started": time.perf_counter(), "reported": 0.0}
+
+        with tempfile.TemporaryDirectory(prefix='kg-import-') as spool_dir:
+            spools = []
+            try:
+                for kind, payload in iter_batches(shards, batch_size, spool_dir, workers):
+                    if kind == 'nodes':
+                        self._import_batch(importer, 'nodes', payload, progress, verbose)
+                    elif kind == 'links':
+                        spools.append(payload)
+                    else:
+                        importer.stats['entities']['errors'] += payload['nodes']
+                        importer.stats['relationships']['errors'] += payload['links']
+                        progress['nodes'] += payload['nodes']
+                        progress['links'] += payload['links']
+            except ShardError as e:
+                raise CommandError(f"{e} ({self._committed(progress)})")
+
+            for spool in spools:
+                for links in read_spool(spool):
+                    self._import_batch(importer, 'links', links, progress, verbose)
+
+        self._report_progress(progress, final=True)
+        return importer.stats
+
+    def _import_batch(self, importer, key, rows, progress, verbose, checkpoint=None):
+        """导入一个批次；checkpoint 为记录检查点的回调，与批次在同一事务中提交"""
+        try:
+            with transaction.atomic(), coalesce_writes():
+                if key == 'nodes':
+                    importer.import_entities(rows)
+                else:
+                    importer.import_relationships(rows)
+                if checkpoint is not None:
+                    checkpoint()
+        except DatabaseError as e:
+            hint = '; use --resume to continue' if checkpoint is not None else ''
+            raise CommandError(f"Import failed: {e} ({self._committed(progress)}{hint})")
+        progress[key] += len(rows)
+
+        # 冲突明细随批次输出，不在内存中累积
+        if verbose:
+            for conflict in importer.stats['conflicts']:
+                self.stdout.write(f"  - {conflict['type']}: {conflict['message']}")
+        importer.stats['conflicts'].clear()
+        self._report_progress(progress)
+
+    def _report_progress(self, progress, final=False):
+        now = time.perf_counter()
+        if not final and now - progress['reported'] < PROGRESS_INTERVAL:
+            return
+        progress['reported'] = now
+        elapsed = max(now - progress['started'], 1e-9)
+        rows = progress['nodes'] + progress['links']
+        self.stdout.write(
+            f"{'Finished' if final else 'Progress'}: {progress['nodes']} nodes, {progress['links']} links "
+            f"in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)"
+        )
+
+    @staticmethod
+    def _committed(progress):
+        return f"{progress['nodes']} nodes and {progress['links']} links were already committed"
+
     def _print_results(self, stats, verbose):
         """打印导入结果"""
         self.stdout.write("\n" + "="*50)
@@ -332,6 +582,9 @@ class Command(BaseCommand):
         if stats['relationships']['errors'] > 0:
             self.stdout.write(f"  Errors: {stats['relationships']['errors']}")
 
+        if 'queries' in stats:
+            self.stdout.write(f"\nSQL queries: {stats['queries']}")
+
         # 冲突详情
         if stats['conflicts'] and verbose:
             self.stdout.write("\nConflicts:")
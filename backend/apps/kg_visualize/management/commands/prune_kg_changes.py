@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from backend.apps.kg_visualize import changefeed
+
+
+class Command(BaseCommand):
+    help = 'Prune the knowledge graph change log, keeping only the newest entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=getattr(settings, 'KG_CHANGES_RETENTION', 100000),
+            help='Number of newest change log entries to keep (default: KG_CHANGES_RETENTION)'
+        )
+
+    def handle(self, *args, **options):
+        deleted = changefeed.prune(options['keep'])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} change log entries"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from backend.apps.kg_visualize import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the SQLite entity full-text index (needed after VACUUM)'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} entities"))
@@ -1,12 +1,14 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from backend.apps.kg_visualize.models import Entity, Relationship
+from backend.apps.kg_visualize.versioning import coalesce_writes
 
 
 class Command(BaseCommand):
     help = 'Seed demo knowledge graph data (idempotent)'
 
     @transaction.atomic
+    @coalesce_writes()
     def handle(self, *args, **options):
         entities = [
             {"id": "1", "name": "人工智能", "description": "研究如何使机器模拟人类智能的科学"},
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0002_alter_relationship_unique_together_entity_domain_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainVersion',
+            fields=[
+                ('domain', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='domain')),
+                ('version', models.BigIntegerField(default=0, verbose_name='graphVersion')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updatedTime')),
+            ],
+            options={
+                'verbose_name': 'domainVersion',
+                'verbose_name_plural': 'domainVersion',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0003_domainversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False, verbose_name='sequence')),
+                ('domain', models.CharField(max_length=100, verbose_name='domain')),
+                ('kind', models.CharField(max_length=20, verbose_name='objectKind')),
+                ('object_id', models.CharField(blank=True, max_length=100, verbose_name='objectID')),
+                ('op', models.CharField(max_length=10, verbose_name='operation')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='createdTime')),
+            ],
+            options={
+                'verbose_name': 'graphChange',
+                'verbose_name_plural': 'graphChange',
+                'indexes': [models.Index(fields=['domain', 'seq'], name='kg_change_domain_seq')],
+            },
+        ),
+    ]
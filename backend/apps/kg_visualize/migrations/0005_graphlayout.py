@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0004_graphchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphLayout',
+            fields=[
+                ('domain', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='domain')),
+                ('version', models.BigIntegerField(verbose_name='graphVersion')),
+                ('node_count', models.IntegerField(default=0, verbose_name='nodeCount')),
+                ('node_ids', models.TextField(verbose_name='nodeIDs')),
+                ('positions', models.BinaryField(verbose_name='positions')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='computedTime')),
+            ],
+            options={
+                'verbose_name': 'graphLayout',
+                'verbose_name_plural': 'graphLayout',
+            },
+        ),
+    ]
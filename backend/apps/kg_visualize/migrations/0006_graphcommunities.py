@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0005_graphlayout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphCommunities',
+            fields=[
+                ('domain', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='domain')),
+                ('version', models.BigIntegerField(verbose_name='graphVersion')),
+                ('node_count', models.IntegerField(default=0, verbose_name='nodeCount')),
+                ('level_count', models.IntegerField(default=0, verbose_name='levelCount')),
+                ('node_ids', models.TextField(verbose_name='nodeIDs')),
+                ('memberships', models.BinaryField(verbose_name='memberships')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='computedTime')),
+            ],
+            options={
+                'verbose_name': 'graphCommunities',
+                'verbose_name_plural': 'graphCommunities',
+            },
+        ),
+    ]
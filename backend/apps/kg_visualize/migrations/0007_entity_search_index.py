@@ -0,0 +1,72 @@
+from django.db import migrations
+
+FTS_TABLE = "kg_entity_fts"
+MYSQL_INDEX = "kg_entity_fulltext"
+ENTITY_TABLE = "kg_visualize_entity"
+
+SQLITE_FORWARD = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(entity_id, name, description, tokenize='trigram')",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {ENTITY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, entity_id, name, description) VALUES (new.rowid, new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {ENTITY_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF id, name, description ON {ENTITY_TABLE} BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+        INSERT INTO {FTS_TABLE}(rowid, entity_id, name, description) VALUES (new.rowid, new.id, new.name, new.description);
+    END""",
+    f"INSERT INTO {FTS_TABLE}(rowid, entity_id, name, description) SELECT rowid, id, name, description FROM {ENTITY_TABLE}",
+]
+
+SQLITE_BACKWARD = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def _sqlite_has_trigram(cursor):
+    # trigram 分词器需要 SQLite 3.34+，且编译时启用了 FTS5
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.kg_fts_probe USING fts5(x, tokenize='trigram')")
+        cursor.execute("DROP TABLE temp.kg_fts_probe")
+        return True
+    except Exception:
+        return False
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            if not _sqlite_has_trigram(cursor):
+                return
+            for sql in SQLITE_FORWARD:
+                cursor.execute(sql)
+        elif connection.vendor == "mysql":
+            cursor.execute(
+                f"ALTER TABLE {ENTITY_TABLE} ADD FULLTEXT INDEX {MYSQL_INDEX} (id, name, description) WITH PARSER ngram"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            for sql in SQLITE_BACKWARD:
+                cursor.execute(sql)
+        elif connection.vendor == "mysql":
+            cursor.execute(f"ALTER TABLE {ENTITY_TABLE} DROP INDEX {MYSQL_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0006_graphcommunities'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
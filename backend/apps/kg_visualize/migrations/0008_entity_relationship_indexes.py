@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0007_entity_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['domain', 'updated_at'], name='kg_entity_domain_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['domain', 'id'], name='kg_entity_domain_id'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['domain', 'type'], name='kg_entity_domain_type'),
+        ),
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['domain', 'id'], name='kg_rel_domain_id'),
+        ),
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['domain', 'source'], name='kg_rel_domain_source'),
+        ),
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['domain', 'target'], name='kg_rel_domain_target'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0008_entity_relationship_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=64, verbose_name='importKey')),
+                ('domain', models.CharField(max_length=100, verbose_name='domain')),
+                ('files', models.TextField(verbose_name='files')),
+                ('phase', models.CharField(default='nodes', max_length=10, verbose_name='phase')),
+                ('shard', models.IntegerField(default=0, verbose_name='shardIndex')),
+                ('file', models.CharField(blank=True, max_length=500, verbose_name='currentFile')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='byteOffset')),
+                ('chunk', models.IntegerField(default=0, verbose_name='chunkNumber')),
+                ('stats', models.TextField(blank=True, verbose_name='stats')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='createdTime')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updatedTime')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finishedTime')),
+            ],
+            options={
+                'verbose_name': 'importCheckpoint',
+                'verbose_name_plural': 'importCheckpoint',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportMappingChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk', models.IntegerField(verbose_name='chunkNumber')),
+                ('mapping', models.TextField(verbose_name='mapping')),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mapping_chunks', to='kg_visualize.importcheckpoint', verbose_name='checkpoint')),
+            ],
+            options={
+                'verbose_name': 'importMappingChunk',
+                'verbose_name_plural': 'importMappingChunk',
+                'unique_together': {('checkpoint', 'chunk')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kg_visualize', '0009_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphJob',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='jobID')),
+                ('kind', models.CharField(max_length=10, verbose_name='jobKind')),
+                ('domain', models.CharField(max_length=100, verbose_name='domain')),
+                ('status', models.CharField(default='pending', max_length=10, verbose_name='status')),
+                ('worker', models.CharField(blank=True, max_length=100, verbose_name='worker')),
+                ('params', models.TextField(blank=True, verbose_name='params')),
+                ('processed', models.BigIntegerField(default=0, verbose_name='processedRows')),
+                ('total', models.BigIntegerField(blank=True, null=True, verbose_name='totalRows')),
+                ('result', models.TextField(blank=True, verbose_name='result')),
+                ('result_file', models.CharField(blank=True, max_length=500, verbose_name='resultFile')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='createdTime')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='startedTime')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finishedTime')),
+            ],
+            options={
+                'verbose_name': 'graphJob',
+                'verbose_name_plural': 'graphJob',
+            },
+        ),
+    ]
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import json
+from array import array
+
 from django.db import models
 
 class Entity(models.Model):
@@ -20,10 +23,24 @@ class Entity(models.Model):
         app_label = "kg_visualize"
         # 增加复合唯一约束，同一领域内ID唯一
         unique_together = [("id", "domain")]
+        indexes = [
+            # 按领域取实体（默认按更新时间倒序）
+            models.Index(fields=["domain", "updated_at"], name="kg_entity_domain_updated"),
+            # 按 (domain, id) 的游标分页
+            models.Index(fields=["domain", "id"], name="kg_entity_domain_id"),
+            models.Index(fields=["domain", "type"], name="kg_entity_domain_type"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.id}) - {self.domain}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的领域，修改领域后新旧两个领域都需要更新版本
+        instance._loaded_domain = instance.__dict__.get("domain")
+        return instance
+
 
 class Relationship(models.Model):
     """
@@ -49,9 +66,208 @@ class Relationship(models.Model):
     class Meta:
         verbose_name = "entityRelation"
         verbose_name_plural = "entityRelation"
-        # 同一领域内避免重复关系
+        # 同一领域内避免重复关系（该唯一索引同时服务于按 source/target/type 的查重）
         unique_together = [("source", "target", "type", "domain")]
+        indexes = [
+            # 按领域取关系，以及按 id 的游标分页
+            models.Index(fields=["domain", "id"], name="kg_rel_domain_id"),
+            models.Index(fields=["domain", "source"], name="kg_rel_domain_source"),
+            models.Index(fields=["domain", "target"], name="kg_rel_domain_target"),
+        ]
+        app_label = "kg_visualize"
+
+    def __str__(self):
+        return f"{self.source.name} -[{self.type}]-> {self.target.name} ({self.domain})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_domain = instance.__dict__.get("domain")
+        return instance
+
+
+class DomainVersion(models.Model):
+    """
+    per-domain graph version, bumped on every entity/relationship write
+    """
+    domain = models.CharField(max_length=100, primary_key=True, verbose_name="domain")
+    version = models.BigIntegerField(default=0, verbose_name="graphVersion")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="updatedTime")
+
+    class Meta:
+        verbose_name = "domainVersion"
+        verbose_name_plural = "domainVersion"
+        app_label = "kg_visualize"
+
+    def __str__(self):
+        return f"{self.domain} v{self.version}"
+
+
+class GraphChange(models.Model):
+    """
+    append-only change log of entity/relationship writes
+    """
+    KIND_ENTITY = "entity"
+    KIND_RELATIONSHIP = "relationship"
+    KIND_DOMAIN = "domain"
+
+    OP_INSERT = "insert"
+    OP_UPDATE = "update"
+    OP_DELETE = "delete"
+    OP_RESET = "reset"  # 领域数据被整体替换，客户端需要重新加载
+
+    seq = models.BigAutoField(primary_key=True, verbose_name="sequence")
+    domain = models.CharField(max_length=100, verbose_name="domain")
+    kind = models.CharField(max_length=20, verbose_name="objectKind")
+    object_id = models.CharField(max_length=100, blank=True, verbose_name="objectID")
+    op = models.CharField(max_length=10, verbose_name="operation")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="createdTime")
+
+    class Meta:
+        verbose_name = "graphChange"
+        verbose_name_plural = "graphChange"
+        app_label = "kg_visualize"
+        indexes = [models.Index(fields=["domain", "seq"], name="kg_change_domain_seq")]
+
+    def __str__(self):
+        return f"#{self.seq} {self.op} {self.kind} {self.object_id} ({self.domain})"
+
+
+class GraphLayout(models.Model):
+    """
+    precomputed node positions of one domain at a graph version
+    """
+    domain = models.CharField(max_length=100, primary_key=True, verbose_name="domain")
+    version = models.BigIntegerField(verbose_name="graphVersion")
+    node_count = models.IntegerField(default=0, verbose_name="nodeCount")
+    node_ids = models.TextField(verbose_name="nodeIDs")  # JSON 数组，与 positions 一一对应
+    positions = models.BinaryField(verbose_name="positions")  # float32 的 (x, y) 序列
+    computed_at = models.DateTimeField(auto_now=True, verbose_name="computedTime")
+
+    class Meta:
+        verbose_name = "graphLayout"
+        verbose_name_plural = "graphLayout"
+        app_label = "kg_visualize"
+
+    def __str__(self):
+        return f"{self.domain} layout v{self.version} ({self.node_count} nodes)"
+
+    def positions_by_id(self):
+        coords = array("f")
+        coords.frombytes(bytes(self.positions))
+        ids = json.loads(self.node_ids)
+        return {node_id: (coords[2 * i], coords[2 * i + 1]) for i, node_id in enumerate(ids)}
+
+
+class GraphCommunities(models.Model):
+    """
+    community hierarchy of one domain at a graph version
+    """
+    domain = models.CharField(max_length=100, primary_key=True, verbose_name="domain")
+    version = models.BigIntegerField(verbose_name="graphVersion")
+    node_count = models.IntegerField(default=0, verbose_name="nodeCount")
+    level_count = models.IntegerField(default=0, verbose_name="levelCount")
+    node_ids = models.TextField(verbose_name="nodeIDs")  # JSON 数组，与 memberships 每层一一对应
+    memberships = models.BinaryField(verbose_name="memberships")  # int32，逐层存放每个节点所属社区
+    computed_at = models.DateTimeField(auto_now=True, verbose_name="computedTime")
+
+    class Meta:
+        verbose_name = "graphCommunities"
+        verbose_name_plural = "graphCommunities"
+        app_label = "kg_visualize"
+
+    def __str__(self):
+        return f"{self.domain} communities v{self.version} ({self.level_count} levels)"
+
+    def levels(self):
+        """返回每层的社区编号数组（第 1 层在前）"""
+        labels = array("i")
+        labels.frombytes(bytes(self.memberships))
+        n = self.node_count
+        return [labels[level * n:(level + 1) * n] for level in range(self.level_count)]
+
+
+class ImportCheckpoint(models.Model):
+    """
+    progress of a chunked import_kg_data run, updated in the same transaction as each chunk
+    """
+    PHASE_NODES = "nodes"
+    PHASE_LINKS = "links"
+
+    key = models.CharField(max_length=64, db_index=True, verbose_name="importKey")  # 输入文件与导入选项的摘要
+    domain = models.CharField(max_length=100, verbose_name="domain")
+    files = models.TextField(verbose_name="files")  # JSON 数组，[路径, 格式, 类型, 大小, 修改时间]
+    phase = models.CharField(max_length=10, default=PHASE_NODES, verbose_name="phase")
+    shard = models.IntegerField(default=0, verbose_name="shardIndex")  # 当前文件在 files 中的下标
+    file = models.CharField(max_length=500, blank=True, verbose_name="currentFile")
+    offset = models.BigIntegerField(default=0, verbose_name="byteOffset")  # 当前文件已提交部分之后的字节位置
+    chunk = models.IntegerField(default=0, verbose_name="chunkNumber")  # 已提交的批次数
+    stats = models.TextField(blank=True, verbose_name="stats")  # JSON，累计的导入统计
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="createdTime")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="updatedTime")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="finishedTime")
+
+    class Meta:
+        verbose_name = "importCheckpoint"
+        verbose_name_plural = "importCheckpoint"
+        app_label = "kg_visualize"
+
+    def __str__(self):
+        return f"import into {self.domain}: {self.phase} chunk {self.chunk} ({self.file}@{self.offset})"
+
+
+class ImportMappingChunk(models.Model):
+    """
+    original-to-stored entity ID pairs added by one committed chunk of a checkpointed import
+    """
+    checkpoint = models.ForeignKey(
+        ImportCheckpoint, on_delete=models.CASCADE, related_name="mapping_chunks", verbose_name="checkpoint"
+    )
+    chunk = models.IntegerField(verbose_name="chunkNumber")
+    mapping = models.TextField(verbose_name="mapping")  # JSON 数组，[原 ID, 新 ID]，新 ID 为 null 表示删除
+
+    class Meta:
+        verbose_name = "importMappingChunk"
+        verbose_name_plural = "importMappingChunk"
+        app_label = "kg_visualize"
+        unique_together = ("checkpoint", "chunk")
+
+    def __str__(self):
+        return f"checkpoint {self.checkpoint_id} chunk {self.chunk}"
+
+
+class GraphJob(models.Model):
+    """
+    background import/export/community job executed by the in-process job runner
+    """
+    KIND_IMPORT = "import"
+    KIND_EXPORT = "export"
+    KIND_COMMUNITIES = "community"
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+
+    id = models.CharField(max_length=32, primary_key=True, verbose_name="jobID")  # uuid4 十六进制
+    kind = models.CharField(max_length=10, verbose_name="jobKind")
+    domain = models.CharField(max_length=100, verbose_name="domain")
+    status = models.CharField(max_length=10, default=STATUS_PENDING, verbose_name="status")
+    worker = models.CharField(max_length=100, blank=True, verbose_name="worker")  # 执行任务的 主机名:进程号:启动标识
+    params = models.TextField(blank=True, verbose_name="params")  # JSON，任务参数
+    processed = models.BigIntegerField(default=0, verbose_name="processedRows")
+    total = models.BigIntegerField(null=True, blank=True, verbose_name="totalRows")  # 未知时为空
+    result = models.TextField(blank=True, verbose_name="result")  # JSON，导入报告
+    result_file = models.CharField(max_length=500, blank=True, verbose_name="resultFile")  # 导出文件路径
+    error = models.TextField(blank=True, verbose_name="error")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="createdTime")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="startedTime")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="finishedTime")
+
+    class Meta:
+        verbose_name = "graphJob"
+        verbose_name_plural = "graphJob"
         app_label = "kg_visualize"
 
     def __str__(self):
-        return f"{self.source.name} -[{self.type}]-> {self.target.name} ({self.domain})"
\ No newline at end of file
+        return f"{self.kind} job {self.id} ({self.status})"
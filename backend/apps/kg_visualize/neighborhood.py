@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+k 跳邻域（ego-network）子图
+
+按跳数逐层在数据库中展开（广度优先），每层一批查询：
+- 每个父节点在每个方向上是一个带 ORDER BY id LIMIT fanout + 1 的子查询（UNION ALL
+  拼接，每条语句 PARENT_BATCH 个父节点），数据库只读取每个节点的前 fanout + 1 条
+  关系，枢纽节点不会读取全部关系、也不会挤占其它分支；多出的一条用于判断截断，
+  并抵消指回上一层的关系；
+- 已访问的节点不再展开，经多个父节点到达的节点只记一次（取编号最小的父节点）；
+- 每个节点最多带入 fanout 个新邻居，子图总节点数不超过 limit，读取的关系行数
+  合计不超过 KG_NEIGHBORHOOD_MAX_ROWS。
+返回的子图为所选节点的导出子图（induced subgraph）。
+"""
+from django.conf import settings
+from django.db import connection
+
+from .models import Entity, Relationship
+from .streaming import LINK_FIELDS, NODE_FIELDS, link_to_d3, node_to_d3
+
+DIRECTIONS = ("in", "out", "both")
+# 每条语句展开的父节点数
+PARENT_BATCH = 100
+
+# 每个方向下：(父节点列, 邻居列)
+_COLUMNS = {"out": ("source_id", "target_id"), "in": ("target_id", "source_id")}
+
+
+def _expand(parents, direction, types, per_parent):
+    """
+    parents 各自在 direction 方向上按关系 ID 的前 per_parent 个邻居，
+    返回 (父节点, 邻居, 关系 ID, 方向) 行，同一父节点的行按关系 ID 排序。
+    """
+    table = connection.ops.quote_name(Relationship._meta.db_table)
+    type_filter = ""
+    if types:
+        type_filter = " AND type IN (%s)" % ", ".join(["%s"] * len(types))
+    parts, params = [], []
+    for side in (("out", "in") if direction == "both" else (direction,)):
+        near, far = _COLUMNS[side]
+        for parent in parents:
+            parts.append(
+                f"SELECT * FROM (SELECT {near} AS parent_id, {far} AS node_id, id, '{side}' AS side FROM {table} "
+                f"WHERE {near} = %s{type_filter} ORDER BY id LIMIT %s) AS t{len(parts)}"
+            )
+            params.extend([parent, *types, per_parent])
+    with connection.cursor() as cursor:
+        cursor.execute(" UNION ALL ".join(parts), params)
+        return sorted(cursor.fetchall(), key=lambda row: (row[0], row[2]))
+
+
+def _walk(entity_id, hops, direction, types, fanout, limit, max_rows):
+    """逐层展开，返回 ({节点 ID: 跳数}, 是否截断)"""
+    depths = {entity_id: 0}
+    frontier = [entity_id]
+    rows_read = 0
+    truncated = False
+    for depth in range(1, hops + 1):
+        next_frontier = []
+        for start in range(0, len(frontier), PARENT_BATCH):
+            if rows_read >= max_rows:
+                return depths, True
+            parents = frontier[start:start + PARENT_BATCH]
+            rows = _expand(parents, direction, types, fanout + 1)
+            rows_read += len(rows)
+            children, counts = {}, {}
+            for parent_id, node_id, _, side in rows:
+                children.setdefault(parent_id, []).append(node_id)
+                counts[parent_id, side] = counts.get((parent_id, side), 0) + 1
+            # 某个方向读满了 fanout + 1 条，说明还有未读取的关系
+            truncated = truncated or any(count > fanout for count in counts.values())
+            for parent in parents:
+                neighbours = children.get(parent, ())
+                added = 0
+                for node_id in neighbours:
+                    if node_id in depths:
+                        continue
+                    if added >= fanout:
+                        truncated = True
+                        break
+                    if len(depths) >= limit:
+                        return depths, True
+                    depths[node_id] = depth
+                    next_frontier.append(node_id)
+                    added += 1
+        frontier = next_frontier
+        if not frontier:
+            break
+    return depths, truncated
+
+
+def neighborhood(entity_id, hops=1, direction="both", types=None, limit=None, fanout=None):
+    limit = limit or getattr(settings, "KG_NEIGHBORHOOD_LIMIT", 500)
+    fanout = fanout or getattr(settings, "KG_NEIGHBORHOOD_FANOUT", 100)
+    max_rows = getattr(settings, "KG_NEIGHBORHOOD_MAX_ROWS", 20000)
+
+    depths, truncated = _walk(entity_id, hops, direction, types or [], fanout, limit, max_rows)
+
+    ids = list(depths)
+    nodes, links = [], []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        for e in Entity.objects.filter(id__in=chunk).order_by().values(*NODE_FIELDS):
+            node = node_to_d3(e)
+            node["depth"] = depths[e["id"]]
+            nodes.append(node)
+        relations = Relationship.objects.filter(source_id__in=chunk)
+        if types:
+            relations = relations.filter(type__in=types)
+        links.extend(
+            link_to_d3(r) for r in relations.order_by().values(*LINK_FIELDS)
+            if r["target_id"] in depths
+        )
+    nodes.sort(key=lambda n: (n["depth"], n["id"]))
+    links.sort(key=lambda l: l["id"])
+
+    return {"center": entity_id, "nodes": nodes, "links": links, "truncated": truncated}
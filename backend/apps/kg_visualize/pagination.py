@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+游标（keyset）分页
+
+不使用 OFFSET：每页按排序键从上一页最后一条记录之后继续读取，
+MySQL/SQLite 都可以直接走索引定位，翻到第几页耗时都一样。
+游标对客户端是不透明的字符串（base64 编码的 JSON）。
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise PaginationError("invalid cursor")
+    if not isinstance(state, dict):
+        raise PaginationError("invalid cursor")
+    return state
+
+
+def is_paginated(request):
+    """只有显式传入 limit 或 cursor 时才分页，保持旧接口返回全部数据的行为"""
+    return "limit" in request.GET or "cursor" in request.GET
+
+
+def parse_limit(request, default=None):
+    default = default or getattr(settings, "KG_PAGE_DEFAULT_LIMIT", 1000)
+    maximum = getattr(settings, "KG_PAGE_MAX_LIMIT", 10000)
+    try:
+        limit = int(request.GET.get("limit", default))
+    except (TypeError, ValueError):
+        raise PaginationError("'limit' must be an integer")
+    if limit <= 0:
+        raise PaginationError("'limit' must be positive")
+    return min(limit, maximum)
+
+
+def entity_page(queryset, after, limit):
+    """
+    按 (domain, id) 排序取一页实体。
+
+    after 为上一页最后一条的 [domain, id]，返回 (rows, next_after)，
+    没有下一页时 next_after 为 None。rows 需包含 domain 和 id 字段。
+    """
+    if after is not None:
+        domain, entity_id = after
+        queryset = queryset.filter(Q(domain__gt=domain) | Q(domain=domain, id__gt=entity_id))
+    rows = list(queryset.order_by("domain", "id")[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, [last["domain"], last["id"]]
+    return rows, None
+
+
+def relationship_page(queryset, after, limit):
+    """按 id 排序取一页关系，after 为上一页最后一条的 id"""
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    rows = list(queryset.order_by("id")[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+
+def read_after(state, kind):
+    """从游标中取出指定类型的位置，类型不匹配视为非法游标"""
+    if state is None:
+        return None
+    if state.get("k") != kind:
+        raise PaginationError("invalid cursor")
+    after = state.get("after")
+    if after is None:
+        return None
+    if kind == "entity" and not (isinstance(after, list) and len(after) == 2):
+        raise PaginationError("invalid cursor")
+    if kind == "relationship" and not isinstance(after, int):
+        raise PaginationError("invalid cursor")
+    return after
+
+
+def cursor_state(request, default=None):
+    token = request.GET.get("cursor")
+    if not token:
+        return default
+    return decode_cursor(token)
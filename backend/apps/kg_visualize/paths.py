@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+两个实体之间的路径：最短路径与有界的多条路径枚举
+
+在领域的邻接图引擎（graph_engine）上计算，不按跳数逐层查询数据库：
+- 最短路径：双向广度优先，每次扩展前沿较小的一侧，整层用数组运算展开；
+- k > 1：按长度从短到长枚举简单路径（不重复经过节点）。两侧的广度优先给出各节点
+  到起点 / 终点的跳数，深度优先时剪掉不可能在该位置出现的节点，逐个长度迭代加深，
+  得到按跳数排序的前 k 条路径。
+广度优先访问的节点数与深度优先展开的节点数合计不超过 KG_PATH_MAX_VISITED，达到
+上限时停止并标记 truncated（经过枢纽节点后前沿可能覆盖整个图）。
+direction 为 out 时沿关系方向，in 时逆着关系方向，both 时忽略方向。
+"""
+import numpy as np
+from django.conf import settings
+
+from .graph_engine import get_engine
+from .models import Entity, Relationship
+from .streaming import LINK_FIELDS, NODE_FIELDS, link_to_d3, node_to_d3
+from .versioning import ALL_DOMAINS
+
+DIRECTIONS = ("in", "out", "both")
+_REVERSE = {"out": "in", "in": "out", "both": "both"}
+
+
+class PathError(ValueError):
+    """路径查询的端点不在领域中"""
+
+
+class _Search:
+    """一次查询共用的状态：引擎、关系类型过滤与剩余访问预算"""
+
+    def __init__(self, engine, types, max_visited):
+        self.engine = engine
+        self.types = types
+        # 查询期间其它线程可能追加节点，只使用开始时的编号范围
+        self.node_count = engine.node_count
+        self.budget = max_visited
+        self.truncated = False
+
+    def spend(self, count):
+        self.budget -= count
+        if self.budget < 0:
+            self.truncated = True
+
+    def expand(self, nodes, direction):
+        """(起点编号, 另一端编号, 关系 ID)"""
+        parts = [
+            self.engine.expand(nodes, d, self.types)
+            for d in (("out", "in") if direction == "both" else (direction,))
+        ]
+        origins, others, _, rels = parts[0] if len(parts) == 1 else [np.concatenate(c) for c in zip(*parts)]
+        keep = others < self.node_count
+        return origins[keep], others[keep], rels[keep]
+
+
+class _Side:
+    """
+    从 root 出发的按层广度优先。dist 为各节点的跳数（-1 为未访问）；
+    layers[d] 为第 d 层的 (节点编号（升序）, 上一个节点, 经过的关系 ID)，用于回溯路径。
+    """
+
+    def __init__(self, search, root, direction):
+        self.search = search
+        self.direction = direction
+        self.dist = np.full(search.node_count, -1, dtype=np.int16)
+        self.dist[root] = 0
+        root = np.array([root], dtype=np.int64)
+        self.layers = [(root, root, np.array([-1], dtype=np.int64))]
+
+    @property
+    def depth(self):
+        return len(self.layers) - 1
+
+    @property
+    def frontier(self):
+        return self.layers[-1][0]
+
+    @property
+    def known(self):
+        """dist 对跳数不超过该值的节点是完整的；可达节点已全部访问时为无穷大"""
+        return self.depth if len(self.frontier) else float("inf")
+
+    def step(self):
+        """扩展一层，返回新访问的节点"""
+        origins, others, rels = self.search.expand(self.frontier, self.direction)
+        fresh = self.dist[others] < 0
+        others, first = np.unique(others[fresh], return_index=True)
+        self.dist[others] = self.depth + 1
+        self.layers.append((others, origins[fresh][first], rels[fresh][first]))
+        self.search.spend(len(others))
+        return others
+
+    def trace(self, node):
+        """从 root 到 node 的 (节点列表, 关系 ID 列表)"""
+        nodes, rels = [node], []
+        for depth in range(int(self.dist[node]), 0, -1):
+            layer, parents, via = self.layers[depth]
+            i = int(np.searchsorted(layer, node))
+            node = int(parents[i])
+            nodes.append(node)
+            rels.append(int(via[i]))
+        return nodes[::-1], rels[::-1]
+
+
+def _grow(forward, backward):
+    """扩展前沿较小的一侧一层，返回 (扩展的一侧, 另一侧, 新访问的节点)；两侧都已穷尽时返回 None"""
+    sides = sorted((forward, backward), key=lambda side: len(side.frontier) or float("inf"))
+    side, other = sides
+    if not len(side.frontier):
+        return None
+    return side, other, side.step()
+
+
+def _shortest(search, forward, backward, max_hops):
+    """双向广度优先，返回最短路径 (节点列表, 关系 ID 列表)，不超过 max_hops 跳时没有则返回 None"""
+    while forward.depth + backward.depth < max_hops and not search.truncated:
+        if not (len(forward.frontier) and len(backward.frontier)):
+            break  # 一侧可达的节点已全部访问
+        side, other, fresh = _grow(forward, backward)
+        meet = fresh[other.dist[fresh] >= 0]
+        if len(meet):
+            # 在前面各层都未相遇，本层相遇的节点给出的路径长度相同，取编号最小的
+            middle = int(meet[0])
+            head_nodes, head_rels = forward.trace(middle)
+            tail_nodes, tail_rels = backward.trace(middle)
+            return head_nodes + tail_nodes[::-1][1:], head_rels + tail_rels[::-1]
+    return None
+
+
+def _enumerate(search, forward, backward, max_hops, k, min_hops):
+    """
+    按长度 min_hops..max_hops 迭代加深，枚举不超过 k 条简单路径。
+
+    长度为 L 的路径上第 i 个节点 v 满足 dist_f(v) <= i 且 dist_b(v) <= L - i。两侧扩展到
+    forward.known + backward.known >= L 后，每个位置至少有一侧的 dist 是完整的：
+    L - i <= backward.known 时用 dist_b 剪枝，否则 i <= forward.known，用 dist_f 剪枝。
+    """
+    source, target = int(forward.layers[0][0][0]), int(backward.layers[0][0][0])
+    paths = []
+    on_path = {source}
+
+    def walk(length, nodes, rels):
+        position = len(nodes)
+        if search.budget <= 0:
+            search.truncated = True
+            return
+        search.spend(1)
+        _, others, via = search.expand([nodes[-1]], forward.direction)
+        if length - position <= backward.known:
+            hops = backward.dist[others]
+            keep = (hops >= 0) & (hops <= length - position)
+        else:
+            hops = forward.dist[others]
+            keep = (hops >= 0) & (hops <= position)
+        for other, rel in zip(others[keep].tolist(), via[keep].tolist()):
+            if other in on_path or (other == target) != (position == length):
+                continue
+            if position == length:
+                paths.append((nodes + [other], rels + [rel]))
+            else:
+                on_path.add(other)
+                nodes.append(other)
+                rels.append(rel)
+                walk(length, nodes, rels)
+                nodes.pop()
+                rels.pop()
+                on_path.discard(other)
+            if len(paths) >= k or search.truncated:
+                return
+
+    for length in range(min_hops, max_hops + 1):
+        while forward.known + backward.known < length and not search.truncated:
+            if _grow(forward, backward) is None:
+                break
+        walk(length, [source], [])
+        if len(paths) >= k or search.truncated:
+            break
+    return paths[:k]
+
+
+def _details(entity_ids, rel_ids):
+    nodes, links = [], []
+    entity_ids, rel_ids = list(entity_ids), list(rel_ids)
+    for start in range(0, len(entity_ids), 500):
+        chunk = entity_ids[start:start + 500]
+        nodes.extend(node_to_d3(e) for e in Entity.objects.filter(id__in=chunk).order_by().values(*NODE_FIELDS))
+    for start in range(0, len(rel_ids), 500):
+        chunk = rel_ids[start:start + 500]
+        links.extend(
+            link_to_d3(r) for r in Relationship.objects.filter(id__in=chunk).order_by().values(*LINK_FIELDS)
+        )
+    nodes.sort(key=lambda n: n["id"])
+    links.sort(key=lambda l: l["id"])
+    return nodes, links
+
+
+def find_paths(from_id, to_id, domain=ALL_DOMAINS, max_hops=6, direction="both", types=None, k=1):
+    """
+    from_id 到 to_id 的路径，不超过 max_hops 跳，至多 k 条，按跳数排序。
+    types 为关系类型名列表（None 表示全部）。每条路径为 {"length", "nodes", "links"}
+    （实体 ID 与关系 ID 列表，按路径顺序），涉及的实体、关系的详情在 nodes / links 中。
+    """
+    engine = get_engine(domain)
+    source, target = engine.index(from_id), engine.index(to_id)
+    if source is None or target is None:
+        raise PathError("entity not found")
+    codes = None
+    if types:
+        codes = {code for code in map(engine.type_code, types) if code is not None}
+    max_visited = getattr(settings, "KG_PATH_MAX_VISITED", 200000)
+    search = _Search(engine, codes, max_visited)
+
+    if source == target:
+        found = [([source], [])]
+    else:
+        forward, backward = _Side(search, source, direction), _Side(search, target, _REVERSE[direction])
+        shortest = _shortest(search, forward, backward, max_hops)
+        found = [shortest] if shortest else []
+        if shortest and k > 1:
+            found = _enumerate(search, forward, backward, max_hops, k, len(shortest[1])) or found
+
+    paths = [
+        {"length": len(rels), "nodes": [engine.node_id(i) for i in nodes], "links": rels}
+        for nodes, rels in found
+    ]
+    nodes, links = _details(
+        dict.fromkeys(entity_id for p in paths for entity_id in p["nodes"]),
+        dict.fromkeys(rel_id for p in paths for rel_id in p["links"]),
+    )
+    return {
+        "from": from_id,
+        "to": to_id,
+        "paths": paths,
+        "nodes": nodes,
+        "links": links,
+        "truncated": search.truncated,
+        "visited": max_visited - max(search.budget, 0),
+    }
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+实体全文检索
+
+替代 id/name/description 的 icontains 全表扫描：
+- SQLite：FTS5 虚拟表 kg_entity_fts（trigram 分词，支持中文子串匹配），
+  由实体表上的触发器同步（见迁移 0007_entity_search_index），按 bm25 排序；
+- MySQL：id/name/description 上的 FULLTEXT 索引（ngram 分词），InnoDB 自动同步，
+  按 MATCH ... AGAINST 的相关度排序。
+
+trigram 至少需要 3 个字符、ngram 默认 2 个字符；更短的关键词以及其它数据库
+退回到 icontains（带 limit，命中足够多行即停止扫描）。
+
+已知限制：SQLite 上 2 个字的中文关键词（如「学习」）不走索引。trigram 分词不索引
+短于 3 个字符的子串，恰好 2 个字的字段连一个 trigram 都没有，FTS5 的 MATCH、LIKE
+都无法用它回答；要支持需另建二元分词的 FTS 表，而分词无法在 SQL 触发器中完成。
+命中少于 limit 的短关键词会扫描整张实体表，接口在响应中以 indexed=false 标明，
+见 uses_index()。
+
+SQLite 的 FTS 表以实体表的 rowid 关联，对数据库执行 VACUUM 后 rowid 可能变化，
+需运行 rebuild_kg_search_index 重建。
+
+批量插入时逐行触发器的开销远大于插入本身，导入请在 deferred_index_sync() 中进行。
+"""
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Entity
+
+FTS_TABLE = "kg_entity_fts"
+INSERT_TRIGGER = f"{FTS_TABLE}_ai"
+MYSQL_INDEX = "kg_entity_fulltext"
+SEARCH_FIELDS = ("id", "name", "type", "description", "domain")
+# 各列在排序中的权重：id、name 命中比 description 更相关
+BM25_WEIGHTS = (5.0, 10.0, 1.0)
+MIN_QUERY_LENGTH = {"sqlite": 3, "mysql": 2}
+
+_available = {}
+
+
+def index_available():
+    """当前数据库上是否建立了全文索引（每个数据库别名只检查一次）"""
+    key = connection.alias
+    if key not in _available:
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            elif connection.vendor == "mysql":
+                cursor.execute(
+                    "SELECT 1 FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                    [Entity._meta.db_table, MYSQL_INDEX],
+                )
+            else:
+                _available[key] = False
+                return False
+            _available[key] = cursor.fetchone() is not None
+    return _available[key]
+
+
+def _phrase(q):
+    # 整体作为一个短语匹配；FTS5 中双引号写两次转义，MySQL 布尔模式不支持转义，直接去掉
+    if connection.vendor == "sqlite":
+        return '"%s"' % q.replace('"', '""')
+    return '"%s"' % q.replace('"', " ")
+
+
+def _fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [dict(zip(SEARCH_FIELDS, row)) for row in cursor.fetchall()]
+
+
+def uses_index(q):
+    """q 是否走全文索引；否则 search_entities() 退回到 icontains 扫描"""
+    q = q.strip()
+    return len(q) >= MIN_QUERY_LENGTH.get(connection.vendor, len(q) + 1) and index_available()
+
+
+def search_entities(q, limit):
+    """返回与 q 匹配的实体（按相关度从高到低），最多 limit 条"""
+    q = q.strip()
+    if not q:
+        return []
+    table = connection.ops.quote_name(Entity._meta.db_table)
+    columns = ", ".join(f"e.{connection.ops.quote_name(f)}" for f in SEARCH_FIELDS)
+    if uses_index(q):
+        if connection.vendor == "sqlite":
+            weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+            return _fetch(
+                f"SELECT {columns} FROM {FTS_TABLE} f JOIN {table} e ON e.rowid = f.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}, {weights}), e.id LIMIT %s",
+                [_phrase(q), limit],
+            )
+        match = "MATCH (e.id, e.name, e.description) AGAINST (%s IN BOOLEAN MODE)"
+        return _fetch(
+            f"SELECT {columns} FROM {table} e WHERE {match} ORDER BY {match} DESC, e.id LIMIT %s",
+            [_phrase(q), _phrase(q), limit],
+        )
+
+    queryset = Entity.objects.filter(Q(id__icontains=q) | Q(name__icontains=q) | Q(description__icontains=q))
+    return list(queryset.order_by().values(*SEARCH_FIELDS)[:limit])
+
+
+def rebuild():
+    """按实体表重建 SQLite 的 FTS 表（MySQL 的 FULLTEXT 索引无需重建），返回写入行数"""
+    if connection.vendor != "sqlite" or not index_available():
+        return 0
+    table = connection.ops.quote_name(Entity._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, entity_id, name, description) "
+            f"SELECT rowid, id, name, description FROM {table}"
+        )
+        return cursor.rowcount
+
+
+def clear_index():
+    """
+    清空 SQLite 的 FTS 表，在删除全部实体之前调用：逐行的删除触发器要从倒排索引中
+    逐个删除分词，重建空表只需删除再创建虚拟表。需在事务中调用。
+    """
+    if connection.vendor != "sqlite" or not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute(f"DROP TABLE {FTS_TABLE}")
+        cursor.execute(row[0])
+
+
+@contextmanager
+def deferred_index_sync():
+    """
+    批量插入实体期间暂停 SQLite FTS 的插入触发器，结束时把新增的行一次写入 FTS 表。
+
+    新插入的行 rowid 大于开始时的最大 rowid（写事务期间没有其它连接能插入）。
+    触发器的删除与重建在同一个事务（保存点）内，失败时一起回滚。
+    只暂停插入触发器，块内的更新、删除仍逐行同步。
+    """
+    if connection.vendor != "sqlite" or not index_available():
+        yield
+        return
+    table = connection.ops.quote_name(Entity._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = %s", [INSERT_TRIGGER])
+            row = cursor.fetchone()
+            if row is None:
+                yield
+                return
+            cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}")
+            last_rowid = cursor.fetchone()[0]
+            cursor.execute(f"DROP TRIGGER {INSERT_TRIGGER}")
+        yield
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE}(rowid, entity_id, name, description) "
+                f"SELECT rowid, id, name, description FROM {table} WHERE rowid > %s",
+                [last_rowid],
+            )
+            cursor.execute(row[0])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+实体/关系写入后的派生状态维护（版本号、变更日志、缓存）
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import graph_engine, graph_image
+from .graph_cache import snapshot_cache
+from .models import Entity, GraphChange, Relationship
+from . import versioning
+
+KINDS = {Entity: GraphChange.KIND_ENTITY, Relationship: GraphChange.KIND_RELATIONSHIP}
+
+
+@receiver(post_save, sender=Entity)
+@receiver(post_save, sender=Relationship)
+def graph_saved(sender, instance, created, **kwargs):
+    kind = KINDS[sender]
+    domain = instance.domain
+    # 加载时的领域；领域被修改时，对原领域而言该对象已被删除
+    old_domain = getattr(instance, "_loaded_domain", None)
+    if created:
+        changes = [(domain, kind, instance.pk, GraphChange.OP_INSERT)]
+    elif old_domain and old_domain != domain:
+        changes = [
+            (old_domain, kind, instance.pk, GraphChange.OP_DELETE),
+            (domain, kind, instance.pk, GraphChange.OP_INSERT),
+        ]
+    else:
+        changes = [(domain, kind, instance.pk, GraphChange.OP_UPDATE)]
+    versioning.record_write((domain, old_domain), changes)
+    if sender is Entity:
+        graph_engine.entity_saved(instance.pk, domain, old_domain)
+    else:
+        graph_engine.relationship_saved(
+            instance.pk, instance.source_id, instance.target_id, instance.type, domain, old_domain
+        )
+    instance._loaded_domain = domain
+
+
+@receiver(post_delete, sender=Entity)
+@receiver(post_delete, sender=Relationship)
+def graph_deleted(sender, instance, **kwargs):
+    domain = getattr(instance, "_loaded_domain", None) or instance.domain
+    versioning.record_write(
+        (instance.domain, domain),
+        [(domain, KINDS[sender], instance.pk, GraphChange.OP_DELETE)]
+    )
+    if sender is Entity:
+        graph_engine.entity_deleted(instance.pk, domain)
+    else:
+        graph_engine.relationship_deleted(instance.pk, domain)
+
+
+@receiver(versioning.graph_changed)
+def invalidate_snapshots(sender, domains, **kwargs):
+    snapshot_cache.invalidate(domains)
+    graph_image.invalidate(domains)
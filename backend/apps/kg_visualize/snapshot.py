@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+二进制图谱快照（备份 / 恢复）
+
+export_graph 的 JSON 与 clear_all_data 返回的 backup_data 生成慢、解析回来更慢。
+快照把一个领域（或全部数据）存为 NumPy 的 .npz（zip 中的多个 .npy，不压缩）：
+
+- header：JSON 文本（uint8 数组），格式版本、领域、领域版本号、行数；
+- strings / string_offsets：字符串表。ID、名称、类型、描述、领域去重后拼接为一段
+  UTF-8 文本，string_offsets 为各字符串在解码后文本中的字符偏移（共 n + 1 个）；
+- 节点列（长度 N）：node_id / node_name / node_type / node_description / node_domain
+  为字符串表下标（int32），node_created / node_updated 为 UTC 微秒时间戳（int64）；
+- external：不在本快照节点中的关系端点（跨领域关系）的字符串下标，节点编号为 N..N+K-1；
+- 邻接（CSR，按源节点排序）：indptr（N + K + 1）、indices（目标节点编号），以及与之
+  对齐的边列 edge_id、edge_type、edge_description、edge_domain、edge_created。
+
+恢复时在一个事务中删除快照所属领域（all 为全部）的现有数据（包括指向这些实体的
+其它领域的关系，这些领域同样标记为 reset），再由数组直接批量插入；库中不存在
+外部端点的关系跳过。
+"""
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from . import search
+from .models import Entity, Relationship
+from .streaming import get_chunk_size
+from .versioning import ALL_DOMAINS, coalesce_writes, get_version, mark_reset, read_transaction
+
+FORMAT = "kg-snapshot"
+FORMAT_VERSION = 1
+# 恢复时每次 executemany 插入的行数
+INSERT_BATCH = 10000
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+ENTITY_FIELDS = ("id", "name", "type", "description", "domain", "created_at", "updated_at")
+RELATIONSHIP_FIELDS = ("id", "source", "target", "type", "description", "domain", "created_at")
+
+
+class SnapshotError(ValueError):
+    """快照文件无法识别，或与库中数据冲突无法恢复"""
+
+
+class _Interned:
+    """批量字典编码：encode(values) 返回各值的下标数组，新出现的值按首次出现的顺序编号"""
+
+    def __init__(self):
+        self.index = {}
+
+    def encode(self, values):
+        index = self.index
+        new = [value for value in dict.fromkeys(values) if value not in index]
+        index.update(zip(new, range(len(index), len(index) + len(new))))
+        return np.fromiter(map(index.__getitem__, values), dtype=np.int32, count=len(values))
+
+
+def _columns(queryset, fields, chunk_size):
+    """
+    用原始游标按块读取，按列返回，不经过 Django 对每个值的类型转换。时间列由
+    _micros_column 整列转换；SQLite 连接按列类型逐值解析 datetime（占读取时间的
+    大半），因此把时间列作为文本读取。
+    """
+    selected = []
+    for name in fields:
+        field = queryset.model._meta.get_field(name)
+        if connection.vendor == "sqlite" and isinstance(field, models.DateTimeField):
+            selected.append(Cast(field.attname, models.TextField()))
+        else:
+            selected.append(field.attname)
+    sql, params = queryset.order_by().values_list(*selected).query.sql_with_params()
+    columns = [[] for _ in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+    return columns
+
+
+def _micros(value):
+    if timezone.is_naive(value):
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def _micros_column(values):
+    """时间列转换为 UTC 微秒时间戳。SQLite 返回 'YYYY-MM-DD HH:MM:SS.ffffff' 文本，其它数据库返回 datetime"""
+    if values and isinstance(values[0], str):
+        return np.array(values, dtype="datetime64[us]").astype(np.int64)
+    return np.fromiter(map(_micros, values), dtype=np.int64, count=len(values))
+
+
+def _text(values, default=""):
+    return [value or default for value in values]
+
+
+def save_snapshot(fp, domain="all"):
+    """把领域（all 为全部）数据写入二进制文件对象 fp，返回 header"""
+    chunk_size = get_chunk_size()
+    entities, relations = Entity.objects.all(), Relationship.objects.all()
+    if domain != "all":
+        entities, relations = entities.filter(domain=domain), relations.filter(domain=domain)
+    # 实体与关系在同一个事务中读取，互相一致
+    with read_transaction():
+        version = get_version(domain)
+        ids, names, types, descriptions, domains, created, updated = _columns(entities, ENTITY_FIELDS, chunk_size)
+        (rel_ids, sources, targets, rel_types, rel_descriptions, rel_domains,
+         rel_created) = _columns(relations, RELATIONSHIP_FIELDS, chunk_size)
+
+    strings = _Interned()
+    # 节点编号：快照中的实体为 0..N-1，其余的关系端点（外部实体）依次编号
+    endpoints = _Interned()
+    endpoints.encode(ids)
+    source = endpoints.encode(sources)
+    target = endpoints.encode(targets)
+    external = list(endpoints.index)[len(ids):]
+
+    node_count = len(endpoints.index)
+    order = np.argsort(source, kind="stable")
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source, minlength=node_count), out=indptr[1:])
+
+    header = {
+        "format": FORMAT,
+        "format_version": FORMAT_VERSION,
+        "domain": domain,
+        "graph_version": version,
+        "nodes": len(ids),
+        "external": len(external),
+        "edges": len(rel_ids),
+        "created_at": timezone.now().isoformat(),
+    }
+    arrays = {
+        "node_id": strings.encode(ids),
+        "node_name": strings.encode(names),
+        "node_type": strings.encode(_text(types)),
+        "node_description": strings.encode(_text(descriptions)),
+        "node_domain": strings.encode(_text(domains, "default")),
+        "node_created": _micros_column(created),
+        "node_updated": _micros_column(updated),
+        "external": strings.encode(external),
+        "indptr": indptr,
+        "indices": target[order],
+        "edge_id": np.array(rel_ids, dtype=np.int64)[order],
+        "edge_type": strings.encode(rel_types)[order],
+        "edge_description": strings.encode(_text(rel_descriptions))[order],
+        "edge_domain": strings.encode(_text(rel_domains, "default"))[order],
+        "edge_created": _micros_column(rel_created)[order],
+    }
+    values = list(strings.index)
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.savez(
+        fp,
+        header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+        strings=np.frombuffer("".join(values).encode("utf-8"), dtype=np.uint8),
+        string_offsets=offsets,
+        **arrays,
+    )
+    return header
+
+
+def read_header(data):
+    try:
+        header = json.loads(data["header"].tobytes().decode("utf-8"))
+    except (KeyError, ValueError):
+        raise SnapshotError("Not a knowledge graph snapshot")
+    if header.get("format") != FORMAT:
+        raise SnapshotError("Not a knowledge graph snapshot")
+    if header.get("format_version") != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {header.get('format_version')}")
+    return header
+
+
+def _timestamps(micros):
+    # 数据库接收 'YYYY-MM-DD HH:MM:SS.ffffff'（UTC）形式的时间，整列一次性格式化
+    text = np.datetime_as_string(micros.astype("datetime64[us]"), unit="us")
+    return np.char.replace(text, "T", " ").tolist()
+
+
+def _insert(model, columns, rows):
+    table = connection.ops.quote_name(model._meta.db_table)
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        table,
+        ", ".join(connection.ops.quote_name(model._meta.get_field(name).column) for name in columns),
+        ", ".join(["%s"] * len(columns)),
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INSERT_BATCH):
+            cursor.executemany(sql, rows[start:start + INSERT_BATCH])
+
+
+def _clear(domain):
+    """
+    删除领域数据（all 为全部），包括其它领域中指向这些实体的关系。
+    返回因此被删除了关系的其它领域（all 时为删除前存在数据的全部领域），
+    它们的数据同样发生了变化。
+    """
+    entity_table = connection.ops.quote_name(Entity._meta.db_table)
+    rel_table = connection.ops.quote_name(Relationship._meta.db_table)
+    with connection.cursor() as cursor:
+        if domain == "all":
+            cursor.execute(f"SELECT DISTINCT domain FROM {entity_table} UNION SELECT DISTINCT domain FROM {rel_table}")
+            others = [row[0] for row in cursor.fetchall() if row[0]]
+            cursor.execute(f"DELETE FROM {rel_table}")
+            search.clear_index()
+            cursor.execute(f"DELETE FROM {entity_table}")
+            return others
+        touching = (
+            f"source_id IN (SELECT id FROM {entity_table} WHERE domain = %s) "
+            f"OR target_id IN (SELECT id FROM {entity_table} WHERE domain = %s)"
+        )
+        cursor.execute(
+            f"SELECT DISTINCT domain FROM {rel_table} WHERE domain <> %s AND ({touching})",
+            [domain, domain, domain],
+        )
+        others = [row[0] for row in cursor.fetchall() if row[0]]
+        cursor.execute(f"DELETE FROM {rel_table} WHERE domain = %s OR {touching}", [domain, domain, domain])
+        cursor.execute(f"DELETE FROM {entity_table} WHERE domain = %s", [domain])
+    return others
+
+
+def clear_domain(domain):
+    """
+    删除领域数据（all 为全部），把该领域以及因此失去关系的其它领域标记为 reset，
+    返回这些其它领域。
+
+    直接执行 DELETE：QuerySet.delete() 因实体、关系上的 post_delete 信号处理会逐行读取
+    并逐行记录变更，而 reset 会丢弃这些逐行记录。
+    """
+    with transaction.atomic():
+        others = _clear(domain)
+        mark_reset(ALL_DOMAINS if domain == "all" else domain, *others)
+    return others
+
+
+def load_snapshot(fp):
+    """
+    从快照恢复，替换快照所属领域的现有数据。
+    返回 (header, {"entities": 插入数, "relationships": 插入数, "skipped_relationships": 跳过数})。
+    """
+    try:
+        data = np.load(fp, allow_pickle=False)
+    except (ValueError, OSError) as e:
+        raise SnapshotError(f"Not a knowledge graph snapshot: {e}")
+    with data:
+        header = read_header(data)
+        arrays = {name: data[name] for name in data.files}
+
+    text = arrays["strings"].tobytes().decode("utf-8")
+    offsets = arrays["string_offsets"].tolist()
+    strings = np.array([text[start:end] for start, end in zip(offsets, offsets[1:])] or [""], dtype=object)
+
+    node_ids = strings[arrays["node_id"]]
+    all_ids = np.concatenate([node_ids, strings[arrays["external"]]])
+    entity_rows = list(zip(
+        node_ids.tolist(),
+        strings[arrays["node_name"]].tolist(),
+        strings[arrays["node_type"]].tolist(),
+        strings[arrays["node_description"]].tolist(),
+        strings[arrays["node_domain"]].tolist(),
+        _timestamps(arrays["node_created"]),
+        _timestamps(arrays["node_updated"]),
+    ))
+
+    indptr = arrays["indptr"]
+    sources = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    targets = arrays["indices"]
+    domain = header["domain"]
+    try:
+        with transaction.atomic(), coalesce_writes():
+            # 外部端点必须已在库中，且不属于即将被替换的领域，否则跳过相应的关系
+            external = all_ids[len(node_ids):].tolist()
+            present = set()
+            if external and domain != "all":
+                candidates = Entity.objects.exclude(domain=domain)
+                for start in range(0, len(external), 500):
+                    chunk = external[start:start + 500]
+                    present.update(candidates.filter(id__in=chunk).values_list("id", flat=True))
+            valid = np.concatenate([
+                np.ones(len(node_ids), dtype=bool),
+                np.fromiter((entity_id in present for entity_id in external), dtype=bool, count=len(external)),
+            ])
+            keep = valid[sources] & valid[targets]
+            relationship_rows = list(zip(
+                arrays["edge_id"][keep].tolist(),
+                all_ids[sources[keep]].tolist(),
+                all_ids[targets[keep]].tolist(),
+                strings[arrays["edge_type"][keep]].tolist(),
+                strings[arrays["edge_description"][keep]].tolist(),
+                strings[arrays["edge_domain"][keep]].tolist(),
+                _timestamps(arrays["edge_created"][keep]),
+            ))
+
+            others = _clear(domain)
+            with search.deferred_index_sync():
+                _insert(Entity, ENTITY_FIELDS, entity_rows)
+            _insert(Relationship, RELATIONSHIP_FIELDS, relationship_rows)
+            # 其它领域中指向被替换实体的关系已删除，这些领域也需要整体重新加载
+            mark_reset(ALL_DOMAINS if domain == "all" else domain, *others)
+    except IntegrityError as e:
+        # SQLite 的外键在提交时检查，冲突可能在事务结束时才抛出
+        raise SnapshotError(f"Snapshot conflicts with existing data: {e}")
+
+    return header, {
+        "entities": len(entity_rows),
+        "relationships": len(relationship_rows),
+        "skipped_relationships": int(len(keep) - keep.sum()),
+    }
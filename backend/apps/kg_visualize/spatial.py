@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+视口（bounding box）查询的空间索引
+
+基于 GraphLayout 中的节点坐标，为每个领域在进程内维护一个均匀网格索引：
+节点按所在网格排序后以 CSR 形式存放（cell_start + order），
+矩形查询只访问与矩形相交的网格行，代价为 O(网格行数 + 可见节点数)。
+索引记录其对应的布局版本，领域版本变化后在下一次查询时重建。大领域的布局过期
+（由 compute_kg_layout 离线计算）期间沿用旧索引，只查询已保存布局的版本号，
+布局更新后再读取坐标重建。
+
+坐标与 /api/kg/data?layout=1 返回的 x/y 相同（以原点为中心的布局坐标）。
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from .layout import get_layout, stored_layout_version
+from .models import Entity, Relationship
+from .streaming import LINK_FIELDS, NODE_FIELDS, link_to_d3, node_to_d3
+
+
+class GridIndex:
+    """节点坐标的均匀网格索引，每个网格平均约 per_cell 个节点"""
+
+    def __init__(self, version, node_ids, positions, per_cell=4):
+        self.version = version
+        self.node_ids = node_ids
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        n = len(node_ids)
+        self.side = max(1, math.ceil(math.sqrt(n / per_cell)))
+        if n:
+            self.low = self.positions.min(0)
+            span = float((self.positions.max(0) - self.low).max())
+        else:
+            self.low, span = np.zeros(2), 0.0
+        self.cell_size = max(span, 1e-6) / self.side
+        cells = self._cells(self.positions)
+        key = cells[:, 0] * self.side + cells[:, 1]
+        self.order = np.argsort(key, kind="stable")
+        self.cell_start = np.searchsorted(key[self.order], np.arange(self.side * self.side + 1))
+        self._index = {node_id: i for i, node_id in enumerate(node_ids)}
+
+    def _cells(self, points):
+        return np.clip(np.floor((points - self.low) / self.cell_size), 0, self.side - 1).astype(np.int64)
+
+    def query(self, x0, y0, x1, y1):
+        """返回落在矩形 [x0, x1] x [y0, y1] 内的节点下标（按网格顺序）"""
+        if not len(self.node_ids):
+            return np.zeros(0, dtype=np.int64)
+        high = self.low + self.cell_size * self.side
+        if x1 < self.low[0] or y1 < self.low[1] or x0 > high[0] or y0 > high[1]:
+            return np.zeros(0, dtype=np.int64)
+        (cx0, cy0), (cx1, cy1) = self._cells(np.array([[x0, y0], [x1, y1]], dtype=np.float64))
+        # 行优先编号：同一行中 cy0..cy1 的网格在 order 中是连续的一段
+        parts = [
+            self.order[self.cell_start[cx * self.side + cy0]:self.cell_start[cx * self.side + cy1 + 1]]
+            for cx in range(cx0, cx1 + 1)
+        ]
+        candidates = np.concatenate(parts)
+        x, y = self.positions[candidates, 0], self.positions[candidates, 1]
+        return candidates[(x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)]
+
+    def position(self, node_id):
+        i = self._index.get(node_id)
+        return None if i is None else self.positions[i]
+
+
+class SpatialIndexCache:
+    """进程内按领域缓存 GridIndex（LRU），布局版本变化时重建"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or getattr(settings, "KG_SPATIAL_INDEX_ENTRIES", 8)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain, version):
+        """
+        返回 (index, stale)；尚无任何布局时 index 为 None。
+
+        已有当前版本的索引时不读取布局表，查询代价只与可见节点数有关。
+        """
+        with self._lock:
+            index, stale = self._entries.get(domain, (None, False))
+            if index is not None:
+                self._entries.move_to_end(domain)
+        if index is not None:
+            if index.version == version:
+                return index, False
+            # 过期的旧索引：保存的布局仍是建索引时的版本，不必读取坐标与节点 ID 列表
+            if stale and stored_layout_version(domain) == index.version:
+                return index, True
+
+        layout, stale = get_layout(domain, version)
+        if layout is None:
+            return None, stale
+        if index is None or index.version != layout.version:
+            positions = np.frombuffer(bytes(layout.positions), dtype=np.float32)
+            index = GridIndex(layout.version, json.loads(layout.node_ids), positions)
+        with self._lock:
+            self._entries[domain] = (index, stale)
+            self._entries.move_to_end(domain)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index, stale
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+spatial_cache = SpatialIndexCache()
+
+
+def viewport(domain, bbox, version, limit=None):
+    """
+    返回视口内的节点及与其相连的关系；找不到布局时返回 None。
+
+    关系另一端不在视口内时，其坐标放在 anchors 中，客户端据此画出伸出视口的连线。
+    视口内节点超过 limit 时只返回前 limit 个并标记 truncated。
+    """
+    limit = limit or getattr(settings, "KG_BBOX_LIMIT", 5000)
+    index, stale = spatial_cache.get(domain, version)
+    if index is None:
+        return None
+
+    hits = index.query(*bbox)
+    truncated = len(hits) > limit
+    hits = hits[:limit]
+    ids = [index.node_ids[i] for i in hits]
+    visible = set(ids)
+    coords = {index.node_ids[i]: index.positions[i] for i in hits}
+
+    nodes, links, seen = [], [], set()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        for e in Entity.objects.filter(id__in=chunk).order_by().values(*NODE_FIELDS):
+            node = node_to_d3(e)
+            node["x"], node["y"] = round(float(coords[e["id"]][0]), 1), round(float(coords[e["id"]][1]), 1)
+            nodes.append(node)
+        relations = Relationship.objects.filter(Q(source_id__in=chunk) | Q(target_id__in=chunk))
+        if domain != "all":
+            relations = relations.filter(domain=domain)
+        for r in relations.order_by().values(*LINK_FIELDS):
+            if r["id"] not in seen:
+                seen.add(r["id"])
+                links.append(link_to_d3(r))
+
+    anchors = {}
+    for link in links:
+        for end in (link["source"], link["target"]):
+            if end not in visible and end not in anchors:
+                position = index.position(end)
+                if position is not None:
+                    anchors[end] = [round(float(position[0]), 1), round(float(position[1]), 1)]
+    nodes.sort(key=lambda n: n["id"])
+    links.sort(key=lambda l: l["id"])
+    return {
+        "data": {"nodes": nodes, "links": links},
+        "anchors": anchors,
+        "truncated": truncated,
+        "layout": {"version": index.version, "stale": stale},
+    }
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+流式输出知识图谱数据
+
+大图谱一次性构建 nodes/links 列表会占用大量内存，这里按块从数据库读取
+（queryset.iterator），边读边编码为 JSON 片段，配合 StreamingHttpResponse
+使用，峰值内存与图谱规模无关。
+"""
+import json
+
+from django.conf import settings
+
+from .models import Entity, Relationship
+
+NODE_FIELDS = ("id", "name", "type", "description", "domain")
+LINK_FIELDS = ("id", "source_id", "target_id", "type", "description", "domain")
+
+
+def get_chunk_size():
+    return getattr(settings, "KG_STREAM_CHUNK_SIZE", 2000)
+
+
+def node_to_d3(e):
+    """Entity values() 行 -> D3 节点"""
+    return {
+        "id": e["id"],
+        "name": e["name"],
+        "type": e.get("type", ""),
+        "description": e.get("description", ""),
+        "domain": e.get("domain") or "default"
+    }
+
+
+def link_to_d3(r):
+    """Relationship values() 行 -> D3 连线"""
+    return {
+        "source": r["source_id"],
+        "target": r["target_id"],
+        "type": r["type"],
+        "description": r.get("description", ""),
+        "id": r["id"],
+        "domain": r.get("domain") or "default"
+    }
+
+
+def graph_querysets(domain):
+    """返回指定领域（all 表示全部）的实体与关系 values() 查询集"""
+    entities = Entity.objects.all()
+    relations = Relationship.objects.all()
+    if domain != "all":
+        entities = entities.filter(domain=domain)
+        relations = relations.filter(domain=domain)
+    return entities.values(*NODE_FIELDS), relations.values(*LINK_FIELDS)
+
+
+def iter_json_array(rows, convert, chunk_size):
+    """
+    将 rows 逐条转换并编码为 JSON 数组片段。
+
+    每累计 chunk_size 条输出一次，避免每行一次 yield 的开销。
+    """
+    buf = []
+    first = True
+    for row in rows:
+        item = json.dumps(convert(row))
+        if first:
+            buf.append(item)
+            first = False
+        else:
+            buf.append("," + item)
+        if len(buf) >= chunk_size:
+            yield "".join(buf).encode("utf-8")
+            buf = []
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def stream_graph_data(domain, chunk_size=None):
+    """
+    以 {"ret": 0, "data": {"nodes": [...], "links": [...]}, "domain": ...}
+    格式流式输出图谱数据，与 get_graph_data 的非流式响应结构一致。
+
+    流式模式不保证顺序（去掉了 Entity 的默认排序），这样数据库不需要
+    先对整张表排序再返回。
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    entities, relations = graph_querysets(domain)
+
+    yield b'{"ret": 0, "data": {"nodes": ['
+    yield from iter_json_array(entities.order_by().iterator(chunk_size=chunk_size), node_to_d3, chunk_size)
+    yield b'], "links": ['
+    yield from iter_json_array(relations.order_by().iterator(chunk_size=chunk_size), link_to_d3, chunk_size)
+    yield (']}, "domain": %s}' % json.dumps(domain)).encode("utf-8")
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+实体名称/ID 前缀补全
+
+每个领域在进程内维护一个有序数组：实体名称与 ID 统一转为小写后作为键排序，
+查询时 bisect 定位到第一个不小于前缀的键，顺序向后取到前缀不再匹配为止，
+代价为 O(log n + 返回条数)，与领域规模基本无关。
+
+索引首次查询时构建，记录构建时的领域版本号与变更日志位置（seq）。版本变化后
+与 graph_engine 相同，从变更日志读取之后的变更修补索引，代价与修改量成正比；
+日志不足以修补（已清理、出现 reset、变更过多）时才重新读取整个领域。
+重建期间其它线程继续使用旧索引，不阻塞补全请求。
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import changefeed
+from .models import Entity
+from .versioning import ALL_DOMAINS, get_version
+
+FIELDS = ("id", "name", "type", "domain")
+
+# 一次修补的键不超过该数时逐个插入 / 删除，否则与剩余的键归并成新数组
+INPLACE_PATCH_KEYS = 64
+
+
+def _key(text):
+    return (text or "").casefold()
+
+
+def _pairs(entity, ref):
+    entity_id, name = entity[0], entity[1]
+    if _key(entity_id) == _key(name):
+        return [(_key(name), ref)]
+    return [(_key(name), ref), (_key(entity_id), ref)]
+
+
+class SuggestIndex:
+    def __init__(self, domain, version, seq, rows):
+        """rows 为 (id, name, type, domain) 序列，seq 为读取 rows 之前的变更日志位置"""
+        self.domain = domain
+        self.version = version
+        self.seq = seq
+        self.entities = [tuple(row) for row in rows]
+        self._refs = {entity[0]: ref for ref, entity in enumerate(self.entities)}
+        # (键, 实体编号) 按键排序；删除的实体在 entities 中留空位，编号不复用
+        self.pairs = sorted(pair for ref, entity in enumerate(self.entities) for pair in _pairs(entity, ref))
+        self._lock = threading.Lock()
+
+    def suggest(self, prefix, limit):
+        prefix = _key(prefix)
+        results, seen = [], set()
+        with self._lock:
+            position = bisect_left(self.pairs, (prefix,))
+            while position < len(self.pairs) and len(results) < limit:
+                key, ref = self.pairs[position]
+                if not key.startswith(prefix):
+                    break
+                if ref not in seen:
+                    seen.add(ref)
+                    results.append(dict(zip(FIELDS, self.entities[ref])))
+                position += 1
+        return results
+
+    def catch_up(self, version):
+        """
+        按变更日志修补到最新，version 为此前读取的领域版本号。
+        日志不足以修补（已清理、reset、变更过多）时返回 False。
+        """
+        delta = changefeed.changes_since(self.seq, self.domain)
+        if delta["full_reload"]:
+            return False
+        entities = delta["entities"]
+        upserted = [tuple(e[field] for field in FIELDS) for e in entities["upserted"]]
+        with self._lock:
+            removed, added = set(), []
+            for entity_id in entities["deleted"]:
+                ref = self._refs.pop(entity_id, None)
+                if ref is not None:
+                    removed.update(_pairs(self.entities[ref], ref))
+                    self.entities[ref] = None
+            for entity in upserted:
+                ref = self._refs.get(entity[0])
+                if ref is None:
+                    ref = self._refs[entity[0]] = len(self.entities)
+                    self.entities.append(entity)
+                else:
+                    removed.update(_pairs(self.entities[ref], ref))
+                    self.entities[ref] = entity
+                added.extend(_pairs(entity, ref))
+            # 名称未变的实体先删后加，两边抵消
+            removed, added = removed.difference(added), set(added).difference(removed)
+            self._patch(removed, added)
+            self.version = version
+            self.seq = delta["last_seq"]
+        return True
+
+    def _patch(self, removed, added):
+        if len(removed) + len(added) <= INPLACE_PATCH_KEYS:
+            for pair in removed:
+                del self.pairs[bisect_left(self.pairs, pair)]
+            for pair in added:
+                insort(self.pairs, pair)
+        else:
+            kept = (pair for pair in self.pairs if pair not in removed)
+            self.pairs = list(heapq.merge(kept, sorted(added)))
+
+
+class SuggestIndexCache:
+    """进程内按领域缓存 SuggestIndex（LRU），领域版本变化时修补或重建"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or getattr(settings, "KG_SUGGEST_INDEX_ENTRIES", 8)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def get(self, domain, version=None):
+        if version is None:
+            version = get_version(domain)
+        with self._lock:
+            index = self._entries.get(domain)
+            if index is not None:
+                self._entries.move_to_end(domain)
+                if index.version == version:
+                    return index
+            build_lock = self._building.setdefault(domain, threading.Lock())
+
+        # 已有旧索引且其它线程正在重建时直接返回旧索引
+        if not build_lock.acquire(blocking=index is None):
+            return index
+        try:
+            with self._lock:
+                current = self._entries.get(domain)
+            if current is not None and (current.version == version or current.catch_up(version)):
+                return current
+            # 先取得变更日志位置再读取数据，读取期间的写入会在下一次修补时重放
+            seq = changefeed.head_seq()
+            entities = Entity.objects.all() if domain == ALL_DOMAINS else Entity.objects.filter(domain=domain)
+            rows = entities.order_by().values_list(*FIELDS).iterator(chunk_size=10000)
+            index = SuggestIndex(domain, version, seq, rows)
+            with self._lock:
+                self._entries[domain] = index
+                self._entries.move_to_end(domain)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return index
+        finally:
+            build_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+suggest_cache = SuggestIndexCache()
+
+
+def suggest(prefix, domain=ALL_DOMAINS, limit=10, version=None):
+    """返回名称或 ID 以 prefix 开头（不区分大小写）的实体，按键的字典序排列"""
+    if not prefix:
+        return []
+    return suggest_cache.get(domain, version).suggest(prefix, limit)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询的执行计划回归测试
+
+依次请求各个接口，捕获其执行的 SQL，用 EXPLAIN QUERY PLAN 检查：
+带领域/ID 等过滤条件的查询不允许对实体、关系、变更日志表做全表扫描
+（SQLite 计划中不带 USING INDEX 的 "SCAN <表>"）。
+新增接口或修改查询后若退化为全表扫描，这里会列出对应的 SQL 与计划。
+"""
+import json
+import re
+import unittest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Entity, GraphChange, Relationship
+from .tests import TestCase, _seed
+
+# 需要检查的表；计划中可能以别名出现（见 search.py、neighborhood.py 中的原生 SQL）
+WATCHED_TABLES = {
+    Entity._meta.db_table, Relationship._meta.db_table, GraphChange._meta.db_table, "e", "r",
+}
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS (\w+))?$")
+
+
+def full_scans(sql):
+    """返回 sql 的执行计划中对受检查表的全表扫描步骤"""
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql)
+        details = [row[-1] for row in cursor.fetchall()]
+    scans = []
+    for detail in details:
+        match = FULL_SCAN.match(detail)
+        if match and ({match.group(1), match.group(2)} & WATCHED_TABLES):
+            scans.append(detail)
+    return scans
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "execution plans are checked on SQLite")
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("plan", 20)
+        _seed("other", 20)
+
+    def assertNoFullScan(self, method, path, data=None, **extra):
+        with CaptureQueriesContext(connection) as captured:
+            if method == "get":
+                response = self.client.get(path, data or {}, **extra)
+            else:
+                response = self.client.generic(method.upper(), path, json.dumps(data or {}),
+                                               content_type="application/json", **extra)
+        self.assertEqual(response.status_code, 200)
+        problems = []
+        for query in captured.captured_queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                continue
+            scans = full_scans(sql)
+            if scans:
+                problems.append(f"{sql}\n    -> {'; '.join(scans)}")
+        self.assertFalse(problems, f"{method.upper()} {path} {data or ''} 出现全表扫描:\n" + "\n".join(problems))
+
+    def test_graph_data(self):
+        self.assertNoFullScan("get", "/api/kg/data", {"domain": "plan"})
+        self.assertNoFullScan("get", "/api/kg/data", {"domain": "plan", "format": "columnar"})
+        self.assertNoFullScan("get", "/api/kg/data", {"domain": "plan", "stream": "1"})
+        self.assertNoFullScan("get", "/api/kg/export", {"domain": "plan"})
+
+    def test_graph_data_pages(self):
+        self.assertNoFullScan("get", "/api/kg/data", {"domain": "plan", "limit": 5})
+        first = self.client.get("/api/kg/data", {"domain": "plan", "limit": 50}).json()
+        self.assertNoFullScan("get", "/api/kg/data", {"domain": "plan", "limit": 5, "cursor": first["next_cursor"]})
+        self.assertNoFullScan("get", "/api/kg/entities", {"limit": 5})
+        page = self.client.get("/api/kg/relationships", {"limit": 5}).json()
+        self.assertNoFullScan("get", "/api/kg/relationships", {"limit": 5, "cursor": page["next_cursor"]})
+
+    def test_entity_and_relationship_lookups(self):
+        self.assertNoFullScan("get", "/api/kg/entities/plan_3")
+        self.assertNoFullScan("get", "/api/kg/entities/plan_3/neighborhood", {"hops": 2})
+        self.assertNoFullScan("get", "/api/kg/entities/plan_3/neighborhood", {"hops": 2, "direction": "in"})
+        self.assertNoFullScan("get", "/api/kg/relationships", {"source": "plan_3"})
+        self.assertNoFullScan("get", "/api/kg/relationships", {"target": "plan_3"})
+        self.assertNoFullScan("get", "/api/kg/entities", {"q": "实体1"})
+        self.assertNoFullScan("get", "/api/kg/entities/suggest", {"prefix": "实体", "domain": "plan"})
+
+    def test_change_feed(self):
+        self.assertNoFullScan("get", "/api/kg/changes", {"since": 1, "domain": "plan"})
+
+    def test_import_duplicate_lookup(self):
+        payload = {
+            "domain": "plan",
+            "strategy": "skip",
+            "conflict_resolution": "skip",
+            "nodes": [{"id": "plan_0", "name": "实体0"}, {"id": "plan_1", "name": "实体1"}],
+            "links": [{"source": "plan_0", "target": "plan_1", "type": "包含"}],
+        }
+        self.assertNoFullScan("post", "/api/kg/import", payload)
@@ -0,0 +1,1240 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import io
+import json
+import mmap
+import os
+import socket
+import tempfile
+import threading
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models.signals import post_delete
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test import TestCase as DjangoTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import changefeed, graph_engine, graph_image, import_pipeline, jobs, search, spatial
+from .importer import GraphImporter
+from .columnar import columnar_to_d3
+from .graph_cache import snapshot_cache
+from .jsonstream import JSONArrayStream, JSONStreamError
+from .spatial import GridIndex, spatial_cache
+from .suggest import suggest_cache
+from .layout import _repulsion_exact, _repulsion_grid, compute_layout
+from .models import Entity, GraphJob, ImportCheckpoint, ImportMappingChunk, Relationship
+from .versioning import coalesce_writes, get_version, mark_reset, read_transaction
+
+
+class TestCase(DjangoTestCase):
+    def setUp(self):
+        super().setUp()
+        # 测试之间数据库回滚会让版本号倒退，缓存必须清空
+        snapshot_cache.clear()
+        spatial_cache.clear()
+        suggest_cache.clear()
+        graph_image.clear()
+        cache.clear()
+
+
+def _seed(domain="test", count=3):
+    entities = [
+        Entity.objects.create(id=f"{domain}_{i}", name=f"实体{i}", type="概念", domain=domain)
+        for i in range(count)
+    ]
+    for a, b in zip(entities, entities[1:]):
+        Relationship.objects.create(source=a, target=b, type="包含", domain=domain)
+    return entities
+
+
+class GraphDataStreamTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("test")
+        _seed("other", 2)
+
+    def test_stream_matches_regular_payload(self):
+        regular = self.client.get("/api/kg/data", {"domain": "test"}).json()
+        response = self.client.get("/api/kg/data", {"domain": "test", "stream": "1"})
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b"".join(response.streaming_content))
+
+        self.assertEqual(streamed["ret"], 0)
+        self.assertEqual(streamed["domain"], "test")
+        key = lambda item: item["id"]
+        self.assertEqual(sorted(streamed["data"]["nodes"], key=key), sorted(regular["data"]["nodes"], key=key))
+        self.assertEqual(sorted(streamed["data"]["links"], key=key), sorted(regular["data"]["links"], key=key))
+
+    def test_stream_rejects_other_modes(self):
+        for params in ({"format": "columnar"}, {"layout": "1"}, {"lod": "1"}, {"limit": "2"}):
+            response = self.client.get("/api/kg/data", {"domain": "test", "stream": "1", **params})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["ret"], 1)
+            self.assertIn("'stream' cannot be combined", response.json()["msg"])
+
+    def test_stream_empty_domain(self):
+        response = self.client.get("/api/kg/data", {"domain": "missing", "stream": "1"})
+        streamed = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(streamed["data"], {"nodes": [], "links": []})
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("b", 4)
+        _seed("a", 3)
+
+    def _walk(self, url, params, key):
+        items, cursor, pages = [], None, 0
+        while True:
+            query = dict(params, **({"cursor": cursor} if cursor else {}))
+            body = self.client.get(url, query).json()
+            self.assertEqual(body["ret"], 0)
+            items.extend(key(body["data"]))
+            pages += 1
+            cursor = body["next_cursor"]
+            if not cursor:
+                return items, pages
+
+    def test_entities_pages_in_domain_id_order(self):
+        rows, pages = self._walk("/api/kg/entities", {"limit": 2}, lambda d: d)
+        self.assertEqual(pages, 4)
+        self.assertEqual([(r["domain"], r["id"]) for r in rows],
+                         sorted((e.domain, e.id) for e in Entity.objects.all()))
+
+    def test_relationships_pages_by_id(self):
+        rows, _ = self._walk("/api/kg/relationships", {"limit": 2}, lambda d: d)
+        self.assertEqual([r["id"] for r in rows],
+                         list(Relationship.objects.order_by("id").values_list("id", flat=True)))
+
+    def test_graph_pages_nodes_then_links(self):
+        nodes, _ = self._walk("/api/kg/data", {"domain": "b", "limit": 3}, lambda d: d["nodes"])
+        links, _ = self._walk("/api/kg/data", {"domain": "b", "limit": 3}, lambda d: d["links"])
+        self.assertEqual(len(nodes), 4)
+        self.assertEqual(len(links), 3)
+
+    def test_invalid_cursor(self):
+        body = self.client.get("/api/kg/entities", {"cursor": "not-a-cursor"}).json()
+        self.assertEqual(body["ret"], 1)
+
+
+class DomainVersionETagTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.entities = _seed("test")
+
+    def test_writes_bump_domain_and_all(self):
+        before = get_version("test"), get_version("all"), get_version("other")
+        self.entities[0].name = "改名"
+        self.entities[0].save()
+        self.assertEqual(get_version("test"), before[0] + 1)
+        self.assertEqual(get_version("all"), before[1] + 1)
+        self.assertEqual(get_version("other"), before[2])
+
+    def test_domain_change_bumps_old_domain(self):
+        before = get_version("test")
+        entity = Entity.objects.get(id="test_0")
+        entity.domain = "other"
+        entity.save()
+        self.assertEqual(get_version("test"), before + 1)
+        self.assertEqual(get_version("other"), 1)
+
+    def test_bulk_writes_coalesce(self):
+        before = get_version("test")
+        with coalesce_writes():
+            Entity.objects.filter(domain="test").delete()
+        self.assertEqual(get_version("test"), before + 1)
+
+    def test_if_none_match_returns_304(self):
+        for url in ("/api/kg/data", "/api/kg/export"):
+            first = self.client.get(url, {"domain": "test"})
+            etag = first["ETag"]
+            cached = self.client.get(url, {"domain": "test"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(cached.status_code, 304)
+
+            Entity.objects.create(id=f"new{len(url)}", name="新实体", domain="test")
+            fresh = self.client.get(url, {"domain": "test"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(fresh.status_code, 200)
+            self.assertNotEqual(fresh["ETag"], etag)
+
+    def test_save_data_mode_bumps_once(self):
+        before = get_version("test")
+        payload = {"currentDomain": "test", "nodes": [{"id": "n1", "name": "n1"}], "links": []}
+        self.client.post("/api/kg/save-data", json.dumps(payload), content_type="application/json")
+        self.assertEqual(get_version("test"), before + 1)
+
+    def test_bulk_clear_skips_per_row_deletes(self):
+        deleted = []
+        receiver = lambda sender, instance, **kwargs: deleted.append(instance.pk)
+        post_delete.connect(receiver, sender=Entity)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Entity)
+        Entity.objects.create(id="ext", name="外部", domain="other")
+        Relationship.objects.create(source_id="ext", target_id="test_0", type="引用", domain="other")
+        before = get_version("other")
+
+        payload = {"currentDomain": "test", "nodes": [{"id": "n1", "name": "n1"}], "links": []}
+        self.client.post("/api/kg/save-data", json.dumps(payload), content_type="application/json")
+        self.assertEqual(deleted, [])
+        # 其它领域中指向被删除实体的关系随之删除，该领域版本号也要更新
+        self.assertFalse(Relationship.objects.filter(domain="other").exists())
+        self.assertEqual(get_version("other"), before + 1)
+
+        before = get_version("test"), get_version("other")
+        self.assertEqual(self.client.post("/api/kg/clear-all").json()["ret"], 0)
+        self.assertEqual(deleted, [])
+        self.assertFalse(Entity.objects.exists())
+        self.assertEqual((get_version("test"), get_version("other")), (before[0] + 1, before[1] + 1))
+
+
+class SnapshotCacheTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("test")
+        _seed("other", 2)
+
+    def test_cache_hit_only_reads_version(self):
+        first = self.client.get("/api/kg/data", {"domain": "test"})
+        with self.assertNumQueries(1):
+            second = self.client.get("/api/kg/data", {"domain": "test"})
+        self.assertEqual(first.content, second.content)
+
+    def test_write_invalidates_domain_and_all_only(self):
+        for domain in ("test", "other", "all"):
+            self.client.get("/api/kg/data", {"domain": domain})
+        with self.captureOnCommitCallbacks(execute=True):
+            Entity.objects.create(id="fresh", name="新实体", domain="test")
+
+        cached_domains = {key[0] for key in snapshot_cache._entries}
+        self.assertEqual(cached_domains, {"other"})
+        body = self.client.get("/api/kg/data", {"domain": "test"}).json()
+        self.assertIn("fresh", [n["id"] for n in body["data"]["nodes"]])
+
+    def test_bulk_import_invalidates_once(self):
+        calls = []
+        original = snapshot_cache.invalidate
+        snapshot_cache.invalidate = lambda domains: calls.append(set(domains)) or original(domains)
+        try:
+            payload = {"domain": "test", "nodes": [{"id": f"bulk{i}", "name": f"b{i}"} for i in range(50)], "links": []}
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post("/api/kg/import", json.dumps(payload), content_type="application/json")
+        finally:
+            snapshot_cache.invalidate = original
+        self.assertEqual(len(calls), 1)
+
+
+class ColumnarFormatTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        entities = _seed("test")
+        other = Entity.objects.create(id="outside", name="外部", domain="other")
+        Relationship.objects.create(source=entities[0], target=other, type="关联", domain="test")
+
+    def test_columnar_round_trips_to_d3(self):
+        regular = self.client.get("/api/kg/data", {"domain": "test"}).json()["data"]
+        for url in ("/api/kg/data", "/api/kg/export"):
+            body = self.client.get(url, {"domain": "test", "format": "columnar"}).json()
+            self.assertEqual(body["format"], "columnar")
+            data = body["data"]
+            self.assertEqual(data["node_types"], ["概念"])
+            self.assertEqual(data["external_ids"], ["outside"])
+            decoded = columnar_to_d3(data)
+            key = lambda item: item["id"]
+            self.assertEqual(sorted(decoded["nodes"], key=key), sorted(regular["nodes"], key=key))
+            self.assertEqual(sorted(decoded["links"], key=key), sorted(regular["links"], key=key))
+
+    def test_unknown_format_rejected(self):
+        self.assertEqual(self.client.get("/api/kg/data", {"format": "xml"}).json()["ret"], 1)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.entities = _seed("test")
+        self.since = self.client.get("/api/kg/changes").json()["data"]["last_seq"]
+
+    def _changes(self, **params):
+        body = self.client.get("/api/kg/changes", dict({"since": self.since}, **params)).json()
+        self.assertEqual(body["ret"], 0)
+        return body["data"]
+
+    def test_crud_views_produce_compacted_delta(self):
+        self.client.post("/api/kg/entities", json.dumps({"id": "x", "name": "X", "domain": "test"}),
+                         content_type="application/json")
+        self.client.patch("/api/kg/entities/x", json.dumps({"name": "X2"}), content_type="application/json")
+        self.client.post("/api/kg/entities", json.dumps({"id": "tmp", "name": "临时", "domain": "test"}),
+                         content_type="application/json")
+        self.client.delete("/api/kg/entities/tmp")
+        self.client.delete("/api/kg/entities/test_2")
+
+        data = self._changes(domain="test")
+        self.assertFalse(data["full_reload"])
+        self.assertEqual([n["name"] for n in data["entities"]["upserted"]], ["X2"])
+        self.assertEqual(data["entities"]["deleted"], ["test_2"])
+        self.assertEqual(len(data["relationships"]["deleted"]), 1)
+
+        again = self._changes(domain="test", since=data["last_seq"])
+        self.assertEqual(again["entities"], {"upserted": [], "deleted": []})
+
+    def test_other_domain_is_filtered(self):
+        Entity.objects.create(id="o", name="其他", domain="other")
+        self.assertEqual(self._changes(domain="test")["entities"]["upserted"], [])
+        self.assertEqual(len(self._changes(domain="other")["entities"]["upserted"]), 1)
+
+    def test_save_data_mode_requires_full_reload(self):
+        payload = {"currentDomain": "test", "nodes": [{"id": "n1", "name": "n1"}], "links": []}
+        self.client.post("/api/kg/save-data", json.dumps(payload), content_type="application/json")
+        self.assertTrue(self._changes(domain="test")["full_reload"])
+        self.assertFalse(self._changes(domain="other")["full_reload"])
+
+    def test_pruned_sequence_requires_full_reload(self):
+        for i in range(3):
+            Entity.objects.create(id=f"p{i}", name=f"p{i}", domain="test")
+        changefeed.prune(1)
+        self.assertTrue(self._changes()["full_reload"])
+
+    def test_sequence_is_assigned_after_taking_the_version_lock(self):
+        # 先写 all 领域的版本记录（行锁持有到提交），再插入变更日志，seq 按提交顺序分配
+        with CaptureQueriesContext(connection) as captured:
+            Entity.objects.create(id="lock", name="lock", domain="test")
+        sql = [q["sql"] for q in captured.captured_queries]
+        version = next(i for i, q in enumerate(sql) if q.startswith("UPDATE") and "domainversion" in q)
+        change = next(i for i, q in enumerate(sql) if q.startswith("INSERT") and "graphchange" in q)
+        self.assertLess(version, change)
+
+
+class NeighborhoodTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        # 链 c_0 -> c_1 -> c_2 -> c_3，以及枢纽 hub -> leaf_0..leaf_9
+        _seed("c", 4)
+        hub = Entity.objects.create(id="hub", name="枢纽", domain="c")
+        Relationship.objects.create(source=Entity.objects.get(id="c_0"), target=hub, type="属于", domain="c")
+        for i in range(10):
+            leaf = Entity.objects.create(id=f"leaf_{i}", name=f"叶{i}", domain="c")
+            Relationship.objects.create(source=hub, target=leaf, type="包含", domain="c")
+
+    def _get(self, entity_id, **params):
+        body = self.client.get(f"/api/kg/entities/{entity_id}/neighborhood", params).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return body["data"]
+
+    def test_hops_and_direction(self):
+        data = self._get("c_1", hops=1, direction="out")
+        self.assertEqual({n["id"] for n in data["nodes"]}, {"c_1", "c_2"})
+        data = self._get("c_1", hops=2, direction="both", types="包含")
+        self.assertEqual({n["id"]: n["depth"] for n in data["nodes"]},
+                         {"c_0": 1, "c_1": 0, "c_2": 1, "c_3": 2})
+        self.assertEqual(len(data["links"]), 3)
+
+    def test_fanout_cap_truncates_hub(self):
+        data = self._get("c_0", hops=2, direction="out", fanout=3)
+        ids = {n["id"] for n in data["nodes"]}
+        self.assertTrue(data["truncated"])
+        self.assertEqual(len([i for i in ids if i.startswith("leaf_")]), 3)
+        # 子图中的连线两端都在节点集合内
+        self.assertTrue(all(l["source"] in ids and l["target"] in ids for l in data["links"]))
+
+    @override_settings(KG_NEIGHBORHOOD_MAX_ROWS=20)
+    def test_hub_does_not_starve_other_branches(self):
+        # root 的两个分支：枢纽 hub（30 个叶子）与链 z_0 -> z_1，按 ID 枢纽先展开
+        root = Entity.objects.create(id="root", name="根", domain="c")
+        Relationship.objects.create(source=root, target_id="hub", type="包含", domain="c")
+        for i in range(10, 30):
+            leaf = Entity.objects.create(id=f"leaf_{i}", name=f"叶{i}", domain="c")
+            Relationship.objects.create(source_id="hub", target=leaf, type="包含", domain="c")
+        z_0, z_1 = _seed("z", 2)
+        Relationship.objects.create(source=root, target=z_0, type="包含", domain="c")
+
+        data = self._get("root", hops=2, direction="out", fanout=3)
+        ids = {n["id"] for n in data["nodes"]}
+        self.assertTrue(data["truncated"])
+        self.assertIn(z_1.id, ids)
+        self.assertEqual(len([i for i in ids if i.startswith("leaf_")]), 3)
+
+    def test_limit_and_validation(self):
+        self.assertEqual(len(self._get("hub", hops=1, limit=5)["nodes"]), 5)
+        self.assertEqual(self.client.get("/api/kg/entities/hub/neighborhood", {"direction": "up"}).json()["ret"], 1)
+        self.assertEqual(self.client.get("/api/kg/entities/none/neighborhood").json()["ret"], 1)
+
+
+class PathTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        # 链 p_0 -> p_1 -> p_2 -> p_3，捷径 p_0 -> x -> p_3（类型 引用），以及 p_4 -> p_3
+        _seed("p", 5)
+        Relationship.objects.filter(source_id="p_3", target_id="p_4").delete()
+        Relationship.objects.create(source_id="p_4", target_id="p_3", type="包含", domain="p")
+        Entity.objects.create(id="x", name="捷径", domain="p")
+        Relationship.objects.create(source_id="p_0", target_id="x", type="引用", domain="p")
+        Relationship.objects.create(source_id="x", target_id="p_3", type="引用", domain="p")
+
+    def _get(self, **params):
+        body = self.client.get("/api/kg/path", params).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return body["data"]
+
+    def test_shortest_and_k_paths(self):
+        data = self._get(**{"from": "p_0", "to": "p_3"})
+        self.assertEqual([p["nodes"] for p in data["paths"]], [["p_0", "x", "p_3"]])
+        self.assertEqual({n["id"] for n in data["nodes"]}, {"p_0", "x", "p_3"})
+        self.assertEqual([(l["source"], l["target"]) for l in data["links"]], [("p_0", "x"), ("x", "p_3")])
+
+        data = self._get(**{"from": "p_0", "to": "p_3", "k": 5})
+        self.assertEqual([p["nodes"] for p in data["paths"]],
+                         [["p_0", "x", "p_3"], ["p_0", "p_1", "p_2", "p_3"]])
+        data = self._get(**{"from": "p_0", "to": "p_3", "types": "包含", "max_hops": 2})
+        self.assertEqual(data["paths"], [])
+
+    def test_direction(self):
+        self.assertEqual(self._get(**{"from": "p_0", "to": "p_4", "direction": "out"})["paths"], [])
+        data = self._get(**{"from": "p_0", "to": "p_4"})
+        self.assertEqual(data["paths"][0]["nodes"], ["p_0", "x", "p_3", "p_4"])
+        data = self._get(**{"from": "p_3", "to": "p_0", "direction": "in", "types": "包含"})
+        self.assertEqual(data["paths"][0]["nodes"], ["p_3", "p_2", "p_1", "p_0"])
+
+    @override_settings(KG_PATH_MAX_VISITED=1)
+    def test_visited_cap_truncates(self):
+        data = self._get(**{"from": "p_0", "to": "p_4"})
+        self.assertTrue(data["truncated"])
+        self.assertEqual(data["paths"], [])
+
+    def test_validation(self):
+        self.assertEqual(self.client.get("/api/kg/path", {"from": "p_0"}).json()["ret"], 1)
+        self.assertEqual(self.client.get("/api/kg/path", {"from": "p_0", "to": "none"}).json()["ret"], 1)
+        self.assertEqual(self.client.get("/api/kg/path", {"from": "p_0", "to": "p_1", "k": 0}).json()["ret"], 1)
+
+    def test_local_ai_path_analysis(self):
+        from .views import generate_local_ai_response
+        graph = self.client.get("/api/kg/data", {"domain": "p"}).json()["data"]
+        start = next(n for n in graph["nodes"] if n["id"] == "p_1")
+        reply = generate_local_ai_response("实体4 的路径", graph, "p", start, None)
+        self.assertIn("最短路径（3 跳）", reply)
+
+
+class LayoutTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("lay", 6)
+
+    def _get(self, **params):
+        body = self.client.get("/api/kg/data", {"domain": "lay", "layout": "1", **params}).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return body
+
+    def test_grid_repulsion_approximates_exact(self):
+        pos = np.random.default_rng(0).normal(size=(2000, 2)) * 2000
+        exact, approx = _repulsion_exact(pos, 4e4), _repulsion_grid(pos, 4e4)
+        error = np.linalg.norm(exact - approx, axis=1) / np.linalg.norm(exact, axis=1)
+        self.assertLess(np.median(error), 0.1)
+
+    def test_data_includes_positions_and_caches(self):
+        body = self._get()
+        self.assertFalse(body["layout"]["stale"])
+        self.assertEqual(body["layout"]["version"], get_version("lay"))
+        self.assertTrue(all(isinstance(n["x"], float) and isinstance(n["y"], float) for n in body["data"]["nodes"]))
+        columnar = self._get(format="columnar")["data"]["nodes"]
+        self.assertEqual(len(columnar["x"]), 6)
+        with self.assertNumQueries(2):  # 版本号 + 布局
+            self._get()
+
+    def test_edit_warm_starts_from_previous_positions(self):
+        before = compute_layout("lay").positions_by_id()
+        Entity.objects.filter(id="lay_5").update(name="改名")  # 不触发信号，版本不变
+        Entity.objects.create(id="lay_new", name="新", domain="lay")
+        after = compute_layout("lay").positions_by_id()
+        self.assertIn("lay_new", after)
+        moved = max(np.hypot(after[k][0] - before[k][0], after[k][1] - before[k][1]) for k in before)
+        self.assertLess(moved, 1000)
+
+    @override_settings(KG_LAYOUT_MAX_SYNC_NODES=1)
+    def test_large_domain_returns_stale_layout(self):
+        body = self._get()
+        self.assertTrue(body["layout"]["stale"])
+        self.assertIsNone(body["layout"]["version"])
+        self.assertNotIn("x", body["data"]["nodes"][0])
+
+
+class LevelOfDetailTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        # 两个紧密的三角形，由一条关系相连
+        ids = ["a0", "a1", "a2", "b0", "b1", "b2"]
+        entities = {i: Entity.objects.create(id=i, name=i.upper(), domain="lod") for i in ids}
+        pairs = [("a0", "a1"), ("a1", "a2"), ("a2", "a0"), ("b0", "b1"), ("b1", "b2"), ("b2", "b0"), ("a0", "b0")]
+        for s, t in pairs:
+            Relationship.objects.create(source=entities[s], target=entities[t], type="关联", domain="lod")
+
+    def _get(self, **params):
+        body = self.client.get("/api/kg/data", {"domain": "lod", **params}).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return body
+
+    def test_super_nodes_and_drill_down(self):
+        body = self._get(lod=1)
+        nodes = body["data"]["nodes"]
+        self.assertEqual(sorted(n["size"] for n in nodes), [3, 3])
+        self.assertEqual(body["data"]["links"], [
+            {"source": nodes[0]["id"], "target": nodes[1]["id"], "weight": 1}
+        ])
+        cluster = nodes[0]["cluster"]
+        members = self._get(lod=1, cluster=cluster)["data"]
+        self.assertEqual(len(members["nodes"]), 3)
+        self.assertEqual(len(members["links"]), 3)
+
+    def test_lod_is_cached_per_version(self):
+        self._get(lod=1)
+        with self.assertNumQueries(1):
+            self._get(lod=1)
+        Entity.objects.create(id="c0", name="C", domain="lod")
+        self.assertEqual(len(self._get(lod=1)["data"]["nodes"]), 3)
+
+    @override_settings(KG_COMMUNITIES_MAX_SYNC_NODES=2, KG_JOB_WORKERS=0)
+    def test_large_domain_serves_stale_result_and_recomputes_in_background(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            body = self._get(lod=1)
+            self._get(lod=1)
+        self.assertEqual(body["communities"], {"version": None, "stale": True})
+        self.assertEqual(body["data"]["nodes"], [])
+        self.assertEqual(GraphJob.objects.filter(kind=GraphJob.KIND_COMMUNITIES).count(), 1)
+        for callback in callbacks:
+            callback()
+        first = self.client.get("/api/kg/data", {"domain": "lod", "lod": 1})
+        self.assertFalse(first.json()["communities"]["stale"])
+
+        Entity.objects.create(id="c0", name="C", domain="lod")
+        with self.captureOnCommitCallbacks():
+            stale = self.client.get("/api/kg/data", {"domain": "lod", "lod": 1}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertTrue(stale.json()["communities"]["stale"])
+        self.assertEqual(len(stale.json()["data"]["nodes"]), 2)
+
+    def test_validation(self):
+        self.assertEqual(self.client.get("/api/kg/data", {"lod": "x"}).json()["ret"], 1)
+        self.assertEqual(self.client.get("/api/kg/data", {"lod": "9"}).json()["ret"], 1)
+        self.assertEqual(self.client.get("/api/kg/data", {"domain": "lod", "lod": 1, "cluster": 99}).json()["ret"], 1)
+
+
+class ViewportTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("vp", 30)
+
+    def test_grid_index_matches_brute_force(self):
+        positions = np.random.default_rng(1).uniform(-500, 500, size=(400, 2))
+        index = GridIndex(1, [f"n{i}" for i in range(400)], positions)
+        for x0, y0, x1, y1 in [(-100, -100, 100, 100), (-600, 0, 0, 600), (400, 400, 900, 900), (700, 700, 800, 800)]:
+            inside = np.flatnonzero((positions[:, 0] >= x0) & (positions[:, 0] <= x1)
+                                    & (positions[:, 1] >= y0) & (positions[:, 1] <= y1))
+            self.assertEqual(sorted(index.query(x0, y0, x1, y1).tolist()), inside.tolist())
+
+    def test_bbox_returns_visible_nodes_and_touching_links(self):
+        full = self.client.get("/api/kg/data", {"domain": "vp", "layout": "1"}).json()["data"]
+        xs = sorted(n["x"] for n in full["nodes"])
+        x0, x1 = (xs[4] + xs[5]) / 2, (xs[15] + xs[16]) / 2
+        body = self.client.get("/api/kg/data", {"domain": "vp", "bbox": f"{x1},-1e9,{x0},1e9"}).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        visible = {n["id"] for n in full["nodes"] if x0 <= n["x"] <= x1}
+        self.assertEqual({n["id"] for n in body["data"]["nodes"]}, visible)
+        expected = {l["id"] for l in full["links"] if l["source"] in visible or l["target"] in visible}
+        self.assertEqual({l["id"] for l in body["data"]["links"]}, expected)
+        for link in body["data"]["links"]:
+            for end in (link["source"], link["target"]):
+                self.assertTrue(end in visible or end in body["anchors"])
+
+    def test_index_rebuilt_on_version_change(self):
+        self.client.get("/api/kg/data", {"domain": "vp", "bbox": "-1e9,-1e9,1e9,1e9"})
+        Entity.objects.create(id="vp_new", name="新", domain="vp")
+        body = self.client.get("/api/kg/data", {"domain": "vp", "bbox": "-1e9,-1e9,1e9,1e9"}).json()
+        self.assertIn("vp_new", {n["id"] for n in body["data"]["nodes"]})
+        self.assertEqual(self.client.get("/api/kg/data", {"bbox": "1,2,3"}).json()["ret"], 1)
+
+    @override_settings(KG_LAYOUT_MAX_SYNC_NODES=10)
+    def test_stale_index_reused_until_layout_is_recomputed(self):
+        compute_layout("vp")
+        Entity.objects.create(id="vp_new", name="新", domain="vp")
+        bbox = {"domain": "vp", "bbox": "-1e9,-1e9,1e9,1e9"}
+        with patch("backend.apps.kg_visualize.spatial.get_layout", wraps=spatial.get_layout) as loads:
+            for _ in range(3):
+                body = self.client.get("/api/kg/data", bbox).json()
+                self.assertNotIn("vp_new", {n["id"] for n in body["data"]["nodes"]})
+            self.assertEqual(loads.call_count, 1)
+            compute_layout("vp")
+            body = self.client.get("/api/kg/data", bbox).json()
+            self.assertIn("vp_new", {n["id"] for n in body["data"]["nodes"]})
+            self.assertEqual(loads.call_count, 2)
+
+
+class EntitySearchTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        Entity.objects.create(id="ml", name="机器学习", description="人工智能的一个分支")
+        Entity.objects.create(id="dl", name="深度学习", description="基于神经网络的机器学习方法")
+        Entity.objects.create(id="cv", name="计算机视觉", description="图像理解")
+
+    def _search(self, q, **params):
+        body = self.client.get("/api/kg/entities", {"q": q, **params}).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return [e["id"] for e in body["data"]]
+
+    def test_ranked_and_kept_in_sync(self):
+        self.assertTrue(search.index_available())
+        # 名称命中排在描述命中之前
+        self.assertEqual(self._search("机器学习"), ["ml", "dl"])
+        self.assertEqual(self._search("机器学习", limit=1), ["ml"])
+        entity = Entity.objects.get(id="cv")
+        entity.name = "机器学习视觉"
+        entity.save()
+        self.assertIn("cv", self._search("机器学习"))
+        Entity.objects.filter(id="ml").delete()
+        self.assertNotIn("ml", self._search("机器学习"))
+
+    def test_short_query_falls_back_to_scan(self):
+        self.assertEqual(sorted(self._search("学习")), ["dl", "ml"])
+        self.assertEqual(self._search("CV"), ["cv"])
+
+    def test_two_character_cjk_query_is_not_indexed(self):
+        # trigram 不索引 2 个字的子串，恰好 2 个字的名称也没有 trigram：只能扫描
+        Entity.objects.create(id="edu", name="教育")
+        body = self.client.get("/api/kg/entities", {"q": "教育"}).json()
+        self.assertEqual(([e["id"] for e in body["data"]], body["indexed"]), (["edu"], False))
+        self.assertTrue(self.client.get("/api/kg/entities", {"q": "机器学"}).json()["indexed"])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH %s", ['"教育"'])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        Entity.objects.create(id="ML", name="机器学习", domain="ai")
+        Entity.objects.create(id="mt", name="机器翻译", domain="ai")
+        Entity.objects.create(id="robot", name="机器人", domain="hw")
+
+    def _suggest(self, **params):
+        body = self.client.get("/api/kg/entities/suggest", params).json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return [e["id"] for e in body["data"]]
+
+    def test_prefix_on_name_and_id(self):
+        self.assertEqual(self._suggest(prefix="机器"), ["robot", "ML", "mt"])
+        self.assertEqual(self._suggest(prefix="机器", domain="ai", limit=1), ["ML"])
+        self.assertEqual(self._suggest(prefix="m"), ["ML", "mt"])
+        self.assertEqual(self._suggest(prefix=""), [])
+
+    def test_refreshed_on_version_change(self):
+        self._suggest(prefix="机器")
+        with self.assertNumQueries(1):
+            self._suggest(prefix="机")
+        Entity.objects.create(id="ms", name="机器视觉", domain="ai")
+        self.assertIn("ms", self._suggest(prefix="机器视", domain="ai"))
+
+    def test_writes_patch_the_index_from_the_change_log(self):
+        index = suggest_cache.get("ai")
+        Entity.objects.create(id="ms", name="机器视觉", domain="ai")
+        entity = Entity.objects.get(id="mt")
+        entity.name = "自动翻译"
+        entity.save()
+        Entity.objects.get(id="ML").delete()
+        self.assertEqual(self._suggest(prefix="机器", domain="ai"), ["ms"])
+        self.assertEqual(self._suggest(prefix="自动", domain="ai"), ["mt"])
+        # 超过逐个插入的上限时归并
+        for i in range(40):
+            Entity.objects.create(id=f"batch{i:02d}", name=f"批量{i:02d}", domain="ai")
+        self.assertEqual(self._suggest(prefix="批量0", domain="ai", limit=20), [f"batch{i:02d}" for i in range(10)])
+        self.assertEqual(self._suggest(prefix="ms", domain="ai"), ["ms"])
+        self.assertIs(suggest_cache.get("ai"), index)
+
+
+class ImportBulkTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.entities = _seed("test")
+        Entity.objects.create(id="test_0_1", name="占用", domain="test")
+
+    def _import(self, nodes, links=(), **options):
+        payload = dict({"domain": "test", "nodes": nodes, "links": list(links)}, **options)
+        body = self.client.post("/api/kg/import", json.dumps(payload), content_type="application/json").json()
+        self.assertEqual(body["ret"], 0, body.get("msg"))
+        return body["data"]
+
+    def test_auto_id_skips_taken_suffixes(self):
+        data = self._import(
+            [{"id": "test_0", "name": "重复"}, {"id": "test_0", "name": "再次重复"}, {"id": "new", "name": "新"}],
+            [{"source": "test_0", "target": "new", "type": "关联"}],
+        )
+        self.assertEqual(data["import_stats"]["entities"],
+                         {"created": 3, "updated": 0, "skipped": 0, "conflicts": 2, "errors": 0})
+        # 同一个 ID 的映射以最后一次为准
+        self.assertEqual(data["entity_id_mapping"], {"test_0": "test_0_3", "new": "new"})
+        self.assertEqual(Entity.objects.filter(id__in=["test_0_2", "test_0_3"]).count(), 2)
+        self.assertTrue(Relationship.objects.filter(source_id="test_0_3", target_id="new").exists())
+
+    def test_merge_data_and_relationship_strategies(self):
+        nodes = [{"id": "test_1", "name": "x", "description": "补充"}, {"id": "test_2", "name": "x"}]
+        links = [{"source": "test_1", "target": "test_2", "type": "包含", "description": "描述"},
+                 {"source": "test_1", "target": "missing", "type": "包含"}]
+        data = self._import(nodes, links, conflict_resolution="merge_data", strategy="merge")
+        self.assertEqual(data["import_stats"]["entities"],
+                         {"created": 0, "updated": 1, "skipped": 1, "conflicts": 0, "errors": 0})
+        self.assertEqual(data["import_stats"]["relationships"], {"created": 1, "skipped": 0, "errors": 1})
+        self.assertEqual(Entity.objects.get(id="test_1").description, "补充")
+        self.assertEqual(Relationship.objects.get(source_id="test_1", target_id="test_2").description, "描述")
+
+        data = self._import(nodes, links, conflict_resolution="skip", strategy="skip")
+        self.assertEqual(data["import_stats"]["entities"]["skipped"], 2)
+        self.assertEqual(data["import_stats"]["relationships"], {"created": 0, "skipped": 1, "errors": 1})
+
+    def test_lookup_queries_do_not_grow_with_payload(self):
+        # 插入语句会按数据库的参数上限拆分，这里只比较读查询的条数
+        def run(count, prefix):
+            nodes = [{"id": f"{prefix}{i}", "name": f"n{i}"} for i in range(count)]
+            links = [{"source": f"{prefix}{i}", "target": f"{prefix}{i + 1}", "type": "链"} for i in range(count - 1)]
+            with CaptureQueriesContext(connection) as captured:
+                self._import(nodes, links)
+            return sum(q["sql"].startswith("SELECT") for q in captured.captured_queries)
+
+        self.assertEqual(run(10, "a"), run(300, "b"))
+
+    def test_bulk_writes_are_recorded_in_change_feed(self):
+        since = self.client.get("/api/kg/changes").json()["data"]["last_seq"]
+        version = get_version("test")
+        self._import([{"id": "fresh", "name": "新实体"}, {"id": "fresh2", "name": "新实体2"}],
+                     [{"source": "fresh", "target": "fresh2", "type": "关联"}])
+        self.assertGreater(get_version("test"), version)
+        data = self.client.get("/api/kg/changes", {"since": since, "domain": "test"}).json()["data"]
+        self.assertEqual([e["id"] for e in data["entities"]["upserted"]], ["fresh", "fresh2"])
+        self.assertEqual(len(data["relationships"]["upserted"]), 1)
+
+
+class StreamingImportTests(TestCase):
+    def test_reader_handles_chunk_boundaries(self):
+        doc = {"meta": {"a": [1]}, "nodes": [{"id": "节点", "v": 12.5e-3}, 123456, "x"], "links": []}
+        for read_size in (1, 2, 7):
+            reader = JSONArrayStream(io.BytesIO(json.dumps(doc, ensure_ascii=False).encode()), read_size=read_size)
+            self.assertEqual(list(reader.items()), [("nodes", item) for item in doc["nodes"]])
+            self.assertEqual(reader.skipped, ["meta"])
+        with self.assertRaises(JSONStreamError):
+            list(JSONArrayStream(io.BytesIO(b'{"nodes": [1 2]}')).items())
+
+    def test_command_commits_batches_and_resolves_links_before_nodes(self):
+        Entity.objects.create(id="a", name="已有", domain="stream")
+        data = {
+            "links": [{"source": "a", "target": "b", "type": "关联"}, {"source": "b", "target": "c", "type": "关联"}],
+            "nodes": [{"id": "a", "name": "A"}, {"id": "b", "name": "B", "domain": "other"},
+                      {"id": "c", "name": "C"}, {"name": "无 ID"}],
+        }
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command("import_kg_data", f.name, "--stream", "--batch-size", "2", "--domain", "stream", stdout=out)
+
+        self.assertIn("rows/s", out.getvalue())
+        self.assertEqual(sorted(Entity.objects.filter(domain="stream").values_list("id", flat=True)),
+                         ["a", "a_1", "b", "c"])
+        self.assertEqual(sorted(Relationship.objects.values_list("source_id", "target_id")),
+                         [("a_1", "b"), ("b", "c")])
+
+    def test_workers_parse_pre_split_files(self):
+        shards = [
+            {"nodes": [{"id": f"w{i}", "name": f"W{i}"} for i in range(0, 5)] + [{"id": "bad"}],
+             "links": [{"source": "w0", "target": "w9", "type": "跨文件"}, {"source": "w1", "target": "w1", "type": "自环"}]},
+            {"nodes": [{"id": f"w{i}", "name": f"W{i}"} for i in range(5, 10)], "links": []},
+        ]
+        paths = []
+        for shard in shards:
+            with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+                json.dump(shard, f)
+            self.addCleanup(os.remove, f.name)
+            paths.append(f.name)
+        call_command("import_kg_data", *paths, "--workers", "2", "--batch-size", "3", "--domain", "par",
+                     stdout=io.StringIO())
+
+        self.assertEqual(Entity.objects.filter(domain="par").count(), 10)
+        self.assertEqual(list(Relationship.objects.values_list("source_id", "target_id")), [("w0", "w9")])
+
+    def test_workers_keep_input_order_for_conflicts(self):
+        # 第二个文件先解析完，仍按文件顺序写入：auto_id 的编号与 --stream 相同
+        shards = [
+            {"nodes": [{"id": f"o{i}", "name": f"O{i}"} for i in range(5000)] + [{"id": "dup", "name": "第一个"}],
+             "links": []},
+            {"nodes": [{"id": "dup", "name": "第二个"}], "links": [{"source": "dup", "target": "o0", "type": "关联"}]},
+        ]
+        paths = []
+        for shard in shards:
+            with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+                json.dump(shard, f, ensure_ascii=False)
+            self.addCleanup(os.remove, f.name)
+            paths.append(f.name)
+        for domain, mode in (("seq", ["--stream"]), ("par", ["--workers", "2"])):
+            call_command("import_kg_data", *paths, *mode, "--batch-size", "1000", "--domain", domain,
+                         stdout=io.StringIO())
+        for domain in ("seq", "par"):
+            dups = Entity.objects.filter(domain=domain, id__startswith="dup").order_by("id")
+            self.assertEqual([e.name for e in dups], ["第一个", "第二个"])
+        self.assertEqual(Relationship.objects.filter(domain="seq").get().source.name,
+                         Relationship.objects.filter(domain="par").get().source.name)
+
+
+class DryRunImportTests(TestCase):
+    def _import(self, data, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command("import_kg_data", f.name, "--domain", "test", *args, stdout=out)
+        return out.getvalue()
+
+    def test_statistics_match_real_import(self):
+        _seed("test")
+        data = {
+            "nodes": [{"id": "test_0", "name": "重复"}, {"id": "new", "name": "新"}, {"id": "new", "name": "再次"},
+                      {"name": "无 ID"}],
+            "links": [{"source": "test_0", "target": "new", "type": "关联"}, {"source": "new", "target": "test_1", "type": "关联"},
+                      {"source": "test_0", "target": "test_0", "type": "自环"}],
+        }
+        predicted = self._import(data, "--dry-run")
+        self.assertFalse(Entity.objects.filter(id="new").exists())
+        self.assertIn("Created: 3\n  Updated: 0\n  Skipped: 0\n  Conflicts: 2\n  Errors: 1", predicted)
+        # test_1 不在文件中，连线无法映射
+        self.assertIn("Relationships:\n  Created: 1\n  Skipped: 0\n  Errors: 2", predicted)
+
+        actual = self._import(data, "--stream")
+        section = slice(predicted.index("Entities:"), predicted.index("SQL queries"))
+        self.assertEqual(predicted[section].strip(), actual[actual.index("Entities:"):].strip("=\n "))
+
+    def test_query_count_is_constant(self):
+        for count in (10, 500):
+            data = {
+                "nodes": [{"id": f"n{i}", "name": f"N{i}"} for i in range(count)],
+                "links": [{"source": f"n{i}", "target": f"n{i + 1}", "type": "链"} for i in range(count - 1)],
+            }
+            self.assertIn("SQL queries: 2", self._import(data, "--dry-run"))
+
+
+class BulkFormatImportTests(TestCase):
+    def _write(self, suffix, text):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False, encoding="utf-8", newline="") as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def _import(self, fmt, *args):
+        out = io.StringIO()
+        call_command("import_kg_data", "--format", fmt, "--domain", "bulk", *args, stdout=out)
+        return out.getvalue()
+
+    def test_ndjson(self):
+        entities = self._write(".ndjson", "\n".join(
+            [json.dumps({"id": f"e{i}", "name": f"批量实体{i}", "type": "概念"}, ensure_ascii=False) for i in range(5)]
+            + ["{broken", ""]
+        ))
+        relationships = self._write(".ndjson", '{"source": "e0", "target": "e1", "type": "包含"}\n')
+        output = self._import("ndjson", "--entities", entities, "--relationships", relationships)
+
+        self.assertIn("Errors: 1", output)
+        self.assertEqual(Entity.objects.filter(domain="bulk").count(), 5)
+        self.assertTrue(Relationship.objects.filter(source_id="e0", target_id="e1", domain="bulk").exists())
+        # 插入时暂停的全文索引触发器已恢复，新实体可被检索
+        self.assertEqual([e["id"] for e in search.search_entities("批量实体3", 10)], ["e3"])
+        Entity.objects.create(id="later", name="稍后创建的实体", domain="bulk")
+        self.assertEqual([e["id"] for e in search.search_entities("稍后创建", 10)], ["later"])
+
+    def test_csv(self):
+        entities = self._write(".csv", 'id,name,description,extra\na,"逗号,名称","多行\n描述",x\nb,B\n,无 ID\n')
+        relationships = self._write(".csv", "source,target,type\na,b,关联\n")
+        self._import("csv", "--entities", entities, "--relationships", relationships, "--batch-size", "1")
+
+        a = Entity.objects.get(id="a")
+        self.assertEqual((a.name, a.description, a.type), ("逗号,名称", "多行\n描述", ""))
+        self.assertEqual(Entity.objects.get(id="b").description, "")
+        self.assertEqual(Relationship.objects.filter(domain="bulk").count(), 1)
+
+        with self.assertRaisesMessage(CommandError, "missing CSV columns name"):
+            self._import("csv", "--entities", self._write(".csv", "id\nx\n"))
+
+    def test_ndjson_byte_ranges_cover_every_line_once(self):
+        lines = [json.dumps({"id": f"n{i}", "name": "x" * (i % 7)}) for i in range(200)]
+        path = self._write(".ndjson", "\n".join(lines) + "\n")
+        with patch.object(import_pipeline, "MIN_RANGE_SIZE", 1):
+            shards = import_pipeline.split_ranges([import_pipeline.Shard(path, "ndjson", "nodes")], 13)
+        self.assertEqual(len(shards), 13)
+        ids = []
+        for shard in shards:
+            ids.extend(item["id"] for _, item in import_pipeline.RECORD_READERS["ndjson"](shard))
+        self.assertEqual(ids, [f"n{i}" for i in range(200)])
+
+
+class ResumableImportTests(TestCase):
+    _write = BulkFormatImportTests._write
+    _import = BulkFormatImportTests._import
+
+    def test_chunk_offsets_resume_each_format(self):
+        nodes = [{"id": f"节点{i}", "name": f"名称\n{i}"} for i in range(7)]
+        files = [
+            (self._write(".json", json.dumps({"nodes": nodes, "links": []}, ensure_ascii=False)), "json"),
+            (self._write(".ndjson", "".join(json.dumps(n, ensure_ascii=False) + "\n" for n in nodes)), "ndjson"),
+            (self._write(".csv", "\ufeffid,name\n" + "".join(f'{n["id"]},"{n["name"]}"\n' for n in nodes)), "csv"),
+        ]
+        for path, fmt in files:
+            shard = import_pipeline.Shard(path, fmt, "nodes")
+            chunks = list(import_pipeline.iter_chunks(shard, "nodes", 3))
+            self.assertEqual([row["id"] for rows, _, _ in chunks for row in rows], [n["id"] for n in nodes])
+            for i, (_, _, offset) in enumerate(chunks[:-1]):
+                rest = import_pipeline.iter_chunks(shard._replace(start=offset), "nodes", 3)
+                self.assertEqual([row for rows, _, _ in rest for row in rows],
+                                 [row for rows, _, _ in chunks[i + 1:] for row in rows], fmt)
+
+    def test_resume_continues_after_last_committed_batch(self):
+        Entity.objects.create(id="n0", name="已有实体", domain="bulk")
+        nodes = [{"id": f"n{i}", "name": f"实体{i}"} for i in range(6)]
+        links = [{"source": f"n{i}", "target": f"n{i + 1}", "type": "下一个"} for i in range(5)]
+        path = self._write(".json", json.dumps({"nodes": nodes, "links": links}, ensure_ascii=False))
+
+        original = GraphImporter.import_relationships
+        calls = []
+
+        def fail_second_batch(importer, rows):
+            calls.append(rows)
+            if len(calls) == 2:
+                raise DatabaseError("disk I/O error")
+            return original(importer, rows)
+
+        with patch.object(GraphImporter, "import_relationships", fail_second_batch):
+            with self.assertRaisesMessage(CommandError, "use --resume to continue"):
+                self._import("json", path, "--stream", "--batch-size", "2")
+        self.assertEqual(Relationship.objects.filter(domain="bulk").count(), 2)
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.phase, checkpoint.chunk), ("links", 5))
+
+        output = self._import("json", path, "--stream", "--batch-size", "2", "--resume")
+        self.assertIn("Resuming after batch 5", output)
+        # 实体没有被重复导入，续传的连线仍按恢复的映射指向 auto_id 新建的 n0_1
+        self.assertEqual(Entity.objects.filter(domain="bulk").count(), 7)
+        self.assertEqual(Relationship.objects.filter(domain="bulk").count(), 5)
+        self.assertTrue(Relationship.objects.filter(source_id="n0_1", target_id="n1").exists())
+        self.assertIn("Created: 5", output)
+        self.assertIsNotNone(ImportCheckpoint.objects.get().finished_at)
+        self.assertFalse(ImportMappingChunk.objects.exists())
+
+        with self.assertRaisesMessage(CommandError, "No unfinished import"):
+            self._import("json", path, "--resume")
+
+
+@override_settings(KG_JOB_WORKERS=0, KG_IMPORT_BATCH_SIZE=2)
+class GraphJobTests(TestCase):
+    payload = {
+        "domain": "jobs",
+        "nodes": [{"id": f"j{i}", "name": f"任务实体{i}"} for i in range(5)],
+        "links": [{"source": "j0", "target": "j1", "type": "关联"}, {"source": "j0", "target": "missing", "type": "关联"}],
+    }
+
+    def _submit(self, method, url, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertEqual(response.status_code, 202)
+        data = response.json()["data"]
+        return self.client.get(data["status_url"]).json()["data"]
+
+    def test_async_import_reports_like_sync_import(self):
+        status = self._submit("post", "/api/kg/import?async=1", data=json.dumps(self.payload),
+                              content_type="application/json")
+        self.assertEqual((status["status"], status["processed"], status["total"]), ("succeeded", 7, 7))
+        stats = status["result"]["import_stats"]
+        self.assertEqual((stats["entities"]["created"], stats["relationships"]["created"]), (5, 1))
+        self.assertEqual(stats["relationships"]["errors"], 1)
+        self.assertEqual(Entity.objects.filter(domain="jobs").count(), 5)
+
+    def test_failed_job_keeps_error(self):
+        with patch.object(GraphImporter, "import_relationships", side_effect=DatabaseError("locked")):
+            status = self._submit("post", "/api/kg/import?async=1", data=json.dumps(self.payload),
+                                  content_type="application/json")
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("locked", status["error"])
+        # 后台导入按批提交，失败前的批次保留
+        self.assertEqual(Entity.objects.filter(domain="jobs").count(), 5)
+
+    def test_async_export_download(self):
+        GraphImporter("jobs").run(self.payload["nodes"], self.payload["links"])
+        with tempfile.TemporaryDirectory() as job_dir, override_settings(KG_JOB_DIR=job_dir):
+            status = self._submit("get", "/api/kg/export", data={"domain": "jobs", "async": "1"})
+            self.assertEqual(status["status"], "succeeded")
+            response = self.client.get(status["download_url"])
+            exported = json.loads(b"".join(response.streaming_content))
+            response.close()
+        expected = self.client.get("/api/kg/export", {"domain": "jobs"}).json()
+        key = lambda item: item["id"]
+        self.assertEqual(sorted(exported["data"]["nodes"], key=key), sorted(expected["data"]["nodes"], key=key))
+        self.assertEqual(sorted(exported["data"]["links"], key=key), sorted(expected["data"]["links"], key=key))
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get("/api/kg/jobs/nope").json()["ret"], 1)
+
+    def test_poll_fails_job_of_restarted_process(self):
+        # 容器重启后进程号可能不变，靠启动标识区分
+        host = socket.gethostname()
+        orphan = GraphJob.objects.create(id="orphan", kind=GraphJob.KIND_EXPORT, domain="jobs",
+                                         status=GraphJob.STATUS_RUNNING, worker=f"{host}:{os.getpid()}:before")
+        live = GraphJob.objects.create(id="live", kind=GraphJob.KIND_EXPORT, domain="jobs",
+                                       status=GraphJob.STATUS_RUNNING, worker=jobs._worker_name())
+        status = self.client.get(f"/api/kg/jobs/{orphan.pk}").json()["data"]
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("Interrupted", status["error"])
+        self.assertEqual(self.client.get(f"/api/kg/jobs/{live.pk}").json()["data"]["status"], "running")
+
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        Entity.objects.create(id="x1", name='逗号,"引号"', description="多行\n描述\x01", domain="exp")
+        Entity.objects.create(id="x2", name="<标签>&", domain="exp")
+        Entity.objects.create(id="other", name="其它领域", domain="other")
+        Relationship.objects.create(source_id="x1", target_id="x2", type="指向", domain="exp")
+
+    def _export(self, **params):
+        response = self.client.get("/api/kg/export", {"domain": "exp", **params})
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def test_ndjson_and_csv_match_import_fields(self):
+        _, body = self._export(format="ndjson", table="relationships")
+        rows = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+        self.assertEqual([(r["source"], r["target"], r["type"]) for r in rows], [("x1", "x2", "指向")])
+
+        response, body = self._export(format="csv", table="entities")
+        self.assertIn("kg-exp-entities.csv", response["Content-Disposition"])
+        rows = {r["id"]: r for r in csv.DictReader(io.StringIO(body.decode("utf-8")))}
+        self.assertEqual({i: r["name"] for i, r in rows.items()}, {"x1": '逗号,"引号"', "x2": "<标签>&"})
+        self.assertEqual(rows["x1"]["description"], "多行\n描述\x01")
+
+        self.assertEqual(self.client.get("/api/kg/export", {"format": "csv"}).json()["ret"], 1)
+
+    def test_graphml_is_well_formed(self):
+        _, body = self._export(format="graphml")
+        ns = {"g": "http://graphml.graphdrawing.org/xmlns"}
+        graph = ElementTree.fromstring(body).find("g:graph", ns)
+        self.assertEqual(sorted(n.get("id") for n in graph.findall("g:node", ns)), ["x1", "x2"])
+        edge = graph.find("g:edge", ns)
+        self.assertEqual((edge.get("source"), edge.get("target")), ("x1", "x2"))
+        names = [d.text for d in graph.findall("g:node/g:data[@key='n_name']", ns)]
+        self.assertIn("<标签>&", names)
+
+    def test_gzip(self):
+        _, plain = self._export(format="ndjson", table="entities")
+        response, compressed = self._export(format="ndjson", table="entities", gzip="1")
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn("kg-exp-entities.ndjson.gz", response["Content-Disposition"])
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+
+class GraphSnapshotTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        _seed("snap", 3)
+        Entity.objects.create(id="ext", name="外部实体", domain="other")
+        Relationship.objects.create(source_id="snap_2", target_id="ext", type="引用", description="跨领域", domain="snap")
+
+    def _state(self):
+        entities = Entity.objects.filter(domain="snap").order_by("id")
+        relations = Relationship.objects.filter(domain="snap").order_by("id")
+        return (
+            list(entities.values_list("id", "name", "type", "description", "created_at", "updated_at")),
+            list(relations.values_list("id", "source_id", "target_id", "type", "description", "created_at")),
+        )
+
+    def test_round_trip_via_api(self):
+        before = self._state()
+        response = self.client.get("/api/kg/snapshot", {"domain": "snap"})
+        self.assertIn("kg-snap.npz", response["Content-Disposition"])
+        data = b"".join(response.streaming_content)
+
+        Entity.objects.filter(id="snap_0").delete()
+        Entity.objects.create(id="snap_new", name="新增", domain="snap")
+        version = get_version("snap")
+        result = self.client.post("/api/kg/snapshot", data, content_type="application/octet-stream").json()
+        self.assertEqual(result["ret"], 0)
+        self.assertEqual(result["data"]["entities"], 3)
+        self.assertEqual(result["data"]["relationships"], 3)
+        self.assertEqual(self._state(), before)
+        self.assertGreater(get_version("snap"), version)
+        self.assertEqual(Entity.objects.filter(domain="other").count(), 1)
+        if search.index_available():
+            self.assertEqual([e["id"] for e in search.search_entities("实体1", 5)], ["snap_1"])
+
+    def test_restore_resets_domains_that_lose_relationships(self):
+        Relationship.objects.create(source_id="ext", target_id="snap_0", type="引用", domain="other")
+        data = b"".join(self.client.get("/api/kg/snapshot", {"domain": "snap"}).streaming_content)
+        before = self.client.get("/api/kg/data", {"domain": "other"})
+        self.assertEqual(len(before.json()["data"]["links"]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/kg/snapshot", data, content_type="application/octet-stream")
+        after = self.client.get("/api/kg/data", {"domain": "other"}, HTTP_IF_NONE_MATCH=before["ETag"])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.json()["data"]["links"], [])
+        self.assertTrue(changefeed.changes_since(0, "other")["full_reload"])
+
+    def test_command_skips_missing_external_endpoints(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snap.npz")
+            call_command("kg_snapshot", "save", path, "--domain", "snap", stdout=io.StringIO())
+            Entity.objects.filter(id="ext").delete()
+            out = io.StringIO()
+            call_command("kg_snapshot", "load", path, stdout=out)
+        self.assertIn("Skipped 1 relationships", out.getvalue())
+        self.assertEqual(Relationship.objects.filter(domain="snap").count(), 2)
+
+    def test_rejects_invalid_files(self):
+        result = self.client.post("/api/kg/snapshot", b"not a snapshot", content_type="application/octet-stream")
+        self.assertEqual(result.json()["ret"], 1)
+        buf = io.BytesIO()
+        np.savez(buf, header=np.frombuffer(b'{"format": "other"}', dtype=np.uint8))
+        result = self.client.post("/api/kg/snapshot", buf.getvalue(), content_type="application/octet-stream")
+        self.assertEqual(result.json()["msg"], "Not a knowledge graph snapshot")
+        self.assertEqual(Entity.objects.filter(domain="snap").count(), 3)
+
+
+class GraphImageTests(TransactionTestCase):
+    # 镜像只在事务之外发布，不能在 TestCase 的事务中测试
+    def setUp(self):
+        super().setUp()
+        graph_image.clear()
+        self.addCleanup(graph_image.clear)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.image_dir = tmp.name
+        settings_override = override_settings(KG_GRAPH_IMAGE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        a, b, c = _seed("img", 3)
+        Relationship.objects.create(source=a, target=c, type="引用", domain="img")
+        Relationship.objects.create(source=c, target=a, type="包含", domain="img")
+        Entity.objects.create(id="far", name="其它领域", domain="other")
+        Relationship.objects.create(source=a, target_id="far", type="引用", domain="img")
+
+    def _files(self):
+        return sorted(name for name in os.listdir(self.image_dir) if name.endswith(".kgimg"))
+
+    def test_published_image_is_memory_mapped(self):
+        image = graph_image.get_graph_image("img")
+        self.assertIsInstance(image.buffer, mmap.mmap)
+        self.assertEqual(len(self._files()), 1)
+        self.assertIs(graph_image.get_graph_image("img"), image)
+
+        self.assertEqual(image.node_ids(), ["img_0", "img_1", "img_2"])
+        self.assertEqual(image.edge_count, 4)  # 跨领域关系不计入
+        self.assertIsNone(image.index("far"))
+        a, c = image.index("img_0"), image.index("img_2")
+        targets, types, _ = image.neighbors(a)
+        self.assertEqual([(image.types[t], image.node_id(n)) for n, t in zip(targets, types)],
+                         [("包含", "img_1"), ("引用", "img_2")])
+        self.assertEqual(list(image.neighbors(a, type_code=image.type_code("引用"))[0]), [c])
+        self.assertEqual(sorted(image.neighbors(a, "in")[0]), [c])
+        self.assertFalse(image.indices["out"].flags.writeable)
+
+        Relationship.objects.create(source_id="img_2", target_id="img_1", type="包含", domain="img")
+        image = graph_image.get_graph_image("img")
+        self.assertEqual(image.edge_count, 5)
+        self.assertEqual(self._files(), [os.path.basename(graph_image._image_path("img", image.version))])
+
+    def test_not_published_inside_transaction(self):
+        with transaction.atomic():
+            Entity.objects.create(id="img_9", name="未提交", domain="img")
+            image = graph_image.get_graph_image("img")
+        self.assertIsInstance(image.buffer, bytes)
+        self.assertEqual(image.node_count, 4)
+        self.assertEqual(self._files(), [])
+
+    def test_build_does_not_take_the_write_lock(self):
+        with CaptureQueriesContext(connection) as captured:
+            graph_image.get_graph_image("img")
+        begins = [q["sql"] for q in captured.captured_queries if q["sql"].startswith("BEGIN")]
+        self.assertEqual(begins, ["BEGIN DEFERRED"])
+        # 写入仍以 IMMEDIATE 开始
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+    def test_read_transaction_on_new_and_reopened_connections(self):
+        begins, errors = [], []
+
+        def record(execute, sql, params, many, context):
+            if sql.startswith("BEGIN"):
+                begins.append(sql)
+            return execute(sql, params, many, context)
+
+        def run():
+            # 新线程上的连接尚未建立；之后真正关闭（测试库在内存中，close() 不会断开）再重连
+            try:
+                with connection.execute_wrapper(record):
+                    for _ in range(2):
+                        with read_transaction():
+                            Entity.objects.count()
+                        BaseDatabaseWrapper.close(connection)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(begins, ["BEGIN DEFERRED", "BEGIN DEFERRED"])
+
+
+class GraphEngineTests(TransactionTestCase):
+    # 引擎只在事务之外缓存与修补，不能在 TestCase 的事务中测试
+    def setUp(self):
+        super().setUp()
+        graph_image.clear()
+        graph_engine.clear()
+        self.addCleanup(graph_engine.clear)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(KG_GRAPH_IMAGE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        _seed("eng", 3)
+
+    def _out(self, engine, entity_id, types=None):
+        others, codes, _ = engine.neighbors(engine.index(entity_id), "out", types)
+        return sorted((engine.node_id(o), engine.types[c]) for o, c in zip(others, codes))
+
+    def test_signals_patch_the_loaded_engine(self):
+        engine = graph_engine.get_engine("eng")
+        Entity.objects.create(id="eng_new", name="新实体", domain="eng")
+        rel = Relationship.objects.create(source_id="eng_0", target_id="eng_new", type="引用", domain="eng")
+        Relationship.objects.filter(source_id="eng_0", target_id="eng_1").delete()
+        self.assertEqual(self._out(engine, "eng_0"), [("eng_new", "引用")])
+        self.assertEqual(self._out(engine, "eng_0", {engine.type_code("包含")}), [])
+        self.assertEqual(list(engine.neighbors(engine.index("eng_new"), "in")[2]), [rel.pk])
+        origins, others, _, rels = engine.expand([engine.index("eng_0"), engine.index("eng_1")], "out")
+        self.assertEqual(sorted(zip(origins.tolist(), others.tolist(), rels.tolist())), sorted([
+            (engine.index("eng_0"), engine.index("eng_new"), rel.pk),
+            (engine.index("eng_1"), engine.index("eng_2"), Relationship.objects.get(source_id="eng_1").pk),
+        ]))
+
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            Relationship.objects.create(source_id="eng_2", target_id="eng_0", type="引用", domain="eng")
+            raise DatabaseError("rollback")
+        self.assertEqual(self._out(engine, "eng_2"), [])
+        self.assertIs(graph_engine.get_engine("eng"), engine)
+
+    def test_catches_up_on_bulk_writes_and_reloads_after_reset(self):
+        engine = graph_engine.get_engine("eng")
+        GraphImporter("eng", conflict_resolution="merge_data").run(
+            [{"id": "eng_2", "name": "实体2"}, {"id": "eng_b", "name": "批量"}],
+            [{"source": "eng_2", "target": "eng_b", "type": "包含"}],
+        )
+        self.assertEqual(self._out(engine, "eng_2"), [])  # 批量写入不发送信号
+        self.assertIs(graph_engine.get_engine("eng"), engine)
+        self.assertEqual(self._out(engine, "eng_2"), [("eng_b", "包含")])
+
+        with coalesce_writes():
+            mark_reset("eng")
+        reloaded = graph_engine.get_engine("eng")
+        self.assertIsNot(reloaded, engine)
+        self.assertEqual(self._out(reloaded, "eng_2"), [("eng_b", "包含")])
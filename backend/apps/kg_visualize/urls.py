@@ -12,15 +12,26 @@ urlpatterns = [
 
     # Entity CRUD
     path('entities', views.list_or_create_entities, name='list_or_create_entities'),
+    path('entities/suggest', views.suggest_entities, name='suggest_entities'),
     path('entities/<str:entity_id>', views.entity_detail, name='entity_detail'),
+    path('entities/<str:entity_id>/neighborhood', views.entity_neighborhood, name='entity_neighborhood'),
+    path('path', views.entity_path, name='entity_path'),
 
     # Relationship CRUD
     path('relationships', views.list_or_create_relationships, name='list_or_create_relationships'),
     path('relationships/<int:rel_id>', views.relationship_detail, name='relationship_detail'),
 
+    # Change feed (delta sync)
+    path('changes', views.graph_changes, name='graph_changes'),
+
     # Import/Export
     path('export', views.export_graph, name='export_graph'),
     path('import', views.import_graph, name='import_graph'),
+    path('snapshot', views.graph_snapshot, name='graph_snapshot'),
+
+    # Background jobs (async import/export)
+    path('jobs/<str:job_id>', views.job_detail, name='job_detail'),
+    path('jobs/<str:job_id>/download', views.job_download, name='job_download'),
 
     # AI Chat
     path('ai-chat', views.ai_chat, name='ai_chat'),
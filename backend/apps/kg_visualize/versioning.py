@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+图谱领域版本号
+
+每个领域维护一个单调递增的版本号，实体/关系的任何写入都会使所在领域
+以及 "all" 的版本号加一。读接口用版本号生成 ETag，客户端携带
+If-None-Match 时只需查询版本表即可返回 304。
+
+批量写入（导入、数据模式保存、清空）请包在 coalesce_writes() 中，
+整个批次结束后每个领域只更新一次版本号，变更日志也一次性批量写入。
+
+版本号更新所在事务提交后发送 graph_changed 信号（参数 domains），
+缓存等派生状态据此失效。
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import Signal
+
+from .models import DomainVersion
+
+ALL_DOMAINS = "all"
+
+graph_changed = Signal()
+
+_local = threading.local()
+
+
+def get_version(domain):
+    version = DomainVersion.objects.filter(domain=domain).values_list("version", flat=True).first()
+    return version or 0
+
+
+def bump(domains):
+    """将给定领域（以及 all）的版本号加一"""
+    domains = {d for d in domains if d} | {ALL_DOMAINS}
+    for domain in sorted(domains):
+        updated = DomainVersion.objects.filter(domain=domain).update(version=F("version") + 1)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    DomainVersion.objects.create(domain=domain, version=1)
+            except IntegrityError:
+                # 并发创建，改为递增已存在的记录
+                DomainVersion.objects.filter(domain=domain).update(version=F("version") + 1)
+    transaction.on_commit(lambda: graph_changed.send(sender=DomainVersion, domains=domains))
+
+
+def mark_dirty(*domains):
+    """记录领域发生了写入；在 coalesce_writes() 中时延迟到批次结束统一处理"""
+    record_write(domains)
+
+
+def record_write(domains, changes=()):
+    """
+    记录一次写入。
+
+    domains 为受影响的领域，changes 为变更日志条目 (domain, kind, object_id, op)，
+    见 changefeed.append()。
+    """
+    batch = getattr(_local, "batch", None)
+    if batch is not None:
+        batch.domains.update(d for d in domains if d)
+        batch.changes.extend(changes)
+        return
+    _flush(set(domains), list(changes), set())
+
+
+def mark_reset(*domains):
+    """
+    领域数据被整体替换（清空、数据模式保存）。
+
+    变更日志中该领域的逐行记录会被一条 reset 记录代替，增量同步的客户端
+    遇到 reset 时需要整体重新加载。
+    """
+    batch = getattr(_local, "batch", None)
+    if batch is not None:
+        batch.resets.update(domains)
+        return
+    _flush(set(), [], set(domains))
+
+
+class _WriteBatch:
+    def __init__(self):
+        self.domains = set()
+        self.changes = []
+        self.resets = set()
+
+
+def _flush(domains, changes, resets):
+    from . import changefeed
+
+    domains = domains | {change[0] for change in changes}
+    if not (domains or resets):
+        return
+    # 先更新版本号：bump() 写入 all 领域的版本记录，该行的写锁持有到事务提交，
+    # 之后插入的变更日志因此按提交顺序分配 seq（见 changefeed 模块说明）
+    with transaction.atomic():
+        bump(domains | resets)
+        changefeed.append(changes, resets)
+
+
+@contextmanager
+def read_transaction():
+    """
+    只读事务：其中的多条查询读到同一份一致的数据。
+
+    SQLite 的事务默认以 IMMEDIATE 开始（开始即取得写锁，见 settings.py），只读事务
+    改以 DEFERRED 开始，不取得写锁：多个只读事务可以并发，写入也不必等到读取结束
+    才能开始。已在事务中时沿用外层事务。
+    """
+    connection = transaction.get_connection()
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        with transaction.atomic():
+            yield
+        return
+    # transaction_mode 在建立连接时才按 OPTIONS 设置：先连接，否则新线程上没有该属性，
+    # 已关闭的连接在 atomic() 中重连时又会被重置为 IMMEDIATE
+    connection.ensure_connection()
+    mode = connection.transaction_mode
+    connection.transaction_mode = "DEFERRED"
+    try:
+        # BEGIN 在进入 atomic() 时执行
+        with transaction.atomic():
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
+
+
+@contextmanager
+def coalesce_writes():
+    """
+    合并批量写入产生的版本更新与变更日志。
+
+    支持嵌套，只有最外层退出时才真正写入；即使批次中途抛出异常，
+    已经发生的写入仍会被记录（若外层事务回滚，记录也会一起回滚）。
+    """
+    if getattr(_local, "batch", None) is not None:
+        yield
+        return
+    _local.batch = _WriteBatch()
+    try:
+        yield
+    finally:
+        batch, _local.batch = _local.batch, None
+        connection = transaction.get_connection()
+        # 事务已标记回滚时写入会被一并撤销，无需（也无法）再记录
+        if not (connection.in_atomic_block and connection.needs_rollback):
+            _flush(batch.domains, batch.changes, batch.resets)
@@ -1,64 +1,302 @@
 # -*- coding: utf-8 -*-
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 from django.db import transaction, models
-from .models import Entity, Relationship
+from django.conf import settings
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from . import changefeed, jobs
+from .exporters import EXPORTERS, ExportError, gzip_stream
+from .columnar import build_columnar
+from .communities import MAX_LEVELS as LOD_MAX_LEVELS, drill_down, get_communities, lod_graph
+from .graph_cache import snapshot_cache
+from .importer import GraphImporter
+from .layout import get_layout
+from .models import Entity, GraphJob, GraphLayout, Relationship
+from .neighborhood import DIRECTIONS as NEIGHBORHOOD_DIRECTIONS, neighborhood
+from .pagination import (
+    PaginationError, cursor_state, encode_cursor, entity_page, is_paginated, parse_limit,
+    read_after, relationship_page,
+)
+from .paths import DIRECTIONS as PATH_DIRECTIONS, PathError, find_paths
+from .search import search_entities, uses_index
+from .snapshot import SnapshotError, clear_domain, load_snapshot, save_snapshot
+from .spatial import viewport
+from .streaming import get_chunk_size, graph_querysets, link_to_d3, node_to_d3, stream_graph_data
+from .suggest import suggest
+from .versioning import ALL_DOMAINS, coalesce_writes, get_version
+import hashlib
+import io
 import json
+import tempfile
 # 使用openai库调用ChatGPT API
 import openai
 
+def _request_version(request, domain):
+    """同一请求内只查询一次领域版本号（ETag 与快照缓存共用）"""
+    versions = request.__dict__.setdefault("_kg_versions", {})
+    if domain not in versions:
+        versions[domain] = get_version(domain)
+    return versions[domain]
+
+
+def _request_layout(request, domain):
+    """同一请求内只取一次布局（ETag 与响应内容共用），返回 (layout, stale)"""
+    layouts = request.__dict__.setdefault("_kg_layouts", {})
+    if domain not in layouts:
+        layouts[domain] = get_layout(domain, _request_version(request, domain))
+    return layouts[domain]
+
+
+def _request_communities(request, domain):
+    """同一请求内只取一次社区层次（ETag 与响应内容共用），返回 (communities, stale)"""
+    communities = request.__dict__.setdefault("_kg_communities", {})
+    if domain not in communities:
+        communities[domain] = get_communities(domain, _request_version(request, domain))
+    return communities[domain]
+
+
+def _communities_version(request, domain):
+    """当前社区层次的版本（尚未计算时为 None）；该层结果已在快照缓存中时即为最新，不查询"""
+    version = _request_version(request, domain)
+    if snapshot_cache.get(domain, f"lod{request.GET.get('lod')}", version) is not None:
+        return version
+    communities, _ = _request_communities(request, domain)
+    return communities.version if communities is not None else None
+
+
+def _graph_etag(request, *args, **kwargs):
+    """
+    由领域版本号生成强 ETag，只查询版本表不触碰实体/关系表。
+
+    同一版本下不同的查询参数（分页、格式等）对应不同的表示，一并计入摘要。
+    请求布局或社区层次时，后台计算完成后数据版本不变但内容变化，其版本也计入 ETag。
+    """
+    domain = request.GET.get('domain', 'all')
+    params = "&".join(f"{k}={v}" for k, values in sorted(request.GET.lists()) for v in values)
+    digest = hashlib.sha1(f"{request.path}?{params}".encode("utf-8")).hexdigest()[:16]
+    etag = f"v{_request_version(request, domain)}-{digest}"
+    if request.GET.get('lod'):
+        etag += f"-c{_communities_version(request, domain)}"
+    elif _wants_layout(request):
+        etag += f"-l{_layout_version(request, domain)}"
+    return f'"{etag}"'
+
+
+def _layout_version(request, domain):
+    """当前布局版本（尚无布局时为 None）；布局已是最新时只做一次存在性查询，不读取坐标数据"""
+    versions = request.__dict__.setdefault("_kg_layout_versions", {})
+    if domain not in versions:
+        version = _request_version(request, domain)
+        if GraphLayout.objects.filter(domain=domain, version=version).exists():
+            versions[domain] = version
+        else:
+            layout, _ = _request_layout(request, domain)
+            versions[domain] = layout.version if layout is not None else None
+    return versions[domain]
+
+
+def _wants_layout(request):
+    # 视口查询同样依赖布局坐标
+    return _is_truthy(request.GET.get('layout')) or bool(request.GET.get('bbox'))
+
+
+def _cached_snapshot(request, domain, fmt, build, compact=False):
+    """
+    返回已序列化的快照；未命中时调用 build() 生成响应内容并写入缓存。
+
+    版本号在查询数据之前读取：若生成期间有新的写入，缓存内容只会比版本号新，
+    下一次请求版本号不匹配时会重新生成。
+    """
+    version = _request_version(request, domain)
+    content = snapshot_cache.get(domain, fmt, version)
+    if content is None:
+        params = {"separators": (",", ":")} if compact else None
+        content = JsonResponse(build(), json_dumps_params=params).content
+        snapshot_cache.set(domain, fmt, version, content)
+    return HttpResponse(content, content_type="application/json")
+
+
+def _columnar_snapshot(request, domain):
+    """列式格式（format=columnar），/data 与 /export 共用同一份缓存"""
+    return _cached_snapshot(request, domain, "columnar", lambda: {
+        "ret": 0, "format": "columnar", "data": build_columnar(domain), "domain": domain
+    }, compact=True)
+
+
+def _layout_snapshot(request, domain, fmt):
+    """
+    附带服务端布局坐标的快照（layout=1）。
+
+    节点带 x/y（列式格式为 nodes.x / nodes.y 两列，没有坐标的节点为 null），
+    顶层 layout 字段给出布局版本及是否过期。过期布局（大领域等待离线计算）不写入缓存。
+    """
+    def build():
+        layout, stale = _request_layout(request, domain)
+        positions = layout.positions_by_id() if layout is not None else {}
+        meta = {"version": layout.version if layout is not None else None, "stale": stale}
+        if fmt == "columnar":
+            data = build_columnar(domain)
+            coords = [positions.get(node_id) for node_id in data["nodes"]["id"]]
+            data["nodes"]["x"] = [round(c[0], 1) if c else None for c in coords]
+            data["nodes"]["y"] = [round(c[1], 1) if c else None for c in coords]
+            return {"ret": 0, "format": "columnar", "data": data, "domain": domain, "layout": meta}
+        data = _build_graph_data(domain)
+        for node in data["nodes"]:
+            coord = positions.get(node["id"])
+            if coord is not None:
+                node["x"], node["y"] = round(coord[0], 1), round(coord[1], 1)
+        return {"ret": 0, "data": data, "domain": domain, "layout": meta}
+
+    # 布局已是当前版本时走快照缓存，命中时无需读取坐标
+    if _layout_version(request, domain) != _request_version(request, domain):
+        return JsonResponse(build(), json_dumps_params={"separators": (",", ":")} if fmt == "columnar" else None)
+    return _cached_snapshot(request, domain, f"{fmt}_layout", build, compact=fmt == "columnar")
+
+
 @csrf_exempt  # 跨域请求时关闭CSRF验证
+@condition(etag_func=_graph_etag)
 def get_graph_data(request): #获取知识图谱完整数据：实体+关系"""
     if request.method == 'GET':
         try:
             # 获取领域参数，默认为all（返回所有领域）
             domain = request.GET.get('domain', 'all')
-            
-            # 查询实体（如果指定了特定领域则过滤，否则返回所有）
-            if domain == 'all':
-                entities = Entity.objects.all().values("id", "name", "type", "description", "domain")
-                relations = Relationship.objects.all().values(
-                    "id", "source_id", "target_id", "type", "description", "domain"
-                )
-            else:
-                entities = Entity.objects.filter(domain=domain).values("id", "name", "type", "description", "domain")
-                relations = Relationship.objects.filter(domain=domain).values(
-                    "id", "source_id", "target_id", "type", "description", "domain"
-                )
-            # 转换为D3.js可识别的格式
-            graph_data = {
-                "nodes": [
-                    {
-                        "id": e["id"],
-                        "name": e["name"],
-                        "type": e.get("type", ""),
-                        "description": e.get("description", ""),
-                        "domain": e.get("domain") or "default"
-                    } for e in entities
-                ],
-                "links": [
-                    {
-                        "source": r["source_id"],
-                        "target": r["target_id"],
-                        "type": r["type"],
-                        "description": r.get("description", ""),
-                        "id": r["id"],
-                        "domain": r.get("domain") or "default"
-                    } for r in relations
-                ]
-            }
-            
-            # 添加调试信息
-            print(f"后端返回数据 - 领域: {domain}, 实体数: {len(graph_data['nodes'])}, 关系数: {len(graph_data['links'])}")
-            print(f"实体领域分布: {[e.get('domain', 'default') for e in entities]}")
-            print(f"关系领域分布: {[r.get('domain', 'default') for r in relations]}")
-            
-            return JsonResponse({"ret": 0, "data": graph_data, "domain": domain})
+            fmt = request.GET.get('format', 'd3')
+            if fmt not in ('d3', 'columnar'):
+                return _json_error(f"Unsupported format: {fmt}")
+            # 流式输出只支持完整的 d3 格式，与其它模式同时指定时拒绝，而不是静默忽略 stream
+            if _is_truthy(request.GET.get('stream')):
+                conflicts = [name for name, used in (
+                    ("format=columnar", fmt == 'columnar'),
+                    ("layout", _is_truthy(request.GET.get('layout'))),
+                    ("lod", bool(request.GET.get('lod'))),
+                    ("bbox", bool(request.GET.get('bbox'))),
+                    ("limit/cursor", is_paginated(request)),
+                ) if used]
+                if conflicts:
+                    return _json_error(f"'stream' cannot be combined with {', '.join(conflicts)}", status=400)
+            # 多层次视图：返回社区超级节点，或下钻到某个社区
+            if request.GET.get('lod'):
+                return _lod_response(request, domain)
+            # 视口查询：只返回布局坐标落在矩形内的节点及与其相连的关系
+            if request.GET.get('bbox'):
+                return _viewport_response(request, domain)
+            # 服务端预计算布局：客户端可直接按坐标渲染，无需浏览器端力导向迭代
+            if _wants_layout(request):
+                return _layout_snapshot(request, domain, fmt)
+            if fmt == 'columnar':
+                return _columnar_snapshot(request, domain)
+
+            # 流式模式：边查询边输出，内存占用不随图谱规模增长
+            if _is_truthy(request.GET.get('stream')):
+                return StreamingHttpResponse(stream_graph_data(domain), content_type="application/json")
+
+            # 游标分页模式：先按 (domain, id) 分页返回实体，再按 id 分页返回关系
+            if is_paginated(request):
+                return _graph_data_page(request, domain)
+
+            return _cached_snapshot(request, domain, "d3", lambda: {
+                "ret": 0, "data": _build_graph_data(domain), "domain": domain
+            })
         except Exception as e:
             return JsonResponse({"ret": 1, "msg": f"Finding data failed: {str(e)}"})
     return JsonResponse({"ret": 1, "msg": "Unsupported request method"})
 
+
+def _lod_response(request, domain):
+    """lod=N：第 N 层社区超级节点；lod=N&cluster=C：下钻到第 N 层的社区 C"""
+    try:
+        level = int(request.GET['lod'])
+        cluster = int(request.GET['cluster']) if request.GET.get('cluster') else None
+    except ValueError:
+        return _json_error("'lod' and 'cluster' must be integers")
+    if not 1 <= level <= LOD_MAX_LEVELS:
+        return _json_error(f"'lod' must be between 1 and {LOD_MAX_LEVELS}")
+
+    # 大领域的社区层次过期时返回旧结果（stale），后台任务计算完成前不写入快照缓存，
+    # 因此缓存中的结果总是最新的，命中时不再查询社区表
+    if cluster is None:
+        content = snapshot_cache.get(domain, f"lod{level}", _request_version(request, domain))
+        if content is not None:
+            return HttpResponse(content, content_type="application/json")
+    communities, stale = _request_communities(request, domain)
+    meta = {"version": communities.version if communities is not None else None, "stale": stale}
+    if cluster is not None:
+        data = drill_down(domain, level, cluster, communities)
+        if data is None:
+            return _json_error("cluster not found")
+        return JsonResponse({
+            "ret": 0, "lod": level, "cluster": cluster, "data": data, "domain": domain, "communities": meta
+        })
+
+    def build():
+        actual, levels, data = lod_graph(domain, level, communities)
+        return {"ret": 0, "lod": actual, "levels": levels, "data": data, "domain": domain, "communities": meta}
+    if stale:
+        return JsonResponse(build())
+    return _cached_snapshot(request, domain, f"lod{level}", build)
+
+
+def _viewport_response(request, domain):
+    """bbox=x0,y0,x1,y1（布局坐标），可选 limit 限制返回的节点数"""
+    try:
+        x0, y0, x1, y1 = (float(v) for v in request.GET['bbox'].split(','))
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+    except ValueError:
+        return _json_error("'bbox' must be x0,y0,x1,y1 and 'limit' an integer")
+    if limit is not None and limit <= 0:
+        return _json_error("'limit' must be positive")
+
+    bbox = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    result = viewport(domain, bbox, _request_version(request, domain), limit)
+    if result is None:
+        return _json_error("layout not available yet, run compute_kg_layout")
+    return JsonResponse({"ret": 0, "domain": domain, "bbox": list(bbox), **result})
+
+
+def _build_graph_data(domain):
+    # 查询实体（如果指定了特定领域则过滤，否则返回所有）
+    entities, relations = graph_querysets(domain)
+    # 转换为D3.js可识别的格式
+    graph_data = {
+        "nodes": [node_to_d3(e) for e in entities],
+        "links": [link_to_d3(r) for r in relations]
+    }
+    
+    # 添加调试信息
+    print(f"后端返回数据 - 领域: {domain}, 实体数: {len(graph_data['nodes'])}, 关系数: {len(graph_data['links'])}")
+    print(f"实体领域分布: {[e.get('domain', 'default') for e in entities]}")
+    print(f"关系领域分布: {[r.get('domain', 'default') for r in relations]}")
+    return graph_data
+
+
+def _graph_data_page(request, domain):
+    try:
+        limit = parse_limit(request)
+        state = cursor_state(request, {"k": "entity", "after": None})
+        entities, relations = graph_querysets(domain)
+        nodes, links = [], []
+        if state.get("k") == "entity":
+            rows, after = entity_page(entities, read_after(state, "entity"), limit)
+            nodes = [node_to_d3(e) for e in rows]
+            # 实体取完后，下一页从第一条关系开始
+            next_state = {"k": "entity", "after": after} if after else {"k": "relationship", "after": None}
+        else:
+            rows, after = relationship_page(relations, read_after(state, "relationship"), limit)
+            links = [link_to_d3(r) for r in rows]
+            next_state = {"k": "relationship", "after": after} if after is not None else None
+    except PaginationError as e:
+        return _json_error(str(e))
+
+    return JsonResponse({
+        "ret": 0,
+        "data": {"nodes": nodes, "links": links},
+        "domain": domain,
+        "next_cursor": encode_cursor(next_state) if next_state else None
+    })
+
+
 @csrf_exempt  # 跨域请求时关闭CSRF验证
 def add_entity(request):
     """
@@ -90,8 +328,12 @@ def add_entity(request):
 # Entity CRUD
 # -----------------------------
 
-def _json_error(message):
-    return JsonResponse({"ret": 1, "msg": message})
+def _json_error(message, status=200):
+    return JsonResponse({"ret": 1, "msg": message}, status=status)
+
+
+def _is_truthy(value):
+    return str(value or "").lower() in ("1", "true", "yes", "on")
 
 
 @csrf_exempt
@@ -99,10 +341,25 @@ def _json_error(message):
 def list_or_create_entities(request):
     if request.method == "GET":
         q = request.GET.get("q", "").strip().lower()
-        queryset = Entity.objects.all()
         if q:
-            queryset = queryset.filter(models.Q(id__icontains=q) | models.Q(name__icontains=q) | models.Q(description__icontains=q))
-        data = list(queryset.values("id", "name", "type", "description", "domain"))
+            # 关键词检索走全文索引，按相关度排序并受 limit 限制；过短的关键词（SQLite 上
+            # 少于 3 个字符，包括 2 个字的中文词）不走索引，退回到扫描，indexed 为 false
+            try:
+                limit = parse_limit(request, getattr(settings, "KG_SEARCH_DEFAULT_LIMIT", 50))
+            except PaginationError as e:
+                return _json_error(str(e))
+            return JsonResponse({"ret": 0, "data": search_entities(q, limit), "indexed": uses_index(q)})
+        queryset = Entity.objects.all().values("id", "name", "type", "description", "domain")
+        if is_paginated(request):
+            try:
+                rows, after = entity_page(
+                    queryset, read_after(cursor_state(request), "entity"), parse_limit(request)
+                )
+            except PaginationError as e:
+                return _json_error(str(e))
+            next_cursor = encode_cursor({"k": "entity", "after": after}) if after else None
+            return JsonResponse({"ret": 0, "data": rows, "next_cursor": next_cursor})
+        data = list(queryset)
         return JsonResponse({"ret": 0, "data": data})
 
     # POST create
@@ -127,6 +384,22 @@ def list_or_create_entities(request):
         return _json_error(str(e))
 
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def suggest_entities(request):
+    """前缀补全：/api/kg/entities/suggest?prefix=&domain=&limit=，匹配实体名称或 ID"""
+    prefix = request.GET.get("prefix", "").strip()
+    domain = request.GET.get("domain", ALL_DOMAINS)
+    try:
+        limit = int(request.GET.get("limit", getattr(settings, "KG_SUGGEST_DEFAULT_LIMIT", 10)))
+    except ValueError:
+        return _json_error("'limit' must be an integer")
+    if limit <= 0:
+        return _json_error("'limit' must be positive")
+    limit = min(limit, getattr(settings, "KG_SUGGEST_MAX_LIMIT", 100))
+    return JsonResponse({"ret": 0, "data": suggest(prefix, domain, limit)})
+
+
 @csrf_exempt
 @require_http_methods(["GET", "PUT", "PATCH", "DELETE"])
 def entity_detail(request, entity_id: str):
@@ -185,6 +458,65 @@ def entity_detail(request, entity_id: str):
     })
 
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def entity_neighborhood(request, entity_id: str):
+    """k 跳邻域子图：/api/kg/entities/<id>/neighborhood?hops=&direction=&types=&limit=&fanout="""
+    if not Entity.objects.filter(id=entity_id).exists():
+        return _json_error("entity not found")
+
+    direction = request.GET.get("direction", "both")
+    if direction not in NEIGHBORHOOD_DIRECTIONS:
+        return _json_error("'direction' must be one of in, out, both")
+    types = [t for t in request.GET.get("types", "").split(",") if t.strip()]
+    try:
+        hops = int(request.GET.get("hops", 1))
+        limit = int(request.GET["limit"]) if request.GET.get("limit") else None
+        fanout = int(request.GET["fanout"]) if request.GET.get("fanout") else None
+    except ValueError:
+        return _json_error("'hops', 'limit' and 'fanout' must be integers")
+    max_hops = getattr(settings, "KG_NEIGHBORHOOD_MAX_HOPS", 4)
+    if not 1 <= hops <= max_hops:
+        return _json_error(f"'hops' must be between 1 and {max_hops}")
+    if (limit is not None and limit <= 0) or (fanout is not None and fanout <= 0):
+        return _json_error("'limit' and 'fanout' must be positive")
+
+    data = neighborhood(entity_id, hops=hops, direction=direction, types=[t.strip() for t in types],
+                        limit=limit, fanout=fanout)
+    return JsonResponse({"ret": 0, "data": data})
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def entity_path(request):
+    """两个实体之间的路径：/api/kg/path?from=&to=&max_hops=&types=&k=&direction=&domain="""
+    from_id, to_id = request.GET.get("from"), request.GET.get("to")
+    if not from_id or not to_id:
+        return _json_error("'from' and 'to' are required")
+    direction = request.GET.get("direction", "both")
+    if direction not in PATH_DIRECTIONS:
+        return _json_error("'direction' must be one of in, out, both")
+    types = [t.strip() for t in request.GET.get("types", "").split(",") if t.strip()]
+    try:
+        max_hops = int(request.GET.get("max_hops", 6))
+        k = int(request.GET.get("k", 1))
+    except ValueError:
+        return _json_error("'max_hops' and 'k' must be integers")
+    hops_limit = getattr(settings, "KG_PATH_MAX_HOPS", 10)
+    if not 1 <= max_hops <= hops_limit:
+        return _json_error(f"'max_hops' must be between 1 and {hops_limit}")
+    k_limit = getattr(settings, "KG_PATH_MAX_K", 20)
+    if not 1 <= k <= k_limit:
+        return _json_error(f"'k' must be between 1 and {k_limit}")
+
+    try:
+        data = find_paths(from_id, to_id, domain=request.GET.get("domain", ALL_DOMAINS), max_hops=max_hops,
+                          direction=direction, types=types or None, k=k)
+    except PathError as e:
+        return _json_error(str(e))
+    return JsonResponse({"ret": 0, "data": data})
+
+
 # -----------------------------
 # Relationship CRUD
 # -----------------------------
@@ -205,6 +537,29 @@ def list_or_create_relationships(request):
         if rel_type:
             qs = qs.filter(type__icontains=rel_type)
 
+        if is_paginated(request):
+            try:
+                rows, after = relationship_page(
+                    qs.values("id", "source_id", "target_id", "type", "description", "domain"),
+                    read_after(cursor_state(request), "relationship"),
+                    parse_limit(request)
+                )
+            except PaginationError as e:
+                return _json_error(str(e))
+            data = [
+                {
+                    "id": r["id"],
+                    "source": r["source_id"],
+                    "target": r["target_id"],
+                    "type": r["type"],
+                    "description": r["description"],
+                    "domain": r["domain"],
+                }
+                for r in rows
+            ]
+            next_cursor = encode_cursor({"k": "relationship", "after": after}) if after is not None else None
+            return JsonResponse({"ret": 0, "data": data, "next_cursor": next_cursor})
+
         data = [
             {
                 "id": r.id,
@@ -323,53 +678,101 @@ def relationship_detail(request, rel_id: int):
     return JsonResponse({"ret": 0, "msg": "deleted"})
 
 
+# -----------------------------
+# Change feed (delta sync)
+# -----------------------------
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def graph_changes(request):
+    """
+    增量同步：返回 since 之后的压缩变更。
+
+    不带 since 时只返回当前的 last_seq，客户端应在加载完整图谱之前调用一次。
+    """
+    domain = request.GET.get("domain", ALL_DOMAINS)
+    since = request.GET.get("since")
+    if since is None or since == "":
+        return JsonResponse({"ret": 0, "data": {"last_seq": changefeed.head_seq()}})
+    try:
+        since = int(since)
+    except ValueError:
+        return _json_error("'since' must be an integer")
+    if since < 0:
+        return _json_error("'since' must not be negative")
+    return JsonResponse({"ret": 0, "data": changefeed.changes_since(since, domain), "domain": domain})
+
+
 # -----------------------------
 # Import / Export
 # -----------------------------
 
 @csrf_exempt
 @require_http_methods(["GET"])
+@condition(etag_func=_graph_etag)
 def export_graph(request):
     # 获取领域参数，默认为all（导出所有领域）
     domain = request.GET.get('domain', 'all')
-    
-    if domain == 'all':
-        entities = list(Entity.objects.all().values("id", "name", "type", "description", "domain"))
-        links = [
-            {
-                "id": r.id,
-                "source": r.source_id,
-                "target": r.target_id,
-                "type": r.type,
-                "description": r.description,
-            }
-            for r in Relationship.objects.all()
-        ]
-    else:
-        entities = list(Entity.objects.filter(domain=domain).values("id", "name", "type", "description", "domain"))
-        links = [
-            {
-                "id": r.id,
-                "source": r.source_id,
-                "target": r.target_id,
-                "type": r.type,
-                "description": r.description,
-            }
-            for r in Relationship.objects.filter(domain=domain)
-        ]
-    return JsonResponse({
+    fmt = request.GET.get('format', 'json')
+    if _is_truthy(request.GET.get('async')):
+        # 后台导出：立即返回任务 ID，完成后从任务的 download_url 下载
+        if fmt != 'json':
+            return _json_error(f"Unsupported format for async export: {fmt}")
+        return _job_accepted(jobs.submit(GraphJob.KIND_EXPORT, domain, {"format": fmt}))
+    if fmt == 'columnar':
+        return _columnar_snapshot(request, domain)
+    if fmt in EXPORTERS:
+        return _streaming_export(request, domain, fmt)
+    if fmt != 'json':
+        return _json_error(f"Unsupported format: {fmt}")
+    return _cached_snapshot(request, domain, "export", lambda: _build_export(domain))
+
+
+def _streaming_export(request, domain, fmt):
+    """
+    NDJSON / CSV / GraphML 流式导出（不经过快照缓存），gzip=1 时边读边压缩。
+    ndjson 与 csv 一次导出一张表，由 table=entities / relationships 指定。
+    """
+    try:
+        exporter = EXPORTERS[fmt](domain, request.GET.get('table'))
+    except ExportError as e:
+        return _json_error(str(e))
+    chunks, filename, content_type = iter(exporter), exporter.filename, exporter.content_type
+    if _is_truthy(request.GET.get('gzip')):
+        chunks, filename, content_type = gzip_stream(chunks), filename + ".gz", "application/gzip"
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    return response
+
+
+def _build_export(domain):
+    entities = Entity.objects.all()
+    relations = Relationship.objects.all()
+    if domain != 'all':
+        entities = entities.filter(domain=domain)
+        relations = relations.filter(domain=domain)
+    entities = list(entities.values("id", "name", "type", "description", "domain"))
+    # 只取需要的列，不构造模型实例
+    links = [
+        {"id": rel_id, "source": source, "target": target, "type": rel_type, "description": description}
+        for rel_id, source, target, rel_type, description in relations.values_list(
+            "id", "source_id", "target_id", "type", "description"
+        ).iterator(chunk_size=get_chunk_size())
+    ]
+    return {
         "ret": 0, 
         "data": {
             "nodes": entities, 
             "links": links
         },
         "domain": domain
-    })
+    }
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 @transaction.atomic
+@coalesce_writes()
 def import_graph(request):
     """
     改进的数据导入函数，支持：
@@ -377,6 +780,9 @@ def import_graph(request):
     2. ID冲突解决（自动生成新ID或合并数据）
     3. 详细的导入报告
     4. 数据合并策略
+
+    ?async=1 时作为后台任务执行并立即返回任务 ID。后台导入每批单独提交，
+    失败时已提交的批次不会回滚（同步导入在一个事务中完成）。
     """
     try:
         payload = json.loads(request.body or b"{}")
@@ -392,178 +798,14 @@ def import_graph(request):
     if not isinstance(nodes, list) or not isinstance(links, list):
         return _json_error("'nodes' and 'links' must be arrays")
 
-    # 导入统计
-    import_stats = {
-        "entities": {"created": 0, "updated": 0, "skipped": 0, "conflicts": 0, "errors": 0},
-        "relationships": {"created": 0, "skipped": 0, "errors": 0},
-        "conflicts": []
-    }
-
-    # 处理实体导入
-    entity_id_mapping = {}  # 用于记录ID映射关系
-    
-    for node in nodes:
-        node_id = node.get("id")
-        name = node.get("name")
-        
-        if not node_id or not name:
-            import_stats["entities"]["errors"] += 1
-            continue
-
-        try:
-            # 检查是否存在相同ID的实体
-            existing_entity = Entity.objects.filter(id=node_id).first()
-            
-            if existing_entity:
-                # 处理冲突
-                if conflict_resolution == "skip":
-                    import_stats["entities"]["skipped"] += 1
-                    entity_id_mapping[node_id] = node_id
-                    continue
-                elif conflict_resolution == "merge_data":
-                    # 合并数据：保留现有数据，补充缺失字段
-                    updated = False
-                    if not existing_entity.type and node.get("type"):
-                        existing_entity.type = node.get("type")
-                        updated = True
-                    if not existing_entity.description and node.get("description"):
-                        existing_entity.description = node.get("description")
-                        updated = True
-                    if updated:
-                        existing_entity.save()
-                        import_stats["entities"]["updated"] += 1
-                    else:
-                        import_stats["entities"]["skipped"] += 1
-                    entity_id_mapping[node_id] = node_id
-                    continue
-                elif conflict_resolution == "auto_id":
-                    # 自动生成新ID
-                    import_stats["entities"]["conflicts"] += 1
-                    import_stats["conflicts"].append({
-                        "type": "entity_id_conflict",
-                        "original_id": node_id,
-                        "message": f"Entity ID '{node_id}' already exists, will generate new ID"
-                    })
-                    
-                    # 生成新ID
-                    counter = 1
-                    new_id = f"{node_id}_{counter}"
-                    while Entity.objects.filter(id=new_id).exists():
-                        counter += 1
-                        new_id = f"{node_id}_{counter}"
-                    
-                    # 创建新实体
-                    new_entity = Entity.objects.create(
-                        id=new_id,
-                        name=name,
-                        type=node.get("type", ""),
-                        description=node.get("description", ""),
-                        domain=node.get("domain", domain)
-                    )
-                    entity_id_mapping[node_id] = new_id
-                    import_stats["entities"]["created"] += 1
-                    continue
-            else:
-                # 创建新实体
-                try:
-                    Entity.objects.create(
-                        id=node_id,
-                        name=name,
-                        type=node.get("type", ""),
-                        description=node.get("description", ""),
-                        domain=node.get("domain", domain)
-                    )
-                    entity_id_mapping[node_id] = node_id
-                    import_stats["entities"]["created"] += 1
-                except Exception as e:
-                    # 如果创建失败，可能是并发问题，尝试获取现有实体
-                    existing_entity = Entity.objects.filter(id=node_id).first()
-                    if existing_entity:
-                        entity_id_mapping[node_id] = node_id
-                        import_stats["entities"]["skipped"] += 1
-                    else:
-                        import_stats["entities"]["errors"] += 1
-                        import_stats["conflicts"].append({
-                            "type": "entity_creation_error",
-                            "entity_id": node_id,
-                            "message": str(e)
-                        })
-                
-        except Exception as e:
-            import_stats["entities"]["errors"] += 1
-            import_stats["conflicts"].append({
-                "type": "entity_creation_error",
-                "entity_id": node_id,
-                "message": str(e)
-            })
+    if _is_truthy(request.GET.get("async")):
+        params = {"strategy": import_strategy, "conflict_resolution": conflict_resolution}
+        return _job_accepted(jobs.submit(GraphJob.KIND_IMPORT, domain, params, {"nodes": nodes, "links": links}))
 
-    # 处理关系导入
-    for link in links:
-        source = link.get("source")
-        target = link.get("target")
-        rel_type = link.get("type")
-        description = link.get("description", "")
-        
-        if not source or not target or not rel_type:
-            import_stats["relationships"]["errors"] += 1
-            continue
-            
-        if source == target:
-            import_stats["relationships"]["errors"] += 1
-            continue
-
-        try:
-            # 使用映射后的ID
-            mapped_source = entity_id_mapping.get(source)
-            mapped_target = entity_id_mapping.get(target)
-            
-            if not mapped_source or not mapped_target:
-                import_stats["relationships"]["errors"] += 1
-                continue
-
-            src = Entity.objects.get(id=mapped_source)
-            tgt = Entity.objects.get(id=mapped_target)
-            
-            # 检查关系是否已存在
-            existing_rel = Relationship.objects.filter(
-                source=src, target=tgt, type=rel_type
-            ).first()
-            
-            if existing_rel:
-                if import_strategy == "skip":
-                    import_stats["relationships"]["skipped"] += 1
-                elif import_strategy == "merge":
-                    # 合并关系描述
-                    if not existing_rel.description and description:
-                        existing_rel.description = description
-                        existing_rel.save()
-                        import_stats["relationships"]["created"] += 1  # 算作更新
-                    else:
-                        import_stats["relationships"]["skipped"] += 1
-            else:
-                # 创建新关系
-                Relationship.objects.create(
-                    source=src, target=tgt, type=rel_type, 
-                    description=description, domain=link.get("domain", domain)
-                )
-                import_stats["relationships"]["created"] += 1
-                
-        except Entity.DoesNotExist:
-            import_stats["relationships"]["errors"] += 1
-            import_stats["conflicts"].append({
-                "type": "relationship_entity_not_found",
-                "source": source,
-                "target": target,
-                "message": "Source or target entity not found"
-            })
-        except Exception as e:
-            import_stats["relationships"]["errors"] += 1
-            import_stats["conflicts"].append({
-                "type": "relationship_creation_error",
-                "source": source,
-                "target": target,
-                "message": str(e)
-            })
+    # 冲突处理与 ID 分配在内存中完成，实体/关系分批批量写入
+    import_stats, entity_id_mapping = GraphImporter(
+        domain=domain, strategy=import_strategy, conflict_resolution=conflict_resolution
+    ).run(nodes, links)
 
     return JsonResponse({
         "ret": 0, 
@@ -578,6 +820,77 @@ def import_graph(request):
     })
 
 
+def _job_accepted(job):
+    response = JsonResponse({
+        "ret": 0,
+        "msg": "job queued",
+        "data": {"job_id": job.pk, "status_url": reverse("job_detail", args=[job.pk])}
+    }, status=202)
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def job_detail(request, job_id: str):
+    """后台任务的状态、进度、吞吐量与最终报告"""
+    try:
+        job = GraphJob.objects.get(pk=job_id)
+    except GraphJob.DoesNotExist:
+        return _json_error("job not found")
+    return JsonResponse({"ret": 0, "data": jobs.job_status(jobs.recover(job))})
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def job_download(request, job_id: str):
+    """下载后台导出任务生成的文件"""
+    try:
+        job = GraphJob.objects.get(pk=job_id, kind=GraphJob.KIND_EXPORT)
+    except GraphJob.DoesNotExist:
+        return _json_error("job not found")
+    if job.status != GraphJob.STATUS_SUCCEEDED:
+        return _json_error(f"export is {job.status}")
+    try:
+        f = open(job.result_file, "rb")
+    except FileNotFoundError:
+        return _json_error("export file no longer exists")
+    return FileResponse(f, as_attachment=True, filename=f"kg-export-{job.domain}.json",
+                        content_type="application/json")
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def graph_snapshot(request):
+    """
+    二进制快照（格式见 snapshot 模块）。
+    GET ?domain= 下载领域（默认全部）的快照；POST 上传快照（multipart 的 file 字段
+    或请求体）恢复，替换快照所属领域的现有数据。
+    """
+    if request.method == "GET":
+        domain = request.GET.get("domain", "all")
+        # np.savez 需要可随机访问的文件，先写入临时文件再发送
+        f = tempfile.TemporaryFile()
+        try:
+            save_snapshot(f, domain)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(0)
+        return FileResponse(f, as_attachment=True, filename=f"kg-{domain}.npz", content_type="application/octet-stream")
+
+    upload = request.FILES.get("file") or io.BytesIO(request.body)
+    try:
+        header, counts = load_snapshot(upload)
+    except SnapshotError as e:
+        return _json_error(str(e))
+    return JsonResponse({
+        "ret": 0,
+        "msg": "snapshot restored",
+        "data": {"domain": header["domain"], "graph_version": header["graph_version"], **counts}
+    })
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def ai_chat(request):
@@ -895,6 +1208,13 @@ def generate_ai_response(user_message, graph_data, current_domain, selected_node
         return generate_local_ai_response(user_message, graph_data, current_domain, selected_node, selected_link)
 
 
+def _link_end_id(end):
+    """D3 连线的端点可能是实体 ID，也可能是（经过 d3.forceLink 处理后的）节点对象"""
+    if isinstance(end, dict):
+        return end.get('id')
+    return end if isinstance(end, str) else None
+
+
 def generate_local_ai_response(user_message, graph_data, current_domain, selected_node, selected_link):
     """本地AI回复（当外部API不可用时）"""
     message = user_message.lower()
@@ -916,6 +1236,15 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
     for link in links:
         rel_type = link.get('type', '未知')
         relation_types[rel_type] = relation_types.get(rel_type, 0) + 1
+
+    # 按实体 ID 建立索引，查找实体与其相关关系时不再逐个扫描 nodes / links
+    node_by_id = {}
+    for node in nodes:
+        node_by_id.setdefault(node.get('id'), node)
+    links_by_entity = {}
+    for link in links:
+        for end in {_link_end_id(link.get('source')), _link_end_id(link.get('target'))} - {None}:
+            links_by_entity.setdefault(end, []).append(link)
     
     # 智能模糊搜索实体 - 支持多种匹配策略
     def smart_search_entities(query):
@@ -1008,7 +1337,7 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
         
         recommendations = []
         for entity_id in list(related_entities)[:max_recommendations]:
-            entity = next((n for n in nodes if n.get('id') == entity_id), None)
+            entity = node_by_id.get(entity_id)
             if entity:
                 recommendations.append(entity)
         
@@ -1016,20 +1345,14 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
     
     # 获取实体的相关关系
     def get_entity_relations(entity_id):
-        return [
-            link for link in links 
-            if (isinstance(link.get('source'), dict) and link['source'].get('id') == entity_id) or
-               (isinstance(link.get('source'), str) and link.get('source') == entity_id) or
-               (isinstance(link.get('target'), dict) and link['target'].get('id') == entity_id) or
-               (isinstance(link.get('target'), str) and link.get('target') == entity_id)
-        ]
+        return links_by_entity.get(entity_id, [])
     
     # 获取实体名称
     def get_entity_name(entity_id):
         if isinstance(entity_id, dict):
             return entity_id.get('name', '')
         else:
-            entity = next((n for n in nodes if n.get('id') == entity_id), None)
+            entity = node_by_id.get(entity_id)
             return entity.get('name', entity_id) if entity else entity_id
     
     # 智能实体查询 - 支持多种查询方式
@@ -1172,7 +1495,7 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
                     entity_activity[node['id']] = len(get_entity_relations(node['id']))
                 
                 most_active = max(entity_activity.items(), key=lambda x: x[1])
-                most_active_entity = next(n for n in nodes if n['id'] == most_active[0])
+                most_active_entity = node_by_id[most_active[0]]
                 return f"⭐ 推荐最活跃实体：{most_active_entity.get('name')} ({most_active[1]} 个关系)"
         
         return "请先选择一个实体，我可以为您推荐相关内容"
@@ -1212,9 +1535,53 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
         
         return response
     
+    def find_payload_path(start_id, goal_id, max_hops=6):
+        """在客户端传来的 links 上广度优先查找最短路径（忽略方向），返回依次经过的关系"""
+        parents = {start_id: None}
+        frontier = [start_id]
+        for _ in range(max_hops):
+            next_frontier = []
+            for entity_id in frontier:
+                for link in get_entity_relations(entity_id):
+                    source, target = _link_end_id(link.get('source')), _link_end_id(link.get('target'))
+                    other = target if source == entity_id else source
+                    if other in parents:
+                        continue
+                    parents[other] = (entity_id, link)
+                    if other == goal_id:
+                        path_links = []
+                        while parents[other]:
+                            other, link = parents[other]
+                            path_links.append(link)
+                        return path_links[::-1]
+                    next_frontier.append(other)
+            frontier = next_frontier
+        return None
+
+    def generate_path_response(start, goal):
+        """生成两个实体之间的最短路径响应"""
+        path_links = find_payload_path(start['id'], goal['id'])
+        if not path_links:
+            return f"❌ 当前图谱中 {start.get('name')} 与 {goal.get('name')} 之间没有 6 跳以内的路径"
+        response = f"🛤️ {start.get('name')} → {goal.get('name')} 的最短路径（{len(path_links)} 跳）：\n\n"
+        for link in path_links:
+            source_name = get_entity_name(link.get('source'))
+            target_name = get_entity_name(link.get('target'))
+            response += f"  • {source_name} --[{link.get('type', '')}]--> {target_name}\n"
+        return response
+
     def handle_path_analysis_query():
         """处理路径分析查询"""
         if selected_node:
+            # 消息中提到了另一个实体时，给出两者之间的最短路径
+            goal = next((
+                node for node in nodes
+                if node.get('id') != selected_node.get('id') and len(node.get('name', '')) > 1
+                and node.get('name', '').lower() in message
+            ), None)
+            if goal:
+                return generate_path_response(selected_node, goal)
+
             related_links = get_entity_relations(selected_node['id'])
             if related_links:
                 response = f"🛤️ {selected_node.get('name')} 的连接路径分析：\n\n"
@@ -1246,6 +1613,10 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
     
     # 智能问答主逻辑
     def smart_qa():
+        # 0. 路径分析（消息中通常带有实体名称，需在实体查询之前处理）
+        if selected_node and any(keyword in message for keyword in ['路径', 'path']):
+            return handle_path_analysis_query()
+
         # 1. 实体查询
         entity_result = handle_entity_query()
         if entity_result:
@@ -1322,6 +1693,7 @@ def generate_local_ai_response(user_message, graph_data, current_domain, selecte
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@coalesce_writes()
 def clear_all_data(request):
     """清空所有数据"""
     try:
@@ -1353,8 +1725,7 @@ def clear_all_data(request):
         }
         
         # 删除所有数据
-        entities.delete()
-        relationships.delete()
+        clear_domain(ALL_DOMAINS)
         
         return JsonResponse({
             "ret": 0,
@@ -1377,6 +1748,7 @@ def clear_all_data(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@coalesce_writes()
 def save_data_mode(request):
     """保存数据模式编辑的数据"""
     try:
@@ -1395,14 +1767,12 @@ def save_data_mode(request):
         if current_domain == "all":
             # 更新所有数据
             print("更新所有领域的数据")
-            Entity.objects.all().delete()
-            Relationship.objects.all().delete()
+            clear_domain(ALL_DOMAINS)
         else:
             # 只更新特定领域的数据
             print(f"只更新领域 '{current_domain}' 的数据")
-            # 删除该领域的实体和关系
-            Entity.objects.filter(domain=current_domain).delete()
-            Relationship.objects.filter(domain=current_domain).delete()
+            # 删除该领域的实体和关系（以及其它领域中指向这些实体的关系）
+            clear_domain(current_domain)
         
         # 保存新数据
         saved_entities = 0
@@ -72,6 +72,14 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': env.db('DATABASE_URL', default=f'sqlite:///{BASE_DIR / "db.sqlite3"}')
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # 后台任务线程与请求并发写入：事务开始即取得写锁，避免先读后写的事务升级锁时
+    # 互相等待而立即报 database is locked；等待锁的时间放宽到 KG_SQLITE_TIMEOUT 秒。
+    # 只读事务用 versioning.read_transaction() 以 DEFERRED 开始，不占用写锁
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': env.int('KG_SQLITE_TIMEOUT', default=30),
+    })
 
 # 密码验证
 AUTH_PASSWORD_VALIDATORS = [
@@ -120,4 +128,54 @@ CHATGPT_BASE_URL = env('CHATGPT_BASE_URL', default='https://api.openai.com/v1/')
 CHATGPT_MODEL = env('CHATGPT_MODEL', default='gpt-3.5-turbo')
 CHATGPT_MAX_TOKENS = env.int('CHATGPT_MAX_TOKENS', default=300)
 CHATGPT_TEMPERATURE = env.float('CHATGPT_TEMPERATURE', default=0.7)
-CHATGPT_USE_OPENAI_LIB = env.bool('CHATGPT_USE_OPENAI_LIB', default=True)
\ No newline at end of file
+CHATGPT_USE_OPENAI_LIB = env.bool('CHATGPT_USE_OPENAI_LIB', default=True)
+
+# 知识图谱大数据量配置
+# 流式输出时每次从数据库读取/输出的行数
+KG_STREAM_CHUNK_SIZE = env.int('KG_STREAM_CHUNK_SIZE', default=2000)
+# 游标分页默认/最大每页条数
+KG_PAGE_DEFAULT_LIMIT = env.int('KG_PAGE_DEFAULT_LIMIT', default=1000)
+KG_PAGE_MAX_LIMIT = env.int('KG_PAGE_MAX_LIMIT', default=10000)
+# 图谱快照缓存：进程内 LRU 条数/总字节上限，共享缓存别名与过期时间（秒）
+KG_SNAPSHOT_CACHE_ENTRIES = env.int('KG_SNAPSHOT_CACHE_ENTRIES', default=32)
+KG_SNAPSHOT_CACHE_MAX_BYTES = env.int('KG_SNAPSHOT_CACHE_MAX_BYTES', default=256 * 1024 * 1024)
+KG_SNAPSHOT_CACHE_ALIAS = env('KG_SNAPSHOT_CACHE_ALIAS', default='default')
+KG_SNAPSHOT_CACHE_TIMEOUT = env.int('KG_SNAPSHOT_CACHE_TIMEOUT', default=3600)
+# 变更日志：单次增量同步最多返回的变更条数（超出则要求整体重新加载），保留条数
+KG_CHANGES_MAX_ROWS = env.int('KG_CHANGES_MAX_ROWS', default=50000)
+KG_CHANGES_RETENTION = env.int('KG_CHANGES_RETENTION', default=100000)
+# k 跳邻域：最大跳数、默认子图节点上限、单节点扩展上限、递归 CTE 行数上限
+KG_NEIGHBORHOOD_MAX_HOPS = env.int('KG_NEIGHBORHOOD_MAX_HOPS', default=4)
+KG_NEIGHBORHOOD_LIMIT = env.int('KG_NEIGHBORHOOD_LIMIT', default=500)
+KG_NEIGHBORHOOD_FANOUT = env.int('KG_NEIGHBORHOOD_FANOUT', default=100)
+KG_NEIGHBORHOOD_MAX_ROWS = env.int('KG_NEIGHBORHOOD_MAX_ROWS', default=20000)
+# 服务端布局：理想边长、冷启动/增量（warm start）迭代次数、请求内同步计算的最大节点数
+KG_LAYOUT_SPACING = env.float('KG_LAYOUT_SPACING', default=200.0)
+KG_LAYOUT_ITERATIONS = env.int('KG_LAYOUT_ITERATIONS', default=200)
+KG_LAYOUT_WARM_ITERATIONS = env.int('KG_LAYOUT_WARM_ITERATIONS', default=40)
+KG_LAYOUT_MAX_SYNC_NODES = env.int('KG_LAYOUT_MAX_SYNC_NODES', default=2000)
+# 社区层次：请求内同步重新计算的最大节点数，更大的领域过期时改为后台任务计算
+KG_COMMUNITIES_MAX_SYNC_NODES = env.int('KG_COMMUNITIES_MAX_SYNC_NODES', default=20000)
+# 视口查询：进程内空间索引缓存的领域数、单次返回的最大节点数
+KG_SPATIAL_INDEX_ENTRIES = env.int('KG_SPATIAL_INDEX_ENTRIES', default=8)
+KG_BBOX_LIMIT = env.int('KG_BBOX_LIMIT', default=5000)
+# 实体关键词检索默认返回条数（最大值同 KG_PAGE_MAX_LIMIT）
+KG_SEARCH_DEFAULT_LIMIT = env.int('KG_SEARCH_DEFAULT_LIMIT', default=50)
+# 前缀补全：进程内索引缓存的领域数、默认/最大返回条数
+KG_SUGGEST_INDEX_ENTRIES = env.int('KG_SUGGEST_INDEX_ENTRIES', default=8)
+KG_SUGGEST_DEFAULT_LIMIT = env.int('KG_SUGGEST_DEFAULT_LIMIT', default=10)
+KG_SUGGEST_MAX_LIMIT = env.int('KG_SUGGEST_MAX_LIMIT', default=100)
+# 图谱导入时 bulk_create / bulk_update 每批写入的行数
+KG_IMPORT_BATCH_SIZE = env.int('KG_IMPORT_BATCH_SIZE', default=1000)
+# 后台导入/导出任务：线程池大小（0 表示在请求线程中同步执行）、导出文件目录、已结束任务的保留时间（秒）
+KG_JOB_WORKERS = env.int('KG_JOB_WORKERS', default=2)
+KG_JOB_DIR = env.str('KG_JOB_DIR', default=str(BASE_DIR / 'jobs'))
+KG_JOB_RETENTION = env.int('KG_JOB_RETENTION', default=86400)
+# 共享图谱镜像：按领域版本号发布的 CSR 图文件目录（同一主机的各进程以 mmap 共享）
+KG_GRAPH_IMAGE_DIR = env.str('KG_GRAPH_IMAGE_DIR', default=str(BASE_DIR / 'graph_images'))
+# 邻接图引擎：进程内增量超过该条数时改为加载新发布的镜像
+KG_GRAPH_ENGINE_MAX_DELTA = env.int('KG_GRAPH_ENGINE_MAX_DELTA', default=50000)
+# 路径查询：最大跳数、最多返回的路径条数、单次查询访问的节点数上限
+KG_PATH_MAX_HOPS = env.int('KG_PATH_MAX_HOPS', default=10)
+KG_PATH_MAX_K = env.int('KG_PATH_MAX_K', default=20)
+KG_PATH_MAX_VISITED = env.int('KG_PATH_MAX_VISITED', default=200000)